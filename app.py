@@ -1,14 +1,30 @@
-from flask import Flask, render_template, request, redirect, url_for
-import json
+from flask import Flask, Response, render_template, request, redirect, url_for
 import os
 from dotenv import load_dotenv
 import uuid
 import threading
 import time
-import bambulabs_api as bl
 from datetime import datetime
-import asyncio
-from kasa import Discover
+from queue_store import create_store
+from blob_store import BLOB_GRACE_SECONDS, BlobStore
+from plate_metadata import InvalidProjectFile, MetadataIndex, find_plate, sliced_plates, validate_plate
+from printer_files import file_digest
+from thumbnails import ThumbnailCache, read_thumbnail
+from forecast import FORECAST_HISTORY, QueueForecaster
+from history import HISTORY_PAGE_SIZE, HistoryStore
+from scheduler import Scheduler
+from telemetry_trace import TRACE_DIR, TraceRecorder
+import metrics
+from metrics import MONITOR_CYCLE_SECONDS, PRINTER_CALL_SECONDS, QUEUE_OPERATION_SECONDS, RESENDS, WEBHOOK_FAILURES
+from queue_model import FLUSH_DELAY_SECONDS, QueueModel
+from queue_changes import QueueChangeLog
+from event_log import EventLog, FAILURE_REASONS
+from event_stream import StatusBroadcaster
+from fan_client import FanGroup, load_fan_groups
+from fan_automation import FanAutomation
+from fleet import BUSY_STATES, FleetDispatcher, load_fleet
+from staging import JobStager
+from leader import SHARED_STATUS_INTERVAL_SECONDS, LeaderElection, SharedStatus
 
 # Load environment variables from a .env file if present
 load_dotenv()
@@ -17,7 +33,6 @@ load_dotenv()
 # This app manages a queue of 3D print jobs and automatically resends print commands
 # when the printer is idle but an item is marked as printing
 
-DATA_FILE = 'queue.json'
 UPLOAD_FOLDER = 'uploads'
 
 # BambuLab printer configuration
@@ -25,327 +40,451 @@ PRINTER_HOSTNAME = "192.168.1.70"
 PRINTER_ACCESS_CODE = "25133451"
 PRINTER_SERIAL = "0309CA4A0800457"
 
+# Multi-worker mode (started through wsgi.py): any number of web workers share
+# the SQLite queue and one of them, elected through a file lock, owns the
+# printers and the monitor loops (see leader.py)
+MULTI_WORKER = os.getenv("MULTI_WORKER") == "1"
+
 # Kasa Fan configuration (values can be overridden by environment variables)
 FAN_HOST = "192.168.1.88"
 FAN_USERNAME = os.getenv("FAN_USERNAME")
 FAN_PASSWORD = os.getenv("FAN_PASSWORD")
 
+# Switch each printer's fans from its telemetry (see fan_automation.py)
+FAN_AUTOMATION = os.getenv("FAN_AUTOMATION") == "1"
+
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-# Global printer instance and connection state
-printer = None
-printer_lock = threading.Lock()
-printer_connected = False
-last_connection_attempt = 0
-connection_retry_interval = 30  # seconds between retry attempts
+# Queue storage backend (SQLite by default, see queue_store.py) and the
+# in-memory queue model every route and the monitor thread work against
+store = create_store()
+if MULTI_WORKER and store.generation() is None:
+    raise ValueError("Multi-worker mode needs the SQLite queue backend")
+# Workers see each other's changes only once written, so write through
+queue_model = QueueModel(store, flush_delay=0 if MULTI_WORKER else FLUSH_DELAY_SECONDS)
 
-def ensure_printer_connection():
-    """Ensure printer is connected, with retry logic"""
-    global printer, printer_connected, last_connection_attempt
-    
-    current_time = time.time()
-    
-    # If we're already connected and the connection is working, return True
-    if printer_connected and printer and printer.mqtt_client_ready():
-        return True
-    
-    # If we recently tried to connect, wait before retrying
-    if current_time - last_connection_attempt < connection_retry_interval:
-        return False
-    
-    last_connection_attempt = current_time
-    
-    try:
-        with printer_lock:
-            # Create new printer instance if needed
-            if printer is None:
-                printer = bl.Printer(PRINTER_HOSTNAME, PRINTER_ACCESS_CODE, PRINTER_SERIAL)
-                print(f"Created new printer instance for {PRINTER_HOSTNAME}")
-            
-            # Try to connect
-            print(f"Attempting to connect to printer at {PRINTER_HOSTNAME}...")
-            printer.connect()
-            time.sleep(2)  # Give connection time to establish
-            
-            # Verify connection
-            if printer.mqtt_client_ready():
-                printer_connected = True
-                print(f"Successfully connected to printer at {PRINTER_HOSTNAME}")
-                return True
-            else:
-                printer_connected = False
-                print(f"Failed to connect to printer at {PRINTER_HOSTNAME} - MQTT client not ready")
-                return False
-                
-    except Exception as e:
-        printer_connected = False
-        print(f"Error connecting to printer at {PRINTER_HOSTNAME}: {e}")
-        return False
+# Which items changed at which queue version, for the JSON queue API's deltas
+# (see queue_changes.py)
+queue_changes = QueueChangeLog(queue_model, shared=MULTI_WORKER)
+
+# Journal of every queue transition; on startup the queue is rebuilt from the
+# last snapshot plus the log tail (see event_log.py)
+event_log = EventLog()
+if not MULTI_WORKER:
+    event_log.attach(queue_model)
+
+# Uploaded files are stored once per content and shared by every item that
+# uses them; reference counts come from the queue (see blob_store.py)
+blob_store = BlobStore(shared=MULTI_WORKER)
+
+# Finished jobs leave the live queue for a separate archive that is paged
+# through by finish time (see history.py)
+history = HistoryStore()
+
+# Plate count, slicer estimates and filament use per file, parsed once per
+# content hash (see plate_metadata.py)
+metadata_index = MetadataIndex()
+
+
+def release_blob(digest):
+    """Drop an item's reference on its file, and the file's metadata with the file"""
+    if blob_store.release(digest):
+        metadata_index.forget(digest)
+
+
+def collect_blobs(grace=0):
+    """Delete the files no item references any more, with their metadata"""
+    for digest in blob_store.rebuild(queue_model.to_list(), grace=grace):
+        metadata_index.forget(digest)
+
+
+if not MULTI_WORKER:
+    collect_blobs()
 
-def get_printer():
-    """Get printer instance, ensuring connection"""
-    global printer
-    with printer_lock:
-        if printer is None:
-            printer = bl.Printer(PRINTER_HOSTNAME, PRINTER_ACCESS_CODE, PRINTER_SERIAL)
-        return printer
+# Plate previews extracted from the archives (see thumbnails.py)
+thumbnail_cache = ThumbnailCache()
+THUMBNAIL_MAX_AGE_SECONDS = 86400
 
-async def get_fan_status():
-    """Get current fan status"""
+# Queue rows rendered with the dashboard; further ones load as requested
+QUEUE_PAGE_SIZE = 100
+
+# Printers pulling jobs from the shared queue: a single printer built from the
+# settings above, or a whole fleet when printers.json exists (see fleet.py).
+# Each printer has its own connection supervisor, pushed telemetry and
+# TTL-cached snapshot; pushed state changes wake its monitor loop immediately.
+printer_nodes = load_fleet(PRINTER_HOSTNAME, PRINTER_ACCESS_CODE, PRINTER_SERIAL)
+dispatcher = FleetDispatcher(printer_nodes, queue_model)
+default_node = dispatcher.default
+
+
+def record_telemetry():
+    """Optionally record every printer's telemetry for replay (see telemetry_trace.py)"""
+    if TRACE_DIR:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        for node in printer_nodes:
+            TraceRecorder(os.path.join(TRACE_DIR, f"{node.name}.trace")).attach(node.telemetry)
+
+
+# Printer and fan status as last published by the leader; until this process
+# is elected, its printer snapshots come from there instead of the printers
+shared_status = SharedStatus()
+if MULTI_WORKER:
+    for node in printer_nodes:
+        node.snapshots.fetch = lambda node=node: shared_status.snapshot(node.name)
+else:
+    record_telemetry()
+
+# Long-lived fan sessions per printer, started on first use: the FAN_HOST fan,
+# or the plugs listed in fans.json (see fan_client.py)
+fan_groups = load_fan_groups(default_node.name, FAN_HOST, FAN_USERNAME, FAN_PASSWORD)
+for name in fan_groups.keys() - dispatcher.by_name.keys():
+    print(f"Ignoring fans for unknown printer {name}")
+fan_automations = []
+if FAN_AUTOMATION:
+    fan_automations = [FanAutomation(node.telemetry, node.snapshot, fan_groups[node.name], node.name)
+                       for node in printer_nodes if node.name in fan_groups]
+
+# The first printer backs the single-printer dashboard
+printer_telemetry = default_node.telemetry
+fan_client = fan_groups.get(default_node.name) or FanGroup([])
+connection_supervisor = default_node.supervisor
+printer_snapshots = default_node.snapshots
+
+MONITOR_POLL_SECONDS = 30  # Fallback poll interval when no push updates arrive
+
+
+def ensure_printer_connection(node=None):
+    """Check whether the printer is connected, never blocks on connecting"""
+    return (node or default_node).is_ready()
+
+
+def get_printer(node=None):
+    """Get the supervised printer instance (None until the first attempt)"""
+    return (node or default_node).printer
+
+
+def mark_printer_failed(node=None):
+    """Ask the supervisor to re-check the connection after a failed call"""
+    (node or default_node).mark_failed()
+
+def get_fan_status():
+    """Get current fan status from the cached fan session"""
+    if MULTI_WORKER and not election.is_leader():
+        return shared_status.fan_status()
     try:
-        fan_device = await Discover.discover_single(
-            host=FAN_HOST,
-            username=FAN_USERNAME, 
-            password=FAN_PASSWORD
-        )
-        if fan_device:
-            # Get the current state of the fan
-            await fan_device.update()
-            return fan_device.is_on
-        return None
+        return fan_client.get_status()
     except Exception as e:
         print(f"Error getting fan status: {e}")
         return None
 
-def get_print_percentage():
+
+def get_printer_snapshot(max_age=None, node=None):
+    """Shared, TTL-cached printer snapshot; concurrent readers wait on one fetch"""
+    return (node or default_node).snapshot(max_age)
+
+
+def get_print_percentage(node=None):
     """Get current print percentage with connection retry"""
-    if not ensure_printer_connection():
-        return None
-    
-    try:
-        printer_instance = get_printer()
-        if printer_instance and printer_instance.mqtt_client_ready():
-            return printer_instance.get_percentage()
-        else:
-            return None
-    except Exception as e:
-        print(f"Error getting print percentage: {e}")
-        # Mark as disconnected on error
-        global printer_connected
-        printer_connected = False
-        return None
+    return get_printer_snapshot(node=node).percentage
+
 
-def get_remaining_time():
+def get_remaining_time(node=None):
     """Get remaining time in seconds with connection retry"""
-    if not ensure_printer_connection():
-        return None
-    
-    try:
-        printer_instance = get_printer()
-        if printer_instance and printer_instance.mqtt_client_ready():
-            return printer_instance.get_time()
-        else:
-            return None
-    except Exception as e:
-        print(f"Error getting remaining time: {e}")
-        # Mark as disconnected on error
-        global printer_connected
-        printer_connected = False
-        return None
+    return get_printer_snapshot(node=node).remaining_time
 
-def get_printer_state():
+
+def get_printer_state(node=None):
     """Get current printer state with connection retry"""
-    if not ensure_printer_connection():
-        return None
-    
-    try:
-        printer_instance = get_printer()
-        if printer_instance and printer_instance.mqtt_client_ready():
-            return printer_instance.get_state()
-        else:
-            return None
-    except Exception as e:
-        print(f"Error getting printer state: {e}")
-        # Mark as disconnected on error
-        global printer_connected
-        printer_connected = False
-        return None
+    return get_printer_snapshot(node=node).state
 
 def load_queue():
-    if not os.path.exists(DATA_FILE):
-        return []
-    with open(DATA_FILE, 'r') as f:
-        return json.load(f)
+    with QUEUE_OPERATION_SECONDS.time(operation='load_queue'):
+        return queue_model.to_list()
 
 
 def save_queue(queue):
-    with open(DATA_FILE, 'w') as f:
-        json.dump(queue, f, indent=2)
+    with QUEUE_OPERATION_SECONDS.time(operation='save_queue'):
+        queue_model.save_all(queue)
+
+
+def get_next_queued_item(node=None):
+    """Get the first item in the queue with 'queued' status that this printer may take"""
+    return dispatcher.next_item(node or default_node)
 
 
-def get_next_queued_item():
-    """Get the first item in the queue with 'queued' status"""
-    queue = load_queue()
-    for item in queue:
-        if item['status'] == 'queued':
-            return item
-    return None
+def is_printing_in_progress(node=None):
+    """Check if an item is currently printing on this printer"""
+    return dispatcher.printing_item(node or default_node) is not None
 
 
-def is_printing_in_progress():
-    """Check if any item is currently printing"""
-    queue = load_queue()
-    return any(item['status'] == 'printing' for item in queue)
+def get_queue_status():
+    """Count queue items by status"""
+    counts = queue_model.count_by_status()
+    printed = history.count_by_status().get('printed', 0)
+    return {
+        # Printed jobs are archived, but still count as they did in the queue
+        'total_items': sum(counts.values()) + printed,
+        'queued': counts.get('queued', 0),
+        'printing': counts.get('printing', 0),
+        'printed': printed
+    }
 
 
-def update_print_status():
+def update_print_status(node=None):
     """Update the status of currently printing items and handle resend scenarios"""
-    queue = load_queue()
+    node = node or default_node
     updated = False
     
     try:
         # Get printer state with connection retry
-        state = get_printer_state()
+        state = get_printer_state(node)
         
         if state is None:
-            print("Unable to get printer state - printer may be disconnected")
+            print(f"Unable to get printer state - printer {node.name} may be disconnected")
             return False
         
+        # The printer took the job, so the next resend starts with a fresh budget
+        if state in BUSY_STATES or state == 'FINISH':
+            node.resends.reset()
+        
         # Check if printer is idle (print finished)
         if state == 'FINISH':
-            # Find any items marked as printing and mark them as printed
-            for item in queue:
-                if item['status'] == 'printing':
-                    item['status'] = 'printed'
-                    item['completed_at'] = datetime.now().isoformat()
-                    updated = True
-                    print(f"Marked {item['original_name']} as completed")
+            # Mark the item printing on this printer as printed
+            item = dispatcher.printing_item(node)
+            if item:
+                queue_model.update(item['id'], reason='finished', status='printed',
+                                   completed_at=datetime.now().isoformat())
+                updated = True
+                print(f"Marked {item['original_name']} as completed")
+                archive_finished()
         
         # Check if printer is printing but no item is marked as printing
         elif state == 'PRINTING':
-            if not is_printing_in_progress():
-                # Find the first queued item and mark it as printing
-                for item in queue:
-                    if item['status'] == 'queued':
-                        item['status'] = 'printing'
-                        item['started_at'] = datetime.now().isoformat()
-                        updated = True
-                        print(f"Marked {item['original_name']} as printing")
-                        break
+            # Mark the first queued item as printing on this printer
+            item = dispatcher.claim_next(node, reason='detected_printing')
+            if item:
+                node.record_job_started(item)
+                updated = True
+                print(f"Marked {item['original_name']} as printing")
         
         # Check if printer is idle but we have an item marked as printing (resend scenario)
         elif state == 'IDLE' or state == 'FAILED':
-            printing_item = next((item for item in queue if item['status'] == 'printing'), None)
-            if printing_item:
+            printing_item = dispatcher.printing_item(node)
+            if printing_item and not node.resends.ready(printing_item['id']):
+                # Still backing off after the last resend
+                pass
+            elif printing_item and node.resends.exhausted(printing_item['id']):
+                print(f"Giving up resending {printing_item['original_name']} after {node.resends.attempts} attempts")
+                # Back to the queue, but no printer takes it before the backoff
+                # is over; it then starts with a fresh budget
+                queue_model.update(printing_item['id'], reason='resend_failed', status='queued',
+                                   retry_at=node.resends.give_up())
+                updated = True
+            elif printing_item:
                 print(f"Printer is idle but {printing_item['original_name']} is marked as printing. Resending print command...")
+                delay = node.resends.record_attempt(printing_item['id'])
                 # Try to resend the print command
-                if resend_print_command(printing_item):
-                    print(f"Successfully resent print command for {printing_item['original_name']}")
+                if resend_print_command(printing_item, node):
+                    RESENDS.inc(printer=node.name, result='sent')
+                    print(f"Successfully resent print command for {printing_item['original_name']} - next resend in {delay:.0f}s at the earliest")
                 else:
+                    RESENDS.inc(printer=node.name, result='failed')
                     print(f"Failed to resend print command for {printing_item['original_name']}")
-                    # Mark as queued again so it can be retried
-                    printing_item['status'] = 'queued'
+                    # Mark as queued again so it can be retried once the backoff is over
+                    queue_model.update(printing_item['id'], reason='resend_failed', status='queued',
+                                       retry_at=node.resends.next_attempt_at)
                     updated = True
         
     except Exception as e:
         print(f"Error updating print status: {e}")
     
-    if updated:
-        save_queue(queue)
-    
     return updated
 
 
-def resend_print_command(item):
+def item_file_path(item):
+    """Local path of an item's uploaded file"""
+    if item.get('blob'):
+        return blob_store.path(item['blob'])
+    # Items queued before the blob store keep their own copy
+    return os.path.join(app.config['UPLOAD_FOLDER'], item['filename'])
+
+
+def item_plate_metadata(item):
+    """Slicer metadata of an item's plate, or None if its file cannot be read"""
+    file_path = item_file_path(item)
+    try:
+        digest = item.get('blob') or file_digest(file_path)
+        return find_plate(metadata_index.get(digest, file_path), item['plate'])
+    except (InvalidProjectFile, OSError) as e:
+        print(f"No plate metadata for {item['original_name']}: {e}")
+        return None
+
+
+def item_print_estimate(item):
+    """Slicer print time estimate of an item's plate in seconds, or None"""
+    metadata = item_plate_metadata(item)
+    return metadata['print_seconds'] if metadata else None
+
+
+def item_filament(item):
+    """(type, colour) of the first filament an item's plate uses, or None"""
+    metadata = item_plate_metadata(item)
+    if not metadata or not metadata['filaments']:
+        return None
+    filament = metadata['filaments'][0]
+    return (filament['type'], filament['color'])
+
+
+# Which queued job a printer takes next: queue order unless QUEUE_POLICY
+# asks for something else (see scheduler.py)
+scheduler = Scheduler(item_print_estimate, item_filament)
+dispatcher.scheduler = scheduler
+
+# Projected start and finish of every queued job (see forecast.py)
+forecaster = QueueForecaster(dispatcher, queue_model, item_print_estimate,
+                             finished=lambda: history.recent(FORECAST_HISTORY, status='printed'))
+
+
+def archive_finished():
+    """Move printed jobs from the live queue into the history archive"""
+    if not queue_model.count_by_status().get('printed'):
+        return 0
+    items = queue_model.list_by_status('printed')
+    for item in items:
+        # Kept with the record: the file may be gone by the time the
+        # forecaster learns from it
+        item['estimated_seconds'] = item_print_estimate(item)
+        item['timeline'] = event_log.timeline(item['id'])
+    # Archived first, so a crash in between leaves a job in both places,
+    # which the next sweep resolves, rather than in neither
+    history.archive(items)
+    for item in items:
+        removed = queue_model.remove(item['id'])
+        if removed and removed.get('blob'):
+            release_blob(removed['blob'])
+    print(f"Archived {len(items)} finished job(s)")
+    return len(items)
+
+
+# Jobs printed before the archive existed move there on startup
+archive_finished()
+
+
+def remote_file_name(item):
+    """Name of an item's file on the printer; derived from its content so a
+    staged upload never overwrites a different file that is currently printing"""
+    return item['filename']
+
+
+# Uploads each printer's next job during the current print (see staging.py)
+stager = JobStager(dispatcher, queue_model, item_file_path, remote_file_name)
+
+
+def send_print_job(node, item):
+    """Upload an item's file to a printer and start it, returns False if the file is missing"""
+    staged = stager.is_staged(item, node)
+    file_path = item_file_path(item)
+    if not staged and not os.path.exists(file_path):
+        print(f"File not found: {file_path}")
+        return False
+    
+    with node.command_lock:
+        printer_instance = get_printer(node)
+        
+        # Upload file if not already on this printer
+        if staged:
+            print(f"{item['original_name']} is already staged on {node.name} - skipping upload")
+        elif not node.files.ensure_uploaded(printer_instance, file_path, remote_file_name(item)):
+            print(f"{item['original_name']} is already on {node.name} - skipping upload")
+        
+        # Start the print
+        plate_number = int(item['plate'])
+        with PRINTER_CALL_SECONDS.time(printer=node.name, call='start_print'):
+            printer_instance.start_print(remote_file_name(item), plate_number=plate_number, use_ams=False, flow_calibration=False)
+    node.snapshots.invalidate()
+    return True
+
+
+def resend_print_command(item, node=None):
     """Resend print command for an item that should be printing but printer is idle"""
-    if not ensure_printer_connection():
+    node = node or default_node
+    if not ensure_printer_connection(node):
         print("Cannot resend print command - printer not connected")
         return False
     
     try:
-        printer_instance = get_printer()
-        
-        # Upload file if not already uploaded
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], item['filename'])
-        if os.path.exists(file_path):
-            with open(file_path, "rb") as f:
-                printer_instance.upload_file(f, item['original_name'])
-            
-            # Start the print
-            plate_number = int(item['plate'])
-            printer_instance.start_print(item['original_name'], plate_number=plate_number, use_ams=False, flow_calibration=False)
-            
-            print(f"Resent print command for {item['original_name']} on plate {plate_number}")
+        if send_print_job(node, item):
+            print(f"Resent print command for {item['original_name']} on plate {item['plate']}")
             return True
-        else:
-            print(f"File not found for resend: {file_path}")
-            return False
+        return False
             
     except Exception as e:
         print(f"Error resending print command: {e}")
-        # Mark as disconnected on error
-        global printer_connected
-        printer_connected = False
+        # Have the supervisor check the connection
+        mark_printer_failed(node)
         return False
 
 
-def start_next_print():
-    """Start printing the next item in the queue"""
-    if is_printing_in_progress():
+def start_next_print(node=None):
+    """Start printing the next item in the queue on a printer"""
+    node = node or default_node
+    if is_printing_in_progress(node):
         print("Print already in progress, skipping...")
         return False
     
-    next_item = get_next_queued_item()
-    if not next_item:
-        print("No items in queue to print")
+    if not ensure_printer_connection(node):
+        print(f"Cannot start print - printer {node.name} not connected")
         return False
     
-    if not ensure_printer_connection():
-        print("Cannot start print - printer not connected")
+    # Claim the job first so no other printer picks it up meanwhile
+    next_item = dispatcher.claim_next(node)
+    if not next_item:
+        print("No items in queue to print")
         return False
     
     try:
-        printer_instance = get_printer()
-        
-        # Upload file if not already uploaded
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], next_item['filename'])
-        if os.path.exists(file_path):
-            with open(file_path, "rb") as f:
-                printer_instance.upload_file(f, next_item['original_name'])
-            
-            # Start the print
-            plate_number = int(next_item['plate'])
-            printer_instance.start_print(next_item['original_name'], plate_number=plate_number, use_ams=False, flow_calibration=False)
-            
-            # Update status in queue
-            queue = load_queue()
-            for item in queue:
-                if item['id'] == next_item['id']:
-                    item['status'] = 'printing'
-                    item['started_at'] = datetime.now().isoformat()
-                    break
-            save_queue(queue)
-            
-            print(f"Started printing {next_item['original_name']} on plate {plate_number}")
+        if send_print_job(node, next_item):
+            node.record_job_started(next_item)
+            print(f"Started printing {next_item['original_name']} on plate {next_item['plate']} ({node.name})")
             return True
-        else:
-            print(f"File not found: {file_path}")
-            return False
             
     except Exception as e:
         print(f"Error starting print: {e}")
-        # Mark as disconnected on error
-        global printer_connected
-        printer_connected = False
-        return False
+        # Have the supervisor check the connection
+        mark_printer_failed(node)
+    
+    # Hand the job back to the queue
+    queue_model.update(next_item['id'], reason='dispatch_failed', status='queued')
+    return False
 
 
-def background_monitor():
-    """Background thread to monitor print status and start new prints"""
-    print("Background monitor started - will retry printer connection every 30 seconds if disconnected")
+def background_monitor(node=None):
+    """Background thread to monitor one printer's status and start new prints"""
+    node = node or default_node
+    print(f"Background monitor started for {node.name} - the connection supervisor reconnects the printer if it drops")
+    node.supervisor.start()
     
     while True:
         try:
-            # Update print status
-            update_print_status()
+            node.wakeup.clear()
             
-            # Start next print if nothing is printing
-            if not is_printing_in_progress():
-                start_next_print()
+            with MONITOR_CYCLE_SECONDS.time(printer=node.name):
+                # Update print status
+                update_print_status(node)
+                
+                # Start next print if nothing is printing (and the printer's
+                # state is known, not stale)
+                if get_printer_state(node) is not None and not is_printing_in_progress(node):
+                    start_next_print(node)
+                
+                # Upload the following job while this one prints
+                stager.maybe_stage(node, get_printer_state(node))
             
-            # Wait before next check
-            time.sleep(30)  # Check every 30 seconds
+            # Wait for a pushed state change, polling as a fallback when the
+            # printer stops pushing updates
+            if node.wakeup.wait(MONITOR_POLL_SECONDS):
+                print(f"Printer {node.name} changed state - checking queue now")
             
         except Exception as e:
             print(f"Error in background monitor: {e}")
@@ -356,160 +495,198 @@ def background_monitor():
 
 @app.route('/')
 def index():
-    queue = load_queue()
+    # Finished prints are archived and lazy-loaded from /api/history, and only
+    # the front of the queue is rendered
+    limit = max(request.args.get('limit', QUEUE_PAGE_SIZE, type=int), 1)
+    with queue_model.lock:
+        active_queue, queue_total = queue_model.page_by_status(ACTIVE_STATUSES, limit=limit)
+        printing_items = queue_model.list_by_status('printing')
+        # The page then follows the queue through /api/queue/changes
+        queue_token = queue_changes.token()
     
-    # Separate active items (queued/printing) from finished items (printed)
-    active_queue = [item for item in queue if item['status'] in ['queued', 'printing']]
-    finished_items = [item for item in queue if item['status'] == 'printed']
+    plate_info = {item['id']: item_plate_metadata(item) for item in active_queue}
+    forecast = forecaster.forecast()
+    eta = {entry['id']: entry for entry in forecast['items']}
     
-    return render_template('index.html', queue=active_queue, finished_items=finished_items)
+    return render_template('index.html', queue=active_queue, queue_total=queue_total, queue_limit=limit,
+                           queue_page_size=QUEUE_PAGE_SIZE, printing_items=printing_items,
+                           queue_token=queue_token, history_page_size=HISTORY_PAGE_SIZE,
+                           printers=[node.name for node in printer_nodes], plate_info=plate_info,
+                           eta=eta, forecast=forecast, policy=scheduler.policy,
+                           error=request.args.get('error'))
 
 
 @app.route('/upload', methods=['POST'])
 def upload():
     file = request.files.get('file')
-    plate = request.form.get('plate')
+    plate = (request.form.get('plate') or '').strip()
+    # "All plates" queues one linked job per sliced plate of the file
+    all_plates = bool(request.form.get('all_plates')) or plate.lower() == 'all'
+    # Optional: only let one printer of the fleet take this job
+    target_printer = request.form.get('printer')
     if not file or not file.filename or not file.filename.endswith('.3mf'):
         return redirect(url_for('index'))
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    filename = f"{uuid.uuid4()}_{file.filename}"
-    file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-    item = {
-        'id': str(uuid.uuid4()),
-        'filename': filename,
-        'original_name': file.filename,
-        'plate': plate,
-        'status': 'queued',
-        'uploaded_at': datetime.now().isoformat()
-    }
-    queue = load_queue()
-    queue.append(item)
-    save_queue(queue)
+    # Hash while streaming to disk; identical files are stored only once
+    digest, size = blob_store.store(file.stream)
+    
+    # Reject plates the file does not have before they reach the printer
+    try:
+        metadata = metadata_index.get(digest, blob_store.path(digest))
+        if all_plates:
+            plates = sliced_plates(metadata)
+            error = None if plates else "The file has no sliced plates - slice and export it first"
+        else:
+            error = validate_plate(metadata, plate)
+            plates = [] if error else [str(int(plate))]
+    except InvalidProjectFile as e:
+        error = str(e)
+    if error:
+        release_blob(digest)
+        return redirect(url_for('index', error=f"{file.filename}: {error}"))
+    
+    # Plates of one file share the blob and the file on the printer, so it is
+    # only uploaded for the first of them
+    group = str(uuid.uuid4()) if len(plates) > 1 else None
+    uploaded_at = datetime.now().isoformat()
+    for number, plate_number in enumerate(plates, start=1):
+        if number > 1:
+            blob_store.acquire(digest)
+        item = {
+            'id': str(uuid.uuid4()),
+            'filename': f"{digest[:12]}_{file.filename}",
+            'blob': digest,
+            'size': size,
+            'original_name': file.filename,
+            'plate': plate_number,
+            'status': 'queued',
+            'uploaded_at': uploaded_at
+        }
+        if group:
+            item.update(group=group, group_index=number, group_size=len(plates))
+        if target_printer in dispatcher.by_name:
+            item['target_printer'] = target_printer
+        queue_model.add(item)
     return redirect(url_for('index'))
 
 
-@app.route('/move/<item_id>/<direction>')
-def move(item_id, direction):
-    queue = load_queue()
-    idx = next((i for i, x in enumerate(queue) if x['id'] == item_id), None)
-    if idx is not None:
-        if direction == 'up' and idx > 0:
-            queue[idx], queue[idx - 1] = queue[idx - 1], queue[idx]
-        elif direction == 'down' and idx < len(queue) - 1:
-            queue[idx], queue[idx + 1] = queue[idx + 1], queue[idx]
-    save_queue(queue)
+def action_response():
+    """Browsers following an action link go back to the dashboard; the
+    dashboard's own requests (POST) get the new queue version instead"""
+    if request.method == 'POST':
+        return {'version': queue_changes.token()}
     return redirect(url_for('index'))
 
 
-@app.route('/start/<item_id>')
+@app.route('/move/<item_id>/<direction>', methods=['GET', 'POST'])
+def move(item_id, direction):
+    # ?before=<id> jumps the item in front of another one in a single step
+    before = request.args.get('before')
+    if before:
+        queue_model.move_before(item_id, before)
+    else:
+        queue_model.swap(item_id, direction)
+    return action_response()
+
+
+@app.route('/pin/<item_id>', methods=['GET', 'POST'])
+def pin(item_id):
+    """Toggle whether a job runs before everything the queue policy would pick"""
+    item = queue_model.get(item_id)
+    if item:
+        queue_model.update(item_id, pinned=not item.get('pinned'))
+    return action_response()
+
+
+@app.route('/start/<item_id>', methods=['GET', 'POST'])
 def start(item_id):
-    queue = load_queue()
-    # Stop any currently printing items
-    for item in queue:
-        if item['status'] == 'printing':
-            item['status'] = 'queued'
-    
-    # Start the selected item
-    for item in queue:
-        if item['id'] == item_id:
-            item['status'] = 'printing'
-            item['started_at'] = datetime.now().isoformat()
-            break
+    item = queue_model.get(item_id)
+    if item is None:
+        return action_response()
+    node = dispatcher.by_name.get(item.get('target_printer'), default_node)
     
-    save_queue(queue)
+    with queue_model.lock:
+        # Stop the item currently printing on that printer
+        printing_item = dispatcher.printing_item(node)
+        if printing_item:
+            queue_model.update(printing_item['id'], reason='manual_start', status='queued')
+        
+        # Start the selected item
+        queue_model.update(item_id, reason='manual_start', status='printing', printer=node.name,
+                           started_at=datetime.now().isoformat())
     
-    # Try to start the print immediately
-    try:
-        start_next_print()
-    except Exception as e:
-        print(f"Error starting print manually: {e}")
+    # Try to start the print immediately; on other workers the leader picks the
+    # change up and sends the job
+    if not MULTI_WORKER or election.is_leader():
+        try:
+            start_next_print(node)
+        except Exception as e:
+            print(f"Error starting print manually: {e}")
     
-    return redirect(url_for('index'))
+    return action_response()
 
 
-@app.route('/finish/<item_id>')
+@app.route('/finish/<item_id>', methods=['GET', 'POST'])
 def finish(item_id):
-    queue = load_queue()
-    for item in queue:
-        if item['id'] == item_id:
-            item['status'] = 'printed'
-            item['completed_at'] = datetime.now().isoformat()
-            break
-    save_queue(queue)
-    return redirect(url_for('index'))
+    queue_model.update(item_id, reason='manual_finish', status='printed',
+                       completed_at=datetime.now().isoformat())
+    archive_finished()
+    return action_response()
 
 
-@app.route('/delete/<item_id>')
+@app.route('/delete/<item_id>', methods=['GET', 'POST'])
 def delete(item_id):
-    queue = load_queue()
-    # Get the item to delete
-    item_to_delete = next((item for item in queue if item['id'] == item_id), None)
-    
+    # Remove the item and get it back so its file can be deleted
+    item_to_delete = queue_model.remove(item_id)
     if item_to_delete:
+        # Deleted jobs stay in the history, as status 'deleted'
+        history.archive([dict(item_to_delete, status='deleted', completed_at=None,
+                              timeline=event_log.timeline(item_id))])
+    
+    if item_to_delete and item_to_delete.get('blob'):
+        # The file goes away with the last item using it
+        release_blob(item_to_delete['blob'])
+    elif item_to_delete:
         # Delete the file if it exists
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], item_to_delete['filename'])
+        file_path = item_file_path(item_to_delete)
         if os.path.exists(file_path):
             try:
                 os.remove(file_path)
             except Exception as e:
                 print(f"Error deleting file {file_path}: {e}")
     
-    queue = [item for item in queue if item['id'] != item_id]
-    save_queue(queue)
-    return redirect(url_for('index'))
+    return action_response()
 
 
-@app.route('/printer_status')
-def printer_status():
-    """API endpoint to get current printer status"""
+def build_printer_status():
+    """Current printer, fan and queue status as sent to the dashboard"""
     try:
-        # Try to ensure connection
-        connection_status = ensure_printer_connection()
+        # One coalesced read of the printer shared with every other caller
+        snapshot = get_printer_snapshot()
         
-        if not connection_status:
+        if not snapshot.connected:
+            # Answer immediately with the last state the printer pushed
             return {
                 'status': 'disconnected',
+                'last_known_state': printer_telemetry.snapshot()['state'],
                 'printer_state': None,
                 'print_percentage': None,
                 'remaining_time': None,
                 'fan_status': None,
-                'queue_status': {
-                    'total_items': len(load_queue()),
-                    'queued': len([item for item in load_queue() if item['status'] == 'queued']),
-                    'printing': len([item for item in load_queue() if item['status'] == 'printing']),
-                    'printed': len([item for item in load_queue() if item['status'] == 'printed'])
-                }
+                'queue_status': get_queue_status(),
+                'queue_version': queue_model.version
             }
         
-        state = get_printer_state()
-        queue = load_queue()
-        
-        # Get additional printer information
-        percentage = get_print_percentage()
-        remaining_time = get_remaining_time()
-        
-        # Get fan status (run async function in sync context)
-        try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            fan_status = loop.run_until_complete(get_fan_status())
-            loop.close()
-        except Exception as e:
-            print(f"Error getting fan status: {e}")
-            fan_status = None
+        # Get fan status (cached, refreshed in the background)
+        fan_status = get_fan_status()
         
         return {
             'status': 'connected',
-            'printer_state': state,
-            'print_percentage': percentage,
-            'remaining_time': remaining_time,
+            'printer_state': snapshot.state,
+            'print_percentage': snapshot.percentage,
+            'remaining_time': snapshot.remaining_time,
             'fan_status': fan_status,
-            'queue_status': {
-                'total_items': len(queue),
-                'queued': len([item for item in queue if item['status'] == 'queued']),
-                'printing': len([item for item in queue if item['status'] == 'printing']),
-                'printed': len([item for item in queue if item['status'] == 'printed'])
-            }
+            'queue_status': get_queue_status(),
+            'queue_version': queue_model.version
         }
     except Exception as e:
         return {
@@ -517,6 +694,218 @@ def printer_status():
             'error': str(e)
         }
 
+
+# One producer shared by every dashboard tab; pushed printer state changes
+# trigger an immediate update
+status_broadcaster = StatusBroadcaster(build_printer_status)
+for node in printer_nodes:
+    node.telemetry.on_state_change(lambda old_state, new_state: status_broadcaster.notify())
+
+
+@app.route('/printer_status')
+def printer_status():
+    """API endpoint to get current printer status"""
+    return build_printer_status()
+
+
+@app.route('/events')
+def events():
+    """Server-Sent Events stream of printer and queue status changes"""
+    if MULTI_WORKER and not request.environ.get('wsgi.multithread'):
+        # A worker serving one request at a time (gunicorn's sync worker) would
+        # be held by the stream until its timeout kills it; 204 makes the
+        # browser close the stream for good and poll /printer_status instead
+        return Response(status=204)
+    return Response(status_broadcaster.stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/thumbnail/<item_id>')
+def thumbnail(item_id):
+    """Plate preview of a job, read from its .3mf"""
+    item = queue_model.get(item_id)
+    if item is None:
+        return 'Not found', 404
+    file_path = item_file_path(item)
+    try:
+        digest = item.get('blob') or file_digest(file_path)
+    except OSError:
+        return 'Not found', 404
+    
+    # The preview only depends on the file content and plate
+    etag = f"{digest}-{item['plate']}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        def load():
+            metadata = item_plate_metadata(item) or {}
+            member = metadata.get('thumbnail') or f"Metadata/plate_{item['plate']}.png"
+            return read_thumbnail(file_path, member)
+        data = thumbnail_cache.get(etag, load)
+        if data is None:
+            return 'Not found', 404
+        response = Response(data, mimetype='image/png')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={THUMBNAIL_MAX_AGE_SECONDS}'
+    return response
+
+
+@app.route('/api/forecast')
+def queue_forecast():
+    """Projected start and finish times for every job and the whole queue
+
+    With ?limit=N only the first N jobs of the queue table are listed.
+    """
+    forecast = forecaster.forecast()
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        shown = {item['id'] for item in queue_model.page_by_status(ACTIVE_STATUSES, limit=max(limit, 0))[0]}
+        forecast = dict(forecast, items=[entry for entry in forecast['items'] if entry['id'] in shown])
+    return forecast
+
+
+ACTIVE_STATUSES = ('queued', 'printing')
+
+
+def queue_entry(item):
+    """Queue item as the JSON queue API sends it, with its plate's slicer summary"""
+    metadata = item_plate_metadata(item) if item['status'] in ACTIVE_STATUSES else None
+    plate = None
+    if metadata:
+        plate = {'print_seconds': metadata['print_seconds'], 'weight_g': metadata.get('weight_g'),
+                 'filaments': [filament['type'] for filament in metadata['filaments']]}
+    return dict(item, plate_meta=plate)
+
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+@app.route('/api/queue')
+def queue_api():
+    """Queued and printing jobs in queue order, tagged with the queue version
+
+    offset and limit select part of the queue; total is the length of all of
+    it. The ETag is the version, so a poll with If-None-Match gets 304 until
+    the queue changes.
+    """
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', type=int)
+    with queue_model.lock:
+        version = queue_changes.token()
+        if version in request.if_none_match:
+            return not_modified(version)
+        items, total = queue_model.page_by_status(ACTIVE_STATUSES, offset, limit)
+    response = app.json.response({'version': version, 'total': total,
+                                  'items': [queue_entry(item) for item in items]})
+    response.set_etag(version)
+    return response
+
+
+@app.route('/api/queue/changes')
+def queue_changes_api():
+    """Jobs changed and removed since the version given as ?since=
+
+    Changed items come in queue order, each with 'before', the id of the item
+    now behind it. When the version is unknown or too old, the whole queue is
+    sent with full set to true. total is the length of the queue and printing
+    lists the printing jobs wherever they are in it.
+    """
+    with queue_model.lock:
+        version = queue_changes.token()
+        if version in request.if_none_match:
+            return not_modified(version)
+        delta = queue_changes.since(request.args.get('since'))
+        if delta is None:
+            items, removed, full = queue_model.list_by_status(*ACTIVE_STATUSES), [], True
+        else:
+            (items, removed), full = delta, False
+        printing = queue_model.list_by_status('printing')
+        total = sum(queue_model.count_by_status().get(status, 0) for status in ACTIVE_STATUSES)
+    response = app.json.response({'version': version, 'full': full, 'removed': removed, 'total': total,
+                                  'items': [queue_entry(item) for item in items],
+                                  'printing': printing})
+    response.set_etag(version)
+    return response
+
+
+@app.route('/api/history')
+def print_history():
+    """Archived jobs, newest first, one page per request
+
+    Filters: since/until (ISO dates, until exclusive), name (substring) and
+    status; pass next_cursor back as cursor for the following page.
+    """
+    try:
+        items, next_cursor = history.page(
+            limit=request.args.get('limit', HISTORY_PAGE_SIZE, type=int),
+            cursor=request.args.get('cursor'),
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+            name=request.args.get('name'),
+            status=request.args.get('status'))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    return {'items': items, 'next_cursor': next_cursor}
+
+
+@app.route('/api/fans')
+def fan_status():
+    """State of every fan plug by printer"""
+    if MULTI_WORKER and not election.is_leader():
+        return shared_status.fans()
+    return {name: group.device_status() for name, group in fan_groups.items()}
+
+
+@app.route('/api/fleet')
+def fleet_status():
+    """Per-printer utilization and queue wait times"""
+    return dispatcher.stats()
+
+
+@app.route('/api/jobs/<item_id>/timeline')
+def job_timeline(item_id):
+    """Status transitions of one job, replayed from the event log"""
+    if MULTI_WORKER and not election.is_leader():
+        event_log.refresh()
+    timeline = event_log.timeline(item_id)
+    if not timeline:
+        # Finished and deleted jobs keep theirs in the history archive
+        archived = history.get(item_id)
+        timeline = archived.get('timeline', []) if archived else []
+    failures = sum(1 for entry in timeline if entry.get('reason') in FAILURE_REASONS)
+    return {'id': item_id, 'timeline': timeline, 'failures': failures}
+
+
+@app.route('/api/jobs/failures')
+def job_failures():
+    """Failed attempts per job still in the queue, replayed from the event log"""
+    if MULTI_WORKER and not election.is_leader():
+        event_log.refresh()
+    return {'failures': event_log.failure_counts()}
+
+def _idle_seconds():
+    """How long each idle printer has been waiting since its last job"""
+    now = time.time()
+    return {(node.name,): now - node.idle_since for node in printer_nodes if node.idle_since is not None}
+
+
+metrics.Gauge('print_queue_items', 'Queue items by status', ['status'],
+              collect=lambda: {(status,): count for status, count in queue_model.count_by_status().items()})
+metrics.Gauge('printer_connected', 'Whether the printer connection is up', ['printer'],
+              collect=lambda: {(node.name,): int(node.supervisor.ready.is_set()) for node in printer_nodes})
+metrics.Gauge('printer_idle_seconds', 'Time since an idle printer finished its last job', ['printer'],
+              collect=_idle_seconds)
+metrics.Gauge('printer_utilization_ratio', 'Share of time the printer was busy since startup', ['printer'],
+              collect=lambda: {(node.name,): node.stats()['utilization'] for node in printer_nodes})
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Metrics in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # --- Webhook endpoint for print failures ---
 @app.route('/webhook/print_failure', methods=['POST'])
 def print_failure_webhook():
@@ -540,15 +929,25 @@ def print_failure_webhook():
                                for val in [event_type, state, status])
 
         if failure_detected:
-            queue = load_queue()
-            updated = False
-            for item in queue:
-                if item['status'] == 'printing':
-                    item['status'] = 'queued'
-                    item['failed_at'] = datetime.now().isoformat()
-                    updated = True
-            if updated:
-                save_queue(queue)
+            # Fleet printers can identify themselves; otherwise every printing job is requeued
+            source = payload.get('printer') or payload.get('serial')
+            nodes = printer_nodes
+            if source:
+                nodes = [node for node in printer_nodes if source in (node.name, node.serial)]
+                if not nodes:
+                    print(f"Print failure webhook for unknown printer {source}")
+                    return {'status': 'error', 'error': f'Unknown printer {source}'}, 404
+            failed = []
+            with queue_model.lock:
+                for node in nodes:
+                    item = dispatcher.printing_item(node)
+                    if item:
+                        queue_model.update(item['id'], reason='failed', status='queued',
+                                           failed_at=datetime.now().isoformat())
+                        failed.append(item)
+            for item in failed:
+                WEBHOOK_FAILURES.inc(printer=item.get('printer') or default_node.name)
+            if failed:
                 print('Current printing job marked as queued after failure')
 
         return {'status': 'ok'}
@@ -557,13 +956,63 @@ def print_failure_webhook():
         return {'status': 'error', 'error': str(e)}, 500
 
 
+def start_monitors():
+    """Start one background monitoring thread per printer, and the fan automation"""
+    for node in printer_nodes:
+        monitor_thread = threading.Thread(target=background_monitor, args=(node,), daemon=True)
+        monitor_thread.start()
+    for automation in fan_automations:
+        automation.start()
+
+
+def lead():
+    """Take over the printers once elected leader (multi-worker mode)
+
+    Runs on the election thread for the life of the process: after starting the
+    monitors it keeps pulling in queue changes from the other workers and
+    publishes printer and fan status for them.
+    """
+    for node in printer_nodes:
+        node.snapshots.fetch = node.fetch_snapshot
+        node.snapshots.invalidate()
+    queue_model.sync()
+    event_log.attach(queue_model, restore=False)
+    collect_blobs(grace=BLOB_GRACE_SECONDS)
+    last_collected = time.time()
+    record_telemetry()
+    start_monitors()
+    
+    while True:
+        try:
+            # Jobs queued, moved or started on other workers get handled right away
+            if queue_model.sync():
+                for node in printer_nodes:
+                    node.wakeup.set()
+            shared_status.publish({node.name: node.snapshot() for node in printer_nodes},
+                                  fan_client.get_status(),
+                                  {name: group.device_status() for name, group in fan_groups.items()})
+            if time.time() - last_collected >= BLOB_GRACE_SECONDS:
+                collect_blobs(grace=BLOB_GRACE_SECONDS)
+                last_collected = time.time()
+        except Exception as e:
+            print(f"Error in leader loop: {e}")
+        time.sleep(SHARED_STATUS_INTERVAL_SECONDS)
+
+
+election = LeaderElection(lead) if MULTI_WORKER else None
+
+if MULTI_WORKER:
+    @app.before_request
+    def sync_queue():
+        """Serve every request from the queue as the other workers left it"""
+        queue_model.sync()
+
+
 if __name__ == '__main__':
-    # Start background monitoring thread
-    monitor_thread = threading.Thread(target=background_monitor, daemon=True)
-    monitor_thread.start()
+    start_monitors()
     
     print("Starting BambuLab Queue Manager...")
-    print(f"Printer: {PRINTER_HOSTNAME}")
+    print(f"Printers: {', '.join(node.hostname for node in printer_nodes)}")
     print("Background monitoring started")
     
     app.run(debug=True, host='0.0.0.0', port=5001)
@@ -0,0 +1,98 @@
+import asyncio
+import time
+import types
+from contextlib import contextmanager
+
+# Virtual time for replaying recorded printer behaviour.
+# A VirtualClock stands in for the `time` module (time, monotonic, sleep) and
+# for asyncio.sleep in the modules it is patched into. Sleeping advances the
+# virtual time instead of waiting, optionally throttled to a fixed speed-up
+# over real time, so hours of printing replay in seconds.
+
+
+class ReplayFinished(BaseException):
+    """Raised from a sleep once the virtual clock passes its stop time
+
+    A BaseException so loops that catch Exception (like monitor_print) end.
+    """
+
+
+class VirtualClock:
+    """Time that only moves when code sleeps or the replay advances it"""
+
+    def __init__(self, start=0.0, speed=None, stop_at=None):
+        self.now = start
+        # None replays as fast as possible, otherwise virtual seconds per real second
+        self.speed = speed
+        self.stop_at = stop_at
+        self.real_start = time.perf_counter()
+        self.virtual_start = start
+        self.sleeps = 0
+
+    # --- time module interface ---
+
+    def time(self):
+        return self.now
+
+    monotonic = time
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def strftime(self, fmt, t=None):
+        return time.strftime(fmt, time.localtime(self.now if t is None else t))
+
+    # --- asyncio interface ---
+
+    async def async_sleep(self, seconds, result=None):
+        self.advance(seconds)
+        # Still yield to the event loop like a real sleep would
+        await asyncio.sleep(0)
+        return result
+
+    # --- Replay control ---
+
+    def advance(self, seconds):
+        """Move virtual time forward, throttled when a speed is set"""
+        self.sleeps += 1
+        self.now += max(0.0, seconds)
+        if self.speed:
+            due = self.real_start + (self.now - self.virtual_start) / self.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        if self.stop_at is not None and self.now >= self.stop_at:
+            raise ReplayFinished()
+
+    def advance_to(self, timestamp):
+        if timestamp > self.now:
+            self.advance(timestamp - self.now)
+
+    def speedup(self):
+        """Virtual seconds replayed per real second so far"""
+        elapsed = time.perf_counter() - self.real_start
+        return (self.now - self.virtual_start) / elapsed if elapsed > 0 else None
+
+    @contextmanager
+    def patch(self, *modules):
+        """Point the modules' `time` and `asyncio` globals at this clock for the with block"""
+        fake_time = types.SimpleNamespace(time=self.time, monotonic=self.monotonic,
+                                          perf_counter=self.perf_counter, sleep=self.sleep,
+                                          strftime=self.strftime, localtime=time.localtime)
+        fake_asyncio = types.SimpleNamespace(**{name: getattr(asyncio, name) for name in dir(asyncio)
+                                                if not name.startswith('__')})
+        fake_asyncio.sleep = self.async_sleep
+        saved = []
+        for module in modules:
+            for name, replacement in (('time', fake_time), ('asyncio', fake_asyncio)):
+                if name in vars(module):
+                    saved.append((module, name, getattr(module, name)))
+                    setattr(module, name, replacement)
+        try:
+            yield self
+        finally:
+            for module, name, original in reversed(saved):
+                setattr(module, name, original)
@@ -0,0 +1,282 @@
+import asyncio
+import random
+import threading
+import time
+
+# In-process stand-ins for a Bambu printer and a Kasa plug.
+# SimulatedPrinter is the machine itself: it runs a small job state machine
+# (IDLE -> PREPARE -> RUNNING -> FINISH) on its own thread and keeps its files
+# and job across reconnects. FakePrinter is the client with the
+# bambulabs_api.Printer interface the app uses; it pushes reports through
+# mqtt_client.on_message_handler like the real client. Latency, failure rate,
+# connection flapping and reports going quiet are configurable and all
+# randomness comes from a seeded generator, so runs are reproducible. install()
+# swaps the fakes in for bambulabs_api.Printer and Kasa discovery.
+
+
+class FakePrinterConfig:
+    """Behaviour of every simulated printer created after install()"""
+
+    def __init__(self, call_latency=0.0, upload_latency=0.0, print_seconds=1.0, prepare_seconds=0.1,
+                 failure_rate=0.0, flap_every=None, flap_seconds=0.0, mute_after=None, tick_seconds=0.05,
+                 seed=0):
+        self.call_latency = call_latency        # Every MQTT read or command
+        self.upload_latency = upload_latency    # Every FTP upload
+        self.print_seconds = print_seconds      # Wall-clock length of one print
+        self.prepare_seconds = prepare_seconds
+        self.failure_rate = failure_rate        # Chance that a command raises
+        self.flap_every = flap_every            # Drop the connection this often (seconds)
+        self.flap_seconds = flap_seconds        # and keep it down this long
+        self.mute_after = mute_after            # Stop pushing reports unasked after this long
+        self.tick_seconds = tick_seconds
+        self.seed = seed
+
+
+class SimulatedPrinter:
+    """One simulated printer, shared by every client connected to its hostname"""
+
+    config = FakePrinterConfig()
+    machines = {}
+    machines_lock = threading.Lock()
+
+    def __init__(self, hostname):
+        self.hostname = hostname
+        self.config = SimulatedPrinter.config
+        self.random = random.Random(f"{self.config.seed}:{hostname}")
+        self.lock = threading.Lock()
+        self.files = {}
+        self.state = 'IDLE'
+        self.percentage = 0
+        self.job_started_at = None
+        self.jobs_finished = 0
+        self.calls = {}
+        self.clients = []
+        self.powered_on_at = time.time()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    @classmethod
+    def get(cls, hostname):
+        with cls.machines_lock:
+            machine = cls.machines.get(hostname)
+            if machine is None:
+                machine = cls.machines[hostname] = cls(hostname)
+            return machine
+
+    def count(self, call):
+        with self.lock:
+            self.calls[call] = self.calls.get(call, 0) + 1
+        if self.config.call_latency:
+            time.sleep(self.config.call_latency)
+
+    def maybe_fail(self, call):
+        if self.config.failure_rate and self.random.random() < self.config.failure_rate:
+            raise ConnectionError(f"Simulated {call} failure on {self.hostname}")
+
+    def link_up(self):
+        """False while a simulated connection drop is in progress"""
+        if not self.config.flap_every:
+            return True
+        period = self.config.flap_every + self.config.flap_seconds
+        return (time.time() - self.powered_on_at) % period < self.config.flap_every
+
+    def muted(self):
+        """True once the printer only reports when asked to"""
+        return self.config.mute_after is not None and time.time() - self.powered_on_at >= self.config.mute_after
+
+    def push(self, requested=False):
+        """Send a report to every connected client"""
+        if not self.link_up() or (self.muted() and not requested):
+            return
+        for client in list(self.clients):
+            handler = client.mqtt_client.on_message_handler
+            if client.connected and handler is not None:
+                handler(client.mqtt_client, None, None, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.config.tick_seconds)
+            self.tick()
+            self.push()
+
+    def tick(self):
+        with self.lock:
+            if self.job_started_at is None:
+                return
+            elapsed = time.time() - self.job_started_at
+            if elapsed < self.config.prepare_seconds:
+                self.state = 'PREPARE'
+            elif elapsed < self.config.prepare_seconds + self.config.print_seconds:
+                self.state = 'RUNNING'
+                self.percentage = int(100 * (elapsed - self.config.prepare_seconds) / self.config.print_seconds)
+            else:
+                self.state = 'FINISH'
+                self.percentage = 100
+                self.job_started_at = None
+                self.jobs_finished += 1
+
+    def remaining_minutes(self):
+        with self.lock:
+            if self.job_started_at is None:
+                return 0
+            left = self.config.prepare_seconds + self.config.print_seconds - (time.time() - self.job_started_at)
+        return max(0, int(left // 60))
+
+    def start_job(self, filename):
+        with self.lock:
+            if filename not in self.files:
+                return False
+            self.state = 'PREPARE'
+            self.percentage = 0
+            self.job_started_at = time.time()
+        self.push()
+        return True
+
+
+class FakeMqttClient:
+    """The part of the MQTT client printer_telemetry reads from"""
+
+    def __init__(self, machine):
+        self.machine = machine
+        self.on_message_handler = None
+
+    def get_printer_state(self):
+        return self.machine.state
+
+    def get_last_print_percentage(self):
+        return self.machine.percentage
+
+    def get_remaining_time(self):
+        return self.machine.remaining_minutes()
+
+    def pushall(self):
+        self.machine.count('pushall')
+        self.machine.push(requested=True)
+
+
+class FakeFtpClient:
+    def __init__(self, machine):
+        self.machine = machine
+
+    def list_directory(self):
+        self.machine.count('list_directory')
+        with self.machine.lock:
+            files = dict(self.machine.files)
+        return '226', [f"-rw-rw-rw- 1 user group {size} Jan 01 00:00 {name}" for name, size in files.items()]
+
+
+class FakePrinter:
+    """Drop-in for bambulabs_api.Printer talking to a SimulatedPrinter"""
+
+    def __init__(self, hostname, access_code=None, serial=None):
+        self.hostname = hostname
+        self.serial = serial
+        self.machine = SimulatedPrinter.get(hostname)
+        self.mqtt_client = FakeMqttClient(self.machine)
+        self.ftp_client = FakeFtpClient(self.machine)
+        self.connected = False
+
+    def connect(self):
+        self.machine.count('connect')
+        self.machine.maybe_fail('connect')
+        self.connected = True
+        self.machine.clients.append(self)
+
+    def disconnect(self):
+        self.machine.count('disconnect')
+        self.connected = False
+        if self in self.machine.clients:
+            self.machine.clients.remove(self)
+
+    def mqtt_client_connected(self):
+        return self.connected and self.machine.link_up()
+
+    def mqtt_client_ready(self):
+        return self.mqtt_client_connected()
+
+    def get_state(self):
+        self.machine.count('get_state')
+        self.machine.maybe_fail('get_state')
+        return self.machine.state
+
+    def get_percentage(self):
+        self.machine.count('get_percentage')
+        return self.machine.percentage
+
+    def get_time(self):
+        self.machine.count('get_time')
+        return self.machine.remaining_minutes()
+
+    def upload_file(self, file, filename="ftp_upload.gcode"):
+        self.machine.count('upload_file')
+        try:
+            data = file.read()
+        finally:
+            file.close()
+        if self.machine.config.upload_latency:
+            time.sleep(self.machine.config.upload_latency)
+        self.machine.maybe_fail('upload_file')
+        with self.machine.lock:
+            self.machine.files[filename] = len(data)
+        return '226 Transfer complete'
+
+    def start_print(self, filename, plate_number, use_ams=True, ams_mapping=None, skip_objects=None,
+                    flow_calibration=True):
+        self.machine.count('start_print')
+        self.machine.maybe_fail('start_print')
+        return self.machine.start_job(filename)
+
+
+class FakeKasaDevice:
+    """Drop-in for a python-kasa plug"""
+
+    instances = []
+
+    def __init__(self, host, latency=0.0):
+        self.host = host
+        self.latency = latency
+        self.is_on = False
+        self.calls = {}
+        FakeKasaDevice.instances.append(self)
+
+    async def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def update(self):
+        await self._call('update')
+
+    async def turn_on(self):
+        await self._call('turn_on')
+        self.is_on = True
+
+    async def turn_off(self):
+        await self._call('turn_off')
+        self.is_on = False
+
+    async def disconnect(self):
+        await self._call('disconnect')
+
+
+def install(printer_config=None, kasa_latency=0.0):
+    """Replace bambulabs_api.Printer and Kasa discovery with the fakes"""
+    import bambulabs_api
+    from kasa import Discover
+
+    if printer_config is not None:
+        SimulatedPrinter.config = printer_config
+    bambulabs_api.Printer = FakePrinter
+
+    async def discover_single(host, **kwargs):
+        return FakeKasaDevice(host, latency=kasa_latency)
+
+    Discover.discover_single = staticmethod(discover_single)
+
+
+def call_counts(instances):
+    """Summed call counts of all simulated printers or plugs"""
+    totals = {}
+    for instance in instances:
+        for name, count in instance.calls.items():
+            totals[name] = totals.get(name, 0) + count
+    return totals
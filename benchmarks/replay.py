@@ -0,0 +1,306 @@
+"""Replay recorded printer telemetry through the fan and monitor logic
+
+Paths: `fan` (the polling FanController.monitor_print of fan_enable.py),
+`automation` (the app's push-driven FanAutomation) and `monitor` (the queue
+app's update/start cycle).
+
+Traces come from a running app with TELEMETRY_TRACE_DIR set, or are
+synthesized. Replay runs on a virtual clock (clock.py), as fast as possible
+or at a fixed --speed (virtual seconds per real second).
+
+    python benchmarks/replay.py                                  # synthesized 10 hour night
+    python benchmarks/replay.py traces/printer.trace --speed 500
+    python benchmarks/replay.py --synthesize night.trace --hours 12 --seed 3
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fakes  # noqa: E402
+from clock import ReplayFinished, VirtualClock  # noqa: E402
+from telemetry_trace import TracePlayer, read_trace, write_trace  # noqa: E402
+
+MONITOR_POLL_SECONDS = 30  # Matches the monitor's fallback poll in app.py
+
+
+def synthesize_night(hours, seed, drop_rate=0.1, start=1_700_000_000.0):
+    """Records of back-to-back prints with idle gaps and occasional dropped jobs"""
+    rng = random.Random(seed)
+    now = start
+    end = start + hours * 3600
+    records = [(now, 'IDLE', 0, 0)]
+    while now < end:
+        now += rng.uniform(60, 600)
+        records.append((now, 'PREPARE', 0, None))
+        now += rng.uniform(120, 300)
+        total_minutes = rng.randint(20, 180)
+        # Some prints drop back to IDLE part way, like a printer losing its job
+        drop_at = rng.randint(1, total_minutes - 1) if rng.random() < drop_rate else None
+        for minute in range(total_minutes):
+            if minute == drop_at:
+                records.append((now, rng.choice(['IDLE', 'FAILED']), 0, 0))
+                break
+            records.append((now, 'RUNNING', int(100 * minute / total_minutes), total_minutes - minute))
+            now += 60
+        else:
+            records.append((now, 'FINISH', 100, 0))
+            now += rng.uniform(30, 120)
+            records.append((now, 'IDLE', 0, 0))
+    return records
+
+
+class ReplayPrinter:
+    """bambulabs_api.Printer stand-in answering from a trace at virtual time"""
+
+    def __init__(self, player, clock):
+        self.player = player
+        self.clock = clock
+        self.mqtt_client = types.SimpleNamespace(on_message_handler=None)
+        self.ftp_client = types.SimpleNamespace(list_directory=lambda: ('226', []))
+        self.commands = []
+
+    def _reading(self):
+        return self.player.at(self.clock.now)
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def mqtt_client_connected(self):
+        return True
+
+    def mqtt_client_ready(self):
+        return True
+
+    def get_state(self):
+        return self._reading()[0]
+
+    def get_percentage(self):
+        return self._reading()[1]
+
+    def get_time(self):
+        return self._reading()[2]
+
+    def upload_file(self, file, filename="ftp_upload.gcode"):
+        file.close()
+        self.commands.append((self.clock.now, 'upload_file', filename))
+        return '226 Transfer complete'
+
+    def start_print(self, filename, plate_number, **kwargs):
+        self.commands.append((self.clock.now, 'start_print', filename))
+        return True
+
+
+class SwitchLog:
+    """Wraps a fake Kasa plug to note when the fan switched, in virtual time"""
+
+    def __init__(self, device, clock):
+        self.device = device
+        self.clock = clock
+        self.switches = []
+
+    def __getattr__(self, name):
+        return getattr(self.device, name)
+
+    async def turn_on(self):
+        self.switches.append((self.clock.now, 'on'))
+        await self.device.turn_on()
+
+    async def turn_off(self):
+        self.switches.append((self.clock.now, 'off'))
+        await self.device.turn_off()
+
+
+def replay_fan(player, speed):
+    """Run FanController.monitor_print over the whole trace"""
+    import fan_enable
+
+    clock = VirtualClock(start=player.start, speed=speed, stop_at=player.end)
+    controller = fan_enable.FanController('replay', 'x', 'x', 'fan', None, None)
+    controller.printer = ReplayPrinter(player, clock)
+    fan = SwitchLog(fakes.FakeKasaDevice('fan'), clock)
+    controller.fan_device = fan
+
+    start = time.perf_counter()
+    with clock.patch(fan_enable), contextlib.redirect_stdout(io.StringIO()):
+        try:
+            asyncio.run(controller.monitor_print())
+        except ReplayFinished:
+            pass
+    elapsed = time.perf_counter() - start
+    return {
+        'virtual_hours': round((clock.now - player.start) / 3600, 2),
+        'real_seconds': round(elapsed, 3),
+        'speedup': round((clock.now - player.start) / elapsed),
+        'loop_iterations': clock.sleeps,
+        'fan_switches': len(fan.switches),
+        'fan_on_minutes': round(on_seconds(fan.switches, clock.now) / 60, 1),
+        'kasa_calls': dict(fan.device.calls)
+    }
+
+
+def replay_fan_automation(player):
+    """Feed the trace to FanAutomation as pushed readings, waking it when it asks to be"""
+    import fan_automation
+    from fan_client import FanDevice, FanGroup
+    from printer_snapshot import PrinterSnapshot
+    from printer_telemetry import PrinterTelemetry
+
+    clock = VirtualClock(start=player.start)
+    telemetry = PrinterTelemetry()
+    # A real fan group whose (already connected) plug logs switches in virtual time
+    device = FanDevice('fan')
+    fan = device.device = SwitchLog(fakes.FakeKasaDevice('fan'), clock)
+    device.is_on = False
+    group = FanGroup([device])
+
+    def read_snapshot():
+        state, percentage, remaining_time = player.at(clock.now)
+        return PrinterSnapshot(True, state, percentage, remaining_time, timestamp=clock.now)
+
+    automation = fan_automation.FanAutomation(telemetry, read_snapshot, group)
+    start = time.perf_counter()
+    with clock.patch(fan_automation), contextlib.redirect_stdout(io.StringIO()):
+        deadline = clock.now + automation.check()
+        for timestamp, *reading in player.records:
+            # Timed wake-ups due before this reading arrives
+            while deadline <= timestamp:
+                clock.advance_to(deadline)
+                deadline = clock.now + automation.check()
+            clock.advance_to(timestamp)
+            telemetry.update(*reading)
+            if automation.wakeup.is_set():
+                automation.wakeup.clear()
+                deadline = clock.now + automation.check()
+    elapsed = time.perf_counter() - start
+    return {
+        'virtual_hours': round((clock.now - player.start) / 3600, 2),
+        'real_seconds': round(elapsed, 3),
+        'checks': automation.checks,
+        # Every call that reached the plug, the group's own update()s included
+        'kasa_calls': dict(fan.device.calls),
+        'fan_switches': len(fan.switches),
+        'fan_on_minutes': round(on_seconds(fan.switches, clock.now) / 60, 1)
+    }
+
+
+def on_seconds(switches, end):
+    total = 0.0
+    on_since = None
+    for timestamp, action in switches:
+        if action == 'on' and on_since is None:
+            on_since = timestamp
+        elif action == 'off' and on_since is not None:
+            total += timestamp - on_since
+            on_since = None
+    if on_since is not None:
+        total += end - on_since
+    return total
+
+
+def replay_monitor(player, speed, jobs):
+    """Drive the monitor's update/start cycle with the trace's printer states
+
+    The trace is fixed, so commands sent to the printer do not change what it
+    reports; this exercises how update_print_status() reacts, e.g. resends.
+    """
+    from run import queue_items
+
+    workdir = tempfile.mkdtemp(prefix='replay_')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    clock = VirtualClock(start=player.start, speed=speed)
+    fakes.install()
+    import bambulabs_api
+    bambulabs_api.Printer = lambda *args, **kwargs: ReplayPrinter(player, clock)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            import app
+            node = app.default_node
+            node.supervisor.wait_ready(10)
+            app.save_queue(queue_items(app, jobs, random.Random(0)))
+
+            # One monitor cycle at every change in the trace, plus the fallback poll
+            times = set(player.change_times())
+            t = player.start
+            while t < player.end:
+                times.add(t)
+                t += MONITOR_POLL_SECONDS
+            start = time.perf_counter()
+            import fleet
+            import printer_snapshot
+            with clock.patch(app, fleet, printer_snapshot):
+                for t in sorted(times):
+                    clock.advance_to(t)
+                    node.snapshots.invalidate()
+                    app.update_print_status(node)
+                    if not app.is_printing_in_progress(node):
+                        app.start_next_print(node)
+            elapsed = time.perf_counter() - start
+        resends = {key[1]: value for key, value in app.metrics.RESENDS.values.items()}
+        commands = node.printer.commands
+        return {
+            'virtual_hours': round((clock.now - player.start) / 3600, 2),
+            'real_seconds': round(elapsed, 3),
+            'speedup': round((clock.now - player.start) / elapsed),
+            'monitor_cycles': len(times),
+            'jobs_printed': app.history.count_by_status().get('printed', 0),
+            'resends': resends,
+            'failed_attempts': sum(app.event_log.failure_counts().values()),
+            'start_print_commands': sum(1 for _, name, _ in commands if name == 'start_print'),
+            'uploads': sum(1 for _, name, _ in commands if name == 'upload_file')
+        }
+    finally:
+        os.chdir(cwd)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('trace', nargs='?', help='Trace to replay (default: a synthesized night)')
+    parser.add_argument('--synthesize', metavar='PATH', help='Write a synthesized trace to PATH and exit')
+    parser.add_argument('--hours', type=float, default=10, help='Length of a synthesized trace')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--speed', type=float, default=None,
+                        help='Virtual seconds per real second (default: as fast as possible)')
+    parser.add_argument('--only', choices=['fan', 'automation', 'monitor'], help='Replay through one path only')
+    parser.add_argument('--jobs', type=int, default=50, help='Queued jobs for the monitor replay')
+    args = parser.parse_args(argv)
+
+    if args.synthesize:
+        records = synthesize_night(args.hours, args.seed)
+        write_trace(args.synthesize, records)
+        print(f"Wrote {len(records)} records ({os.path.getsize(args.synthesize)} bytes) to {args.synthesize}")
+        return
+
+    records = read_trace(args.trace) if args.trace else synthesize_night(args.hours, args.seed)
+    player = TracePlayer(records)
+    results = {'trace': args.trace or f'synthesized {args.hours}h (seed {args.seed})',
+               'records': len(records)}
+    if args.only in (None, 'fan'):
+        results['fan'] = replay_fan(player, args.speed)
+    if args.only in (None, 'automation'):
+        results['automation'] = replay_fan_automation(player)
+    if args.only in (None, 'monitor'):
+        results['monitor'] = replay_monitor(player, args.speed, args.jobs)
+    print(json.dumps(results, indent=2))
+    # Daemon threads (connection supervisor) are left running
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,391 @@
+"""Benchmarks for the print queue with simulated printers and fan plugs
+
+Every scenario runs in its own process and temp directory, with
+bambulabs_api.Printer and Kasa discovery replaced by the fakes in fakes.py.
+
+    python benchmarks/run.py                      # all scenarios
+    python benchmarks/run.py queue_10k flapping   # some of them
+    python benchmarks/run.py --output results.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import uuid
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+FIXTURE = os.path.join(REPO_DIR, 'sigma.3mf')
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fakes  # noqa: E402
+
+
+def percentiles(samples):
+    """Latency summary in milliseconds"""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3)
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'max_ms': round(ordered[-1] * 1000, 3)
+    }
+
+
+def timed(samples, fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    samples.append(time.perf_counter() - start)
+    return result
+
+
+def boot_app(printers=1, printer_config=None, kasa_latency=0.0):
+    """Import the app against fake hardware in the current (temp) directory"""
+    fakes.install(printer_config or fakes.FakePrinterConfig(), kasa_latency=kasa_latency)
+    if printers > 1:
+        with open('printers.json', 'w') as f:
+            json.dump([{'name': f'printer-{i}', 'hostname': f'10.0.0.{i + 1}',
+                        'access_code': 'x', 'serial': f'SERIAL{i}'} for i in range(printers)], f)
+    import app
+    return app
+
+
+def queue_items(app, count, rng):
+    """count queued items all pointing at the fixture blob"""
+    with open(FIXTURE, 'rb') as f:
+        digest, size = app.blob_store.store(f)
+    for _ in range(count - 1):
+        app.blob_store.acquire(digest)
+    now = datetime.now().isoformat()
+    return [{
+        'id': str(uuid.UUID(int=rng.getrandbits(128))),
+        'filename': f"{digest[:12]}_job{i}.3mf",
+        'blob': digest,
+        'size': size,
+        'original_name': f"job{i}.3mf",
+        'plate': '2',
+        'status': 'queued',
+        'uploaded_at': now
+    } for i in range(count)]
+
+
+# --- Scenarios ---
+
+def scenario_queue_10k(args):
+    """Route and queue operation latency with a 10k item queue"""
+    rng = random.Random(args.seed)
+    app = boot_app()
+    client = app.app.test_client()
+    items = queue_items(app, args.items, rng)
+    results = {'items': args.items}
+
+    samples = []
+    timed(samples, app.save_queue, items)
+    results['save_queue'] = percentiles(samples)
+    samples = []
+    timed(samples, app.queue_model.flush)
+    results['store_flush'] = percentiles(samples)
+
+    ops = {
+        'load_queue': lambda: app.load_queue(),
+        'next_item': lambda: app.dispatcher.next_item(app.default_node),
+        'GET /printer_status': lambda: client.get('/printer_status'),
+        'GET /api/forecast': lambda: client.get('/api/forecast'),
+        'GET /metrics': lambda: client.get('/metrics'),
+        'GET /': lambda: client.get('/'),
+    }
+    for name, op in ops.items():
+        samples = []
+        for _ in range(args.iterations):
+            timed(samples, op)
+        results[name] = percentiles(samples)
+
+    # Reorders invalidate the forecast, so time both together
+    moves = []
+    forecasts = []
+    for _ in range(args.iterations):
+        item = items[rng.randrange(len(items))]
+        timed(moves, client.get, f"/move/{item['id']}/top")
+        timed(forecasts, client.get, '/api/forecast')
+    results['GET /move top'] = percentiles(moves)
+    results['GET /api/forecast after move'] = percentiles(forecasts)
+    return results
+
+
+def scenario_dashboard_clients(args):
+    """Many dashboard tabs polling status at once"""
+    config = fakes.FakePrinterConfig(call_latency=args.call_latency, seed=args.seed)
+    app = boot_app(printer_config=config)
+    app.default_node.supervisor.wait_ready(10)
+    client_count = args.clients
+    deadline = time.time() + args.duration
+    latencies = []
+    lock = threading.Lock()
+
+    def dashboard(index):
+        client = app.app.test_client()
+        local = []
+        n = 0
+        while time.time() < deadline:
+            path = '/' if n % 10 == index % 10 else '/printer_status'
+            timed(local, client.get, path)
+            n += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=dashboard, args=(i,)) for i in range(client_count)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    calls = fakes.call_counts(fakes.SimulatedPrinter.machines.values())
+    return {
+        'clients': client_count,
+        'seconds': round(elapsed, 2),
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'latency': percentiles(latencies),
+        'printer_get_state_calls': calls.get('get_state', 0)
+    }
+
+
+def scenario_flapping(args):
+    """Jobs completed by monitor threads while printer connections flap"""
+    config = fakes.FakePrinterConfig(call_latency=args.call_latency, print_seconds=args.print_seconds,
+                                     failure_rate=args.failure_rate, flap_every=args.flap_every,
+                                     flap_seconds=args.flap_seconds, seed=args.seed)
+    app = boot_app(printers=args.printers, printer_config=config)
+    app.MONITOR_POLL_SECONDS = args.poll
+    return run_monitors(app, args)
+
+
+def scenario_stale_reports(args):
+    """Jobs completed by monitor threads when printers stop pushing reports unasked"""
+    config = fakes.FakePrinterConfig(call_latency=args.call_latency, print_seconds=args.print_seconds,
+                                     mute_after=args.stale_after, seed=args.seed)
+    app = boot_app(printers=args.printers, printer_config=config)
+    app.MONITOR_POLL_SECONDS = args.poll
+    import fleet
+    fleet.REPORT_REQUEST_SECONDS = args.stale_after
+    for node in app.printer_nodes:
+        node.telemetry.stale_after = args.stale_after
+    return run_monitors(app, args)
+
+
+def run_monitors(app, args):
+    """Run a monitor thread per printer until args.jobs queued jobs are printed"""
+    rng = random.Random(args.seed)
+    app.save_queue(queue_items(app, args.jobs, rng))
+
+    start = time.time()
+    for node in app.printer_nodes:
+        threading.Thread(target=app.background_monitor, args=(node,), daemon=True).start()
+    deadline = start + args.timeout
+    while time.time() < deadline:
+        if app.history.count_by_status().get('printed', 0) >= args.jobs:
+            break
+        time.sleep(0.05)
+    elapsed = time.time() - start
+    printed = app.history.count_by_status().get('printed', 0)
+    calls = fakes.call_counts(fakes.SimulatedPrinter.machines.values())
+    return {
+        'printers': args.printers,
+        'jobs': args.jobs,
+        'jobs_printed': printed,
+        'seconds': round(elapsed, 2),
+        'jobs_per_minute': round(printed / elapsed * 60, 1),
+        'machine_jobs_finished': sum(m.jobs_finished for m in fakes.SimulatedPrinter.machines.values()),
+        'printer_calls': calls,
+        'monitor_cycle': histogram_summary(app.metrics.MONITOR_CYCLE_SECONDS),
+        'fleet': {node['name']: {'utilization': round(node['utilization'], 3),
+                                 'jobs_started': node['jobs_started']}
+                  for node in app.dispatcher.stats()['printers']}
+    }
+
+
+def histogram_summary(histogram):
+    """Count and mean of a metrics.Histogram over all label sets"""
+    count = 0
+    total = 0.0
+    for _, (_, value_sum, value_count) in histogram.values.items():
+        count += value_count
+        total += value_sum
+    return {'count': count, 'mean_ms': round(total / count * 1000, 3) if count else None}
+
+
+def scenario_fan_monitor(args):
+    """FanController.monitor_print loop throughput against a fake printer and plug"""
+    config = fakes.FakePrinterConfig(call_latency=args.call_latency, print_seconds=args.duration,
+                                     seed=args.seed)
+    fakes.install(config, kasa_latency=args.kasa_latency)
+    import fan_enable
+    fan_enable.CHECK_INTERVAL_SECONDS = 0
+    # setup_printer waits 2s for the first report; the fake reports right away
+    fan_enable.time = types.SimpleNamespace(time=time.time, sleep=lambda seconds: None)
+
+    controller = fan_enable.FanController('10.0.0.1', 'x', 'SERIAL0', '10.0.0.99', None, None)
+    controller.setup_printer()
+    printer = controller.printer
+    with open(FIXTURE, 'rb') as f:
+        printer.upload_file(f, 'fixture.3mf')
+    printer.start_print('fixture.3mf', plate_number=2)
+
+    async def run():
+        await controller.setup_fan()
+        try:
+            await asyncio.wait_for(controller.monitor_print(), args.duration)
+        except asyncio.TimeoutError:
+            pass
+
+    start = time.time()
+    asyncio.run(run())
+    elapsed = time.time() - start
+    printer_calls = fakes.call_counts([printer.machine])
+    kasa_calls = fakes.call_counts(fakes.FakeKasaDevice.instances)
+    iterations = printer_calls.get('get_state', 0)
+    return {
+        'seconds': round(elapsed, 2),
+        'iterations': iterations,
+        'iterations_per_second': round(iterations / elapsed, 1),
+        'kasa_calls': kasa_calls
+    }
+
+
+def scenario_fan_group(args):
+    """Switching a bank of plugs through one FanGroup, all at once versus one by one"""
+    fakes.install(kasa_latency=args.kasa_latency)
+    from fan_client import FanDevice, FanGroup
+
+    group = FanGroup([FanDevice(f'10.0.1.{i}') for i in range(args.fans)])
+    group.start()
+    deadline = time.time() + 10
+    while any(device.is_on is None for device in group.devices) and time.time() < deadline:
+        time.sleep(0.01)
+
+    together = []
+    one_by_one = []
+    for i in range(args.iterations):
+        timed(together, group.switch, i % 2 == 0)
+    for i in range(args.iterations):
+        start = time.perf_counter()
+        for device in group.devices:
+            group.switch_devices([(device, i % 2 == 0)])
+        one_by_one.append(time.perf_counter() - start)
+    return {
+        'fans': args.fans,
+        'kasa_latency_ms': args.kasa_latency * 1000,
+        'together': percentiles(together),
+        'one_by_one': percentiles(one_by_one)
+    }
+
+
+SCENARIOS = {
+    'queue_10k': scenario_queue_10k,
+    'dashboard_clients': scenario_dashboard_clients,
+    'flapping': scenario_flapping,
+    'stale_reports': scenario_stale_reports,
+    'fan_monitor': scenario_fan_monitor,
+    'fan_group': scenario_fan_group,
+}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', nargs='*', help=f"Any of: {', '.join(SCENARIOS)}")
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--items', type=int, default=10000, help='queue_10k: queue length')
+    parser.add_argument('--iterations', type=int, default=20, help='queue_10k: runs per operation')
+    parser.add_argument('--clients', type=int, default=50, help='dashboard_clients: concurrent clients')
+    parser.add_argument('--duration', type=float, default=5, help='Seconds for timed scenarios')
+    parser.add_argument('--call-latency', type=float, default=0.005, help='Simulated printer call latency')
+    parser.add_argument('--kasa-latency', type=float, default=0.005, help='Simulated plug call latency')
+    parser.add_argument('--printers', type=int, default=2, help='flapping: printers in the fleet')
+    parser.add_argument('--fans', type=int, default=8, help='fan_group: plugs in the group')
+    parser.add_argument('--jobs', type=int, default=40, help='flapping: jobs to print')
+    parser.add_argument('--print-seconds', type=float, default=0.3, help='flapping: length of one print')
+    parser.add_argument('--failure-rate', type=float, default=0.02, help='flapping: chance a printer call fails')
+    parser.add_argument('--flap-every', type=float, default=2.0, help='flapping: seconds between drops')
+    parser.add_argument('--flap-seconds', type=float, default=0.5, help='flapping: length of a drop')
+    parser.add_argument('--stale-after', type=float, default=0.5,
+                        help='stale_reports: seconds until printers go quiet and reports count as stale')
+    parser.add_argument('--poll', type=float, default=1.0, help='flapping: monitor fallback poll interval')
+    parser.add_argument('--timeout', type=float, default=120, help='flapping: give up after this long')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--report', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(unknown)}")
+    return args
+
+
+def run_child(args):
+    """Run one scenario in this process, output silenced, result written to --report"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = SCENARIOS[args.child](args)
+    with open(args.report, 'w') as f:
+        json.dump(result, f)
+    # Background threads (monitors, fake printers) are daemons
+    os._exit(0)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv)
+    if args.child:
+        return run_child(args)
+
+    names = args.scenarios or list(SCENARIOS)
+    passthrough = [arg for arg in argv if arg not in SCENARIOS]
+    if '--output' in passthrough:
+        index = passthrough.index('--output')
+        del passthrough[index:index + 2]
+    results = {}
+    for name in names:
+        workdir = tempfile.mkdtemp(prefix=f'bench_{name}_')
+        report = os.path.join(workdir, 'report.json')
+        print(f"Running {name}...", file=sys.stderr)
+        start = time.time()
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name,
+                               '--report', report] + passthrough, cwd=workdir)
+        if proc.returncode == 0 and os.path.exists(report):
+            with open(report) as f:
+                results[name] = json.load(f)
+        else:
+            results[name] = {'error': f'exit code {proc.returncode}'}
+        results[name]['wall_seconds'] = round(time.time() - start, 2)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    config = {key: value for key, value in vars(args).items()
+              if key not in ('scenarios', 'output', 'child', 'report')}
+    output = json.dumps({'config': config, 'results': results}, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
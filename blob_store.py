@@ -0,0 +1,131 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+# Content-addressed storage for uploaded files.
+# Uploads are hashed (SHA-256) while they stream to disk and kept once under
+# their hash, however many queue items use them. Queue items reference a blob
+# by its hash; reference counts are rebuilt from the queue on startup and a
+# blob is deleted when its last item is. When several processes share the
+# folder (multi-worker mode) their counts cannot be trusted, so nothing is
+# deleted on release and the leader collects unreferenced blobs with rebuild().
+
+BLOB_FOLDER = os.getenv("BLOB_FOLDER", os.path.join("uploads", "blobs"))
+CHUNK_SIZE = 1024 * 1024
+# Files younger than this survive rebuild(grace=...) - another process may be
+# uploading them or about to queue an item for them
+BLOB_GRACE_SECONDS = 3600
+
+
+class BlobStore:
+    """Deduplicated file storage keyed by SHA-256"""
+
+    def __init__(self, root=BLOB_FOLDER, extension='.3mf', shared=False):
+        self.root = root
+        self.extension = extension
+        self.shared = shared
+        self.lock = threading.Lock()
+        self.refcounts = {}
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest + self.extension)
+
+    def store(self, stream):
+        """Write a stream into the store and take a reference, returns (digest, size)"""
+        os.makedirs(self.root, exist_ok=True)
+        sha = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    sha.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            digest = sha.hexdigest()
+            path = self.path(digest)
+            with self.lock:
+                if os.path.exists(path):
+                    os.remove(tmp_path)
+                    # Fresh again, so a concurrent rebuild(grace=...) keeps it
+                    os.utime(path)
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(tmp_path, path)
+                self.refcounts[digest] = self.refcounts.get(digest, 0) + 1
+            return digest, size
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def acquire(self, digest):
+        """Take another reference on a stored blob"""
+        with self.lock:
+            self.refcounts[digest] = self.refcounts.get(digest, 0) + 1
+
+    def release(self, digest):
+        """Drop a reference, deleting the blob when nothing uses it any more
+
+        Returns True if the file was removed.
+        """
+        with self.lock:
+            count = self.refcounts.get(digest, 0) - 1
+            if count > 0:
+                self.refcounts[digest] = count
+                return False
+            self.refcounts.pop(digest, None)
+            if self.shared:
+                return False
+            path = self.path(digest)
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"Error deleting blob {path}: {e}")
+                    return False
+            return True
+
+    def rebuild(self, items, grace=0):
+        """Recount references from queue items and drop blobs nobody references
+
+        Files modified within the last grace seconds are kept. Returns the
+        digests of the removed blobs.
+        """
+        cutoff = time.time() - grace
+        counts = {}
+        removed = []
+        for item in items:
+            digest = item.get('blob')
+            if digest:
+                counts[digest] = counts.get(digest, 0) + 1
+        with self.lock:
+            self.refcounts = counts
+            if not os.path.isdir(self.root):
+                return removed
+            for entry in os.listdir(self.root):
+                subdir = os.path.join(self.root, entry)
+                if not os.path.isdir(subdir):
+                    # Leftover temp file from an interrupted upload
+                    if entry.endswith('.tmp') and self._older_than(subdir, cutoff):
+                        os.remove(subdir)
+                    continue
+                for name in os.listdir(subdir):
+                    digest = name[:-len(self.extension)] if name.endswith(self.extension) else name
+                    if digest not in counts and self._older_than(os.path.join(subdir, name), cutoff):
+                        print(f"Removing unreferenced blob {name}")
+                        os.remove(os.path.join(subdir, name))
+                        removed.append(digest)
+        return removed
+
+    @staticmethod
+    def _older_than(path, cutoff):
+        try:
+            return os.path.getmtime(path) < cutoff
+        except OSError:
+            return False
+
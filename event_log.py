@@ -0,0 +1,268 @@
+import json
+import os
+import threading
+import time
+import atexit
+from datetime import datetime
+
+# Append-only journal of queue changes.
+# Every change to the queue model is appended as one JSON line; a background
+# thread fsyncs the log in batches and periodically compacts it into a snapshot
+# (queue contents + the timelines of jobs still in it). On startup the snapshot
+# is loaded and the log tail replayed on top of it, unless the store already
+# holds the result.
+
+EVENT_LOG_FILE = os.getenv("QUEUE_EVENT_LOG", "queue_events.log")
+SNAPSHOT_FILE = os.getenv("QUEUE_SNAPSHOT", "queue_snapshot.json")
+FSYNC_INTERVAL_SECONDS = 0.2    # Group commits: at most this much data is at risk
+SNAPSHOT_EVERY_EVENTS = 1000    # Compact once the log tail has this many events
+SNAPSHOT_INTERVAL_SECONDS = 3600
+
+# Transition reasons that count as a failed attempt for a job
+FAILURE_REASONS = ('failed', 'resend_failed')
+
+
+class EventLog:
+    """Journal for a QueueModel with fsync batching, snapshots and replay"""
+
+    def __init__(self, log_path=EVENT_LOG_FILE, snapshot_path=SNAPSHOT_FILE):
+        self.log_path = log_path
+        self.snapshot_path = snapshot_path
+        self.lock = threading.Lock()
+        self.model = None
+        self.seq = 0
+        self.tail_events = 0
+        self.pending_sync = False
+        self.last_snapshot = time.time()
+        self.timelines = {}
+        self.log_file = None
+        self.stop_event = threading.Event()
+        self.sync_thread = None
+
+    # --- Startup ---
+
+    def attach(self, model, restore=True):
+        """Rebuild the model from snapshot + log tail, then journal its changes
+
+        With restore=False the store stays authoritative (multi-worker mode, where
+        other processes write it too): only the timelines are recovered and the
+        current queue becomes the new snapshot.
+        """
+        self.model = model
+        with model.lock:
+            snapshot = self._read_snapshot()
+            if snapshot is None:
+                # First run with a journal: the store contents become the base snapshot
+                self.log_file = open(self.log_path, 'a')
+                self.compact()
+            elif not restore:
+                self._load_timelines(snapshot)
+                self.log_file = open(self.log_path, 'a')
+                self.compact()
+            elif self._replayed_items(snapshot) == model.to_list():
+                # The store already holds everything the journal does (the usual
+                # case after a clean shutdown), so it is not rewritten
+                self._load_timelines(snapshot)
+                self.log_file = open(self.log_path, 'a')
+            else:
+                self.seq = snapshot['seq']
+                self.timelines = snapshot.get('timelines', {})
+                model.save_all(snapshot['items'])
+                replayed = self._replay_tail()
+                print(f"Recovered queue from {self.snapshot_path} and replayed {replayed} events")
+                self.log_file = open(self.log_path, 'a')
+            model.journal = self
+        self.sync_thread = threading.Thread(target=self._sync_loop, daemon=True)
+        self.sync_thread.start()
+        atexit.register(self.close)
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return None
+        with open(self.snapshot_path, 'r') as f:
+            return json.load(f)
+
+    def _replayed_items(self, snapshot):
+        """The queue the snapshot plus log tail describe, worked out on plain dicts"""
+        items = {item['id']: dict(item) for item in snapshot['items']}
+        for event in self.read_events():
+            if event['seq'] <= snapshot['seq']:
+                continue
+            kind = event['type']
+            if kind == 'add':
+                items[event['item']['id']] = dict(event['item'])
+            elif kind == 'update' and event['id'] in items:
+                items[event['id']].update(event['fields'])
+            elif kind == 'remove':
+                items.pop(event['id'], None)
+            elif kind == 'move' and event['id'] in items:
+                item = items.pop(event['id'])
+                before = event.get('before')
+                if before not in items:
+                    items[item['id']] = item
+                else:
+                    order = list(items.values())
+                    order.insert(list(items).index(before), item)
+                    items = {entry['id']: entry for entry in order}
+            elif kind == 'replace':
+                items = {item['id']: dict(item) for item in event['items']}
+        return list(items.values())
+
+    def _load_timelines(self, snapshot):
+        """Timelines and sequence number from a snapshot plus the log tail, without touching the model"""
+        self.seq = snapshot['seq']
+        self.timelines = snapshot.get('timelines', {})
+        for event in self.read_events():
+            if event['seq'] > self.seq:
+                self.seq = event['seq']
+                self._add_to_timeline(event)
+
+    def refresh(self):
+        """Re-read the timelines another process journals (multi-worker followers)"""
+        snapshot = self._read_snapshot()
+        if snapshot is not None:
+            with self.lock:
+                self._load_timelines(snapshot)
+
+    def _replay_tail(self):
+        replayed = 0
+        for event in self.read_events():
+            # Events already folded into the snapshot can survive a crash mid-compaction
+            if event['seq'] <= self.seq:
+                continue
+            self.seq = event['seq']
+            self.apply(event)
+            self._add_to_timeline(event)
+            replayed += 1
+        self.tail_events = replayed
+        return replayed
+
+    def read_events(self):
+        """Yield the events in the log tail, stopping at a torn final line"""
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, 'r') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    print(f"Ignoring truncated event log entry in {self.log_path}")
+                    return
+
+    def apply(self, event):
+        """Apply one event to the model without journaling it again"""
+        model = self.model
+        kind = event['type']
+        if kind == 'add':
+            model.add(event['item'])
+        elif kind == 'update':
+            model.update(event['id'], **event['fields'])
+        elif kind == 'remove':
+            model.remove(event['id'])
+        elif kind == 'move':
+            model.move_before(event['id'], event.get('before'))
+        elif kind == 'replace':
+            model.save_all(event['items'])
+
+    # --- Recording ---
+
+    def record(self, kind, **data):
+        """Append one event; the caller holds the model lock so events are ordered"""
+        with self.lock:
+            self.seq += 1
+            event = {'seq': self.seq, 'ts': datetime.now().isoformat(), 'type': kind}
+            event.update(data)
+            self.log_file.write(json.dumps(event) + '\n')
+            self.pending_sync = True
+            self.tail_events += 1
+            self._add_to_timeline(event)
+
+    def _add_to_timeline(self, event):
+        kind = event['type']
+        if kind == 'add':
+            entry = {'ts': event['ts'], 'event': 'added', 'to': event['item'].get('status')}
+            self.timelines.setdefault(event['item']['id'], []).append(entry)
+        elif kind == 'update' and 'to' in event:
+            entry = {'ts': event['ts'], 'event': 'status', 'from': event.get('from'),
+                     'to': event['to']}
+            if event.get('reason'):
+                entry['reason'] = event['reason']
+            self.timelines.setdefault(event['id'], []).append(entry)
+        elif kind == 'remove':
+            entry = {'ts': event['ts'], 'event': 'removed'}
+            self.timelines.setdefault(event['id'], []).append(entry)
+
+    # --- Background fsync and compaction ---
+
+    def _sync_loop(self):
+        while not self.stop_event.wait(FSYNC_INTERVAL_SECONDS):
+            try:
+                self.sync()
+                if (self.tail_events >= SNAPSHOT_EVERY_EVENTS or
+                        (self.tail_events and time.time() - self.last_snapshot >= SNAPSHOT_INTERVAL_SECONDS)):
+                    with self.model.lock:
+                        self.compact()
+            except Exception as e:
+                print(f"Error syncing event log: {e}")
+
+    def sync(self):
+        """Flush and fsync everything appended since the last sync"""
+        with self.lock:
+            if not self.pending_sync or self.log_file is None:
+                return
+            self.log_file.flush()
+            os.fsync(self.log_file.fileno())
+            self.pending_sync = False
+
+    def compact(self):
+        """Write a snapshot of the model and start a fresh log (caller holds the model lock)"""
+        with self.lock:
+            items = self.model.to_list()
+            # Jobs that left the queue took their timeline to the history
+            # archive, so it is not carried from snapshot to snapshot
+            live = {item['id'] for item in items}
+            self.timelines = {item_id: entries for item_id, entries in self.timelines.items()
+                              if item_id in live}
+            snapshot = {
+                'seq': self.seq,
+                'created_at': datetime.now().isoformat(),
+                'items': items,
+                'timelines': self.timelines
+            }
+            tmp_path = self.snapshot_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            # Only truncate once the snapshot is durable
+            if self.log_file is not None:
+                self.log_file.close()
+            self.log_file = open(self.log_path, 'w')
+            self.tail_events = 0
+            self.pending_sync = False
+            self.last_snapshot = time.time()
+
+    def close(self):
+        self.stop_event.set()
+        try:
+            self.sync()
+        except Exception as e:
+            print(f"Error syncing event log on shutdown: {e}")
+
+    # --- Replay queries ---
+
+    def timeline(self, item_id):
+        """Status history of one job, oldest first"""
+        with self.lock:
+            return list(self.timelines.get(item_id, []))
+
+    def failure_counts(self):
+        """Number of failed attempts per job id"""
+        with self.lock:
+            counts = {}
+            for item_id, entries in self.timelines.items():
+                failures = sum(1 for entry in entries if entry.get('reason') in FAILURE_REASONS)
+                if failures:
+                    counts[item_id] = failures
+            return counts
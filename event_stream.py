@@ -0,0 +1,95 @@
+import json
+import queue
+import threading
+
+# Server-Sent Events for the dashboard.
+# A single producer thread builds the status payload and pushes it to every
+# connected client only when it changed, so the cost of talking to the printer
+# does not grow with the number of open tabs.
+
+PRODUCER_INTERVAL_SECONDS = 1.0
+KEEPALIVE_SECONDS = 15        # Comment lines keep proxies from closing idle streams
+CLIENT_BUFFER_SIZE = 16       # Slow clients drop stale payloads instead of piling up
+
+
+class StatusBroadcaster:
+    """Shares one status producer between all SSE subscribers"""
+
+    def __init__(self, build_payload, interval=PRODUCER_INTERVAL_SECONDS):
+        self.build_payload = build_payload
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.last_payload = None
+        self.wakeup = threading.Event()
+        self.has_subscribers = threading.Event()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def notify(self):
+        """Rebuild the payload now instead of at the next interval"""
+        self.wakeup.set()
+
+    def subscribe(self):
+        client = queue.Queue(maxsize=CLIENT_BUFFER_SIZE)
+        with self.lock:
+            self.subscribers.add(client)
+            self.has_subscribers.set()
+            # New clients get the current state straight away
+            if self.last_payload is not None:
+                client.put_nowait(self.last_payload)
+        self.start()
+        self.notify()
+        return client
+
+    def unsubscribe(self, client):
+        with self.lock:
+            self.subscribers.discard(client)
+            if not self.subscribers:
+                self.has_subscribers.clear()
+
+    def _run(self):
+        while True:
+            # Nothing is fetched while nobody is listening
+            self.has_subscribers.wait()
+            try:
+                payload = json.dumps(self.build_payload(), sort_keys=True)
+                if payload != self.last_payload:
+                    self.publish(payload)
+            except Exception as e:
+                print(f"Error building status event: {e}")
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def publish(self, payload):
+        with self.lock:
+            self.last_payload = payload
+            for client in self.subscribers:
+                try:
+                    client.put_nowait(payload)
+                except queue.Full:
+                    # Drop the oldest payload; only the latest state matters
+                    try:
+                        client.get_nowait()
+                        client.put_nowait(payload)
+                    except (queue.Empty, queue.Full):
+                        pass
+
+    def stream(self):
+        """Generator of SSE frames for one client"""
+        client = self.subscribe()
+        try:
+            while True:
+                try:
+                    payload = client.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: status\ndata: {payload}\n\n"
+        finally:
+            self.unsubscribe(client)
@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+
+# In-process fan control for the queue app.
+# Instead of a second printer session polled every second (fan_enable.py),
+# the fan follows the app's pushed printer telemetry. Every reading is checked
+# against the switching rule on the spot, and the thread only wakes when the
+# rule says the fan must change or when the remaining time says it soon could,
+# so it sleeps through the hours of a long print. Every plug of the printer's
+# fan group (see fan_client.py) is judged on its own thresholds and state.
+
+# Fan control thresholds (in minutes)
+FAN_ON_THRESHOLD_MINUTES = 2   # Turn fan ON when remaining time is <= 2 minutes
+FAN_OFF_THRESHOLD_MINUTES = 5  # Turn fan OFF again only after time rises above 5 minutes
+
+RUNNING_STATES = ('PRINTING', 'RUNNING')
+STOPPED_STATES = ('IDLE', 'FINISH')
+
+# Wake this long before the remaining time is due to reach the ON threshold
+FAN_WAKE_MARGIN_SECONDS = 30
+FAN_MIN_SLEEP_SECONDS = 5
+# Longest sleep; pushed readings wake the thread earlier whenever they matter
+FAN_MAX_SLEEP_SECONDS = float(os.getenv("FAN_MAX_SLEEP_SECONDS", "600"))
+FAN_RETRY_SECONDS = 30         # After a failed switch
+
+
+def desired_fan_state(state, remaining_time, fan_on, on_minutes=FAN_ON_THRESHOLD_MINUTES,
+                      off_minutes=FAN_OFF_THRESHOLD_MINUTES):
+    """Whether the fan should be on, or None to leave it as it is
+
+    remaining_time is in minutes. Between the two thresholds the fan keeps its
+    current state (hysteresis).
+    """
+    if state in STOPPED_STATES:
+        return False
+    if state not in RUNNING_STATES:
+        return None
+    try:
+        minutes = int(remaining_time)
+    except (TypeError, ValueError):
+        return None
+    if minutes <= on_minutes:
+        return True
+    if minutes > off_minutes:
+        return False
+    return bool(fan_on)
+
+
+def seconds_until_check(state, remaining_time, fan_on, on_minutes=FAN_ON_THRESHOLD_MINUTES):
+    """How long the fan can be left alone, judging by the current reading"""
+    if state not in RUNNING_STATES or fan_on:
+        # Only a state change (which is pushed) can switch the fan now
+        return FAN_MAX_SLEEP_SECONDS
+    try:
+        minutes = int(remaining_time)
+    except (TypeError, ValueError):
+        return FAN_MAX_SLEEP_SECONDS
+    due = (minutes - on_minutes) * 60 - FAN_WAKE_MARGIN_SECONDS
+    return min(max(due, FAN_MIN_SLEEP_SECONDS), FAN_MAX_SLEEP_SECONDS)
+
+
+class FanAutomation:
+    """Switches a printer's FanGroup from its telemetry, sleeping until a decision is due"""
+
+    def __init__(self, telemetry, read_snapshot, fans, name=''):
+        self.read_snapshot = read_snapshot
+        self.fans = fans
+        self.fans.automated = True
+        self.name = name
+        self.wakeup = threading.Event()
+        self.start_lock = threading.Lock()
+        self.thread = None
+        self.next_check_at = None
+        self.checks = 0
+        self.switches = 0
+        telemetry.on_update(self._on_update)
+
+    def start(self):
+        """Start the control thread (safe to call more than once)"""
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _changes(self, state, remaining_time):
+        """(device, on) pairs for the plugs the reading says to switch
+
+        Plugs that are disconnected or backing off are skipped until they are back.
+        """
+        changes = []
+        for device in self.fans.devices:
+            if not device.available():
+                continue
+            desired = desired_fan_state(state, remaining_time, device.is_on, device.on_minutes, device.off_minutes)
+            if desired is not None and desired != bool(device.is_on):
+                changes.append((device, desired))
+        return changes
+
+    def _on_update(self, state, percentage, remaining_time):
+        # Runs on the MQTT thread for every report: only wake the control
+        # thread when the reading actually calls for a switch of a plug that
+        # can take it
+        if self._changes(state, remaining_time):
+            self.wakeup.set()
+
+    def _run(self):
+        print(f"Fan automation started for {self.name} - {len(self.fans.devices)} fan(s) "
+              f"follow the printer's pushed state")
+        while True:
+            try:
+                delay = self.check()
+            except Exception as e:
+                print(f"Error in fan automation: {e}")
+                delay = FAN_RETRY_SECONDS
+            self.wakeup.wait(delay)
+            self.wakeup.clear()
+
+    def check(self):
+        """Apply the switching rule once, returns seconds until the next check"""
+        self.checks += 1
+        snapshot = self.read_snapshot()
+        self.fans.start()
+        changes = self._changes(snapshot.state, snapshot.remaining_time)
+        # All plugs that need it switch at once
+        results = self.fans.switch_devices(changes)
+        for (device, on), result in zip(changes, results):
+            if result is not None:
+                self.switches += 1
+                print(f"Fan {device.host} turned {'ON' if result else 'OFF'} - printer {snapshot.state}, "
+                      f"{snapshot.remaining_time} minutes remaining")
+        delays = [seconds_until_check(snapshot.state, snapshot.remaining_time, device.is_on, device.on_minutes)
+                  for device in self.fans.devices if device.available()]
+        if len(delays) < len(self.fans.devices) or any(result is None for result in results):
+            # Plugs that come back are also picked up by the next pushed reading
+            delays.append(FAN_RETRY_SECONDS)
+        delay = min(delays, default=FAN_MAX_SLEEP_SECONDS)
+        self.next_check_at = time.time() + delay
+        return delay
@@ -0,0 +1,258 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from kasa import Discover
+
+from metrics import FAN_CALL_SECONDS
+from fan_automation import FAN_ON_THRESHOLD_MINUTES, FAN_OFF_THRESHOLD_MINUTES
+
+# Persistent Kasa fan sessions.
+# The device connections live on one long-lived event loop in a background
+# thread. They are refreshed with update() on a schedule, and sync callers read
+# the cached state instead of discovering the plug on every request.
+# A FanGroup drives several plugs (enclosure fans, exhaust) for one printer:
+# commands and refreshes go to all of them at once with asyncio.gather, each
+# under its own timeout, and every plug keeps its own state, thresholds and
+# reconnect backoff. fans.json maps printers to their plugs.
+
+FAN_CONFIG_FILE = os.getenv("FAN_CONFIG", "fans.json")
+REFRESH_INTERVAL_SECONDS = 10
+RECONNECT_MIN_SECONDS = 1
+RECONNECT_MAX_SECONDS = 300
+COMMAND_TIMEOUT_SECONDS = 10
+
+
+class FanDevice:
+    """One Kasa plug: its connection, cached state and switching thresholds"""
+
+    def __init__(self, host, username=None, password=None, on_minutes=FAN_ON_THRESHOLD_MINUTES,
+                 off_minutes=FAN_OFF_THRESHOLD_MINUTES, timeout=COMMAND_TIMEOUT_SECONDS):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.on_minutes = on_minutes
+        self.off_minutes = off_minutes
+        self.timeout = timeout
+        self.device = None
+        self.is_on = None
+        self.updated_at = 0
+        self.backoff = RECONNECT_MIN_SECONDS
+        self.retry_at = 0
+        self.last_error = None
+
+    async def _connect(self):
+        with FAN_CALL_SECONDS.time(call='discover', device=self.host):
+            device = await Discover.discover_single(
+                host=self.host,
+                username=self.username,
+                password=self.password
+            )
+        if device is None:
+            raise ConnectionError(f"No Kasa device found at {self.host}")
+        print(f"Connected to fan at {self.host}")
+        return device
+
+    async def _failed(self, error):
+        """Drop the connection and back off before the next attempt"""
+        print(f"Fan {self.host} error: {error!r} - reconnecting in {self.backoff:.0f}s")
+        self.last_error = repr(error)
+        device, self.device = self.device, None
+        self.is_on = None
+        if device is not None:
+            try:
+                await device.disconnect()
+            except Exception:
+                pass
+        # Exponential backoff with jitter so a dead plug is not hammered
+        self.retry_at = time.time() + self.backoff * random.uniform(0.5, 1.5)
+        self.backoff = min(self.backoff * 2, RECONNECT_MAX_SECONDS)
+
+    def available(self):
+        """Connected and not backing off after an error, so worth switching"""
+        return self.device is not None and time.time() >= self.retry_at
+
+    async def refresh(self):
+        """Connect if needed and re-read the plug's state (skipped while backing off)"""
+        if time.time() < self.retry_at:
+            return self.is_on
+        try:
+            if self.device is None:
+                self.device = await asyncio.wait_for(self._connect(), self.timeout)
+            with FAN_CALL_SECONDS.time(call='update', device=self.host):
+                await asyncio.wait_for(self.device.update(), self.timeout)
+            self.is_on = self.device.is_on
+            self.updated_at = time.time()
+            self.backoff = RECONNECT_MIN_SECONDS
+            self.last_error = None
+        except Exception as e:
+            await self._failed(e)
+        return self.is_on
+
+    async def switch(self, on):
+        """Turn the plug on or off, returns the new state or None on failure
+
+        A plug that is disconnected or backing off is left alone: reconnecting
+        is the refresh loop's job, on its own schedule.
+        """
+        if not self.available():
+            return None
+        try:
+            with FAN_CALL_SECONDS.time(call='turn_on' if on else 'turn_off', device=self.host):
+                await asyncio.wait_for(self.device.turn_on() if on else self.device.turn_off(), self.timeout)
+            with FAN_CALL_SECONDS.time(call='update', device=self.host):
+                await asyncio.wait_for(self.device.update(), self.timeout)
+        except Exception as e:
+            print(f"Error switching fan {self.host} {'on' if on else 'off'}: {e!r}")
+            await self._failed(e)
+            return None
+        self.is_on = self.device.is_on
+        self.updated_at = time.time()
+        return self.is_on
+
+    def status(self):
+        return {'host': self.host, 'on': self.is_on, 'updated_at': self.updated_at,
+                'on_minutes': self.on_minutes, 'off_minutes': self.off_minutes, 'error': self.last_error}
+
+
+class FanGroup:
+    """Kasa plugs switched together from one background event loop thread"""
+
+    def __init__(self, devices, refresh_interval=REFRESH_INTERVAL_SECONDS, name=''):
+        self.devices = list(devices)
+        self.refresh_interval = refresh_interval
+        self.name = name
+        self.loop = None
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.refresh_now = None
+        # Set by FanAutomation: its switches read the plugs back, so the
+        # scheduled update() is left out and only dropped plugs are reconnected
+        self.automated = False
+
+    def start(self):
+        """Start the event loop thread (safe to call more than once)"""
+        with self.start_lock:
+            if self.thread is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self._run_loop, daemon=True)
+            self.thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.refresh_now = asyncio.Event()
+        self.loop.create_task(self._maintain())
+        self.loop.run_forever()
+
+    async def _maintain(self):
+        """Keep the connections alive and the cached states fresh, one batch at a time
+
+        While automation drives the group, connected plugs are only re-read on
+        refresh(); the loop otherwise just reconnects plugs that dropped.
+        """
+        refresh_all = True
+        while True:
+            if refresh_all or not self.automated:
+                devices = self.devices
+            else:
+                devices = [device for device in self.devices if device.device is None]
+            await asyncio.gather(*(device.refresh() for device in devices))
+            # Come back early for a plug whose reconnect backoff ends sooner
+            retry_in = [device.retry_at - time.time() for device in self.devices if device.device is None]
+            if self.automated:
+                delay = max(0.0, min(retry_in)) if retry_in else None
+            else:
+                delay = max(0.0, min([self.refresh_interval] + retry_in))
+            try:
+                await asyncio.wait_for(self.refresh_now.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            refresh_all = self.refresh_now.is_set()
+            self.refresh_now.clear()
+
+    def refresh(self):
+        """Ask for an update() ahead of schedule"""
+        if self.loop is not None and self.refresh_now is not None:
+            self.loop.call_soon_threadsafe(self.refresh_now.set)
+
+    @property
+    def is_on(self):
+        """True if any plug is on, None while none is connected"""
+        states = [device.is_on for device in self.devices if device.is_on is not None]
+        return any(states) if states else None
+
+    def get_status(self):
+        """Cached on/off state, or None while no plug is connected"""
+        self.start()
+        return self.is_on
+
+    def device_status(self):
+        self.start()
+        return [device.status() for device in self.devices]
+
+    async def _switch_devices(self, changes):
+        results = await asyncio.gather(*(device.switch(on) for device, on in changes))
+        if any(device.device is None for device, _ in changes):
+            # Wake the loop to reconnect the plugs that just dropped
+            self.refresh_now.set()
+        return results
+
+    def switch_devices(self, changes):
+        """Switch several plugs at once from sync code
+
+        changes is a list of (device, on) pairs; returns the new state of each
+        plug, None where switching failed.
+        """
+        if not changes:
+            return []
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(self._switch_devices(changes), self.loop)
+        # Every plug is bounded by its own timeouts (switch, then update)
+        timeout = 2 * max(device.timeout for device, _ in changes) + 1
+        try:
+            return future.result(timeout)
+        except Exception as e:
+            print(f"Error switching fans {self.name}: {e!r}")
+            future.cancel()
+            self.refresh()
+            return [None] * len(changes)
+
+    def switch(self, on):
+        """Turn every plug on or off, returns the group state or None if any plug failed"""
+        results = self.switch_devices([(device, on) for device in self.devices])
+        if any(result is None for result in results):
+            return None
+        return self.is_on
+
+
+class FanClient(FanGroup):
+    """A single Kasa fan"""
+
+    def __init__(self, host, username, password, refresh_interval=REFRESH_INTERVAL_SECONDS):
+        super().__init__([FanDevice(host, username, password)], refresh_interval, name=host)
+        self.host = host
+
+
+def load_fan_groups(default_printer, host, username, password, path=FAN_CONFIG_FILE):
+    """Fan groups by printer name from fans.json, or just the FAN_HOST fan on the default printer
+
+    fans.json is a list of plugs:
+    [{"printer": "x1c-left", "host": "192.168.1.88", "on_minutes": 2, "off_minutes": 5}, ...]
+    printer defaults to the first printer, credentials to FAN_USERNAME/FAN_PASSWORD.
+    """
+    if not os.path.exists(path):
+        return {default_printer: FanClient(host, username, password)}
+    with open(path, 'r') as f:
+        entries = json.load(f)
+    devices = {}
+    for entry in entries:
+        device = FanDevice(entry['host'], entry.get('username', username), entry.get('password', password),
+                           on_minutes=entry.get('on_minutes', FAN_ON_THRESHOLD_MINUTES),
+                           off_minutes=entry.get('off_minutes', FAN_OFF_THRESHOLD_MINUTES),
+                           timeout=entry.get('timeout', COMMAND_TIMEOUT_SECONDS))
+        devices.setdefault(entry.get('printer', default_printer), []).append(device)
+    print(f"Loaded {len(entries)} fan(s) for {len(devices)} printer(s) from {path}")
+    return {printer: FanGroup(group, name=printer) for printer, group in devices.items()}
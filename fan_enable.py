@@ -10,9 +10,9 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-# Fan control thresholds (in minutes)
-FAN_ON_THRESHOLD_MINUTES = 2   # Turn fan ON when remaining time is <= 2 minutes
-FAN_OFF_THRESHOLD_MINUTES = 5  # Turn fan OFF again only after time rises above 5 minutes
+# Fan control thresholds (in minutes), shared with the queue app's in-process
+# fan automation (FAN_AUTOMATION=1), which makes this script unnecessary there
+from fan_automation import FAN_ON_THRESHOLD_MINUTES, FAN_OFF_THRESHOLD_MINUTES
 
 class FanController:
     def __init__(self, printer_hostname, printer_access_code, printer_serial, fan_host, fan_username, fan_password):
@@ -0,0 +1,318 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import bambulabs_api as bl
+
+from printer_telemetry import PrinterTelemetry
+from printer_snapshot import PrinterSnapshot, SnapshotCache
+from printer_connection import ConnectionSupervisor
+from printer_files import PrinterFileInventory
+from metrics import PRINTER_CALL_SECONDS, PRINTER_IDLE_SECONDS
+
+# Printer fleet: every printer gets its own connection supervisor, telemetry
+# and snapshot, and all of them pull jobs from one shared queue. Whichever
+# printer goes idle first claims the next eligible job.
+
+FLEET_CONFIG_FILE = os.getenv("FLEET_CONFIG", "printers.json")
+
+# Printer states that count as busy for utilization
+BUSY_STATES = ('RUNNING', 'PRINTING', 'PREPARE', 'PAUSE')
+
+# Resends of a job the printer dropped back to IDLE/FAILED on
+RESEND_MAX_ATTEMPTS = int(os.getenv("RESEND_MAX_ATTEMPTS", "5"))
+RESEND_BACKOFF_MIN_SECONDS = float(os.getenv("RESEND_BACKOFF_MIN", "30"))
+RESEND_BACKOFF_MAX_SECONDS = float(os.getenv("RESEND_BACKOFF_MAX", "600"))
+
+# How often to ask a printer whose reports went stale for a full one
+REPORT_REQUEST_SECONDS = 10
+
+
+class ResendBudget:
+    """Retry budget with exponential backoff for resending one printer's job"""
+
+    def __init__(self, max_attempts=RESEND_MAX_ATTEMPTS, backoff_min=RESEND_BACKOFF_MIN_SECONDS,
+                 backoff_max=RESEND_BACKOFF_MAX_SECONDS):
+        self.max_attempts = max_attempts
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.item_id = None
+        self.attempts = 0
+        self.next_attempt_at = 0.0
+
+    def _track(self, item_id):
+        if item_id != self.item_id:
+            self.item_id = item_id
+            self.attempts = 0
+            self.next_attempt_at = 0.0
+
+    def ready(self, item_id):
+        """True when the backoff for this job has elapsed"""
+        self._track(item_id)
+        return time.time() >= self.next_attempt_at
+
+    def exhausted(self, item_id):
+        self._track(item_id)
+        return self.attempts >= self.max_attempts
+
+    def record_attempt(self, item_id):
+        """Count a resend and push the next one out exponentially"""
+        self._track(item_id)
+        delay = min(self.backoff_min * (2 ** self.attempts), self.backoff_max)
+        self.attempts += 1
+        self.next_attempt_at = time.time() + delay
+        return delay
+
+    def reset(self):
+        """The printer picked the job up, start over for the next one"""
+        self._track(None)
+
+    def give_up(self):
+        """Start over once the job is back in the queue; returns when it may be dispatched again"""
+        self._track(None)
+        return time.time() + self.backoff_max
+
+
+class PrinterNode:
+    """One printer of the fleet with its own connection, telemetry and snapshot"""
+
+    def __init__(self, name, hostname, access_code, serial):
+        self.name = name
+        self.hostname = hostname
+        self.access_code = access_code
+        self.serial = serial
+        self.telemetry = PrinterTelemetry()
+        self.supervisor = ConnectionSupervisor(self.create_printer, hostname)
+        self.snapshots = SnapshotCache(self.fetch_snapshot)
+        # Set when this printer's state changes so its monitor loop runs right away
+        self.wakeup = threading.Event()
+        # Serializes uploads and print commands sent to this printer
+        self.command_lock = threading.Lock()
+        # Files on the printer's storage, so known files are not uploaded again
+        self.files = PrinterFileInventory(name)
+        self.resends = ResendBudget()
+        # When a full report was last requested because the pushes went stale
+        self.report_requested_at = 0
+        self.telemetry.on_state_change(self._on_state_change)
+        self.telemetry.on_update(self._on_update)
+
+        # Utilization accounting
+        self.stats_lock = threading.Lock()
+        self.observed_since = time.time()
+        self.busy_seconds = 0.0
+        self.last_state = None
+        self.last_state_at = self.observed_since
+        self.jobs_started = 0
+        self.wait_seconds_total = 0.0
+        # When the printer last went from busy to idle, for the idle-gap metric
+        self.idle_since = None
+
+    def create_printer(self):
+        """Create the printer client and subscribe to its report stream"""
+        printer = bl.Printer(self.hostname, self.access_code, self.serial)
+        self.telemetry.attach(printer)
+        return printer
+
+    @property
+    def printer(self):
+        return self.supervisor.printer
+
+    def is_ready(self):
+        return self.supervisor.is_ready()
+
+    def fetch_snapshot(self):
+        """Read state, progress and remaining time from the printer in one pass"""
+        if not self.is_ready():
+            return PrinterSnapshot(connected=False)
+        try:
+            printer = self.printer
+            if printer and printer.mqtt_client_ready():
+                if self.telemetry.updated_at and not self.telemetry.is_fresh():
+                    # Reports stopped coming, so the client's cached state is as
+                    # old as the last one: ask for a full report and leave the
+                    # state unknown until it arrives
+                    self._request_report(printer)
+                    if not self.telemetry.is_fresh():
+                        return PrinterSnapshot(connected=True)
+                with PRINTER_CALL_SECONDS.time(printer=self.name, call='get_state'):
+                    state = printer.get_state()
+                snapshot = PrinterSnapshot(
+                    connected=True,
+                    state=state,
+                    percentage=printer.get_percentage(),
+                    remaining_time=printer.get_time()
+                )
+                self.record_state(snapshot.state)
+                return snapshot
+            return PrinterSnapshot(connected=True)
+        except Exception as e:
+            print(f"Error reading printer status from {self.name}: {e}")
+            self.supervisor.mark_failed()
+            return PrinterSnapshot(connected=False)
+
+    def _request_report(self, printer):
+        if time.time() - self.report_requested_at < REPORT_REQUEST_SECONDS:
+            return
+        self.report_requested_at = time.time()
+        print(f"No report from {self.name} for {time.time() - self.telemetry.updated_at:.0f}s, requesting one")
+        try:
+            printer.mqtt_client.pushall()
+        except Exception as e:
+            print(f"Error requesting a report from {self.name}: {e}")
+
+    def _on_update(self, state, percentage, remaining_time):
+        if self.report_requested_at:
+            # First report after going stale: look again right away
+            self.report_requested_at = 0
+            self.snapshots.invalidate()
+            self.wakeup.set()
+
+    def snapshot(self, max_age=None):
+        return self.snapshots.get(max_age)
+
+    def mark_failed(self):
+        """Ask the supervisor to re-check the connection after a failed call"""
+        self.supervisor.mark_failed()
+        self.snapshots.invalidate()
+
+    def _on_state_change(self, old_state, new_state):
+        self.snapshots.invalidate()
+        self.record_state(new_state)
+        self.wakeup.set()
+
+    def record_state(self, state):
+        """Account the time spent in the previous state"""
+        state = getattr(state, 'value', state)
+        with self.stats_lock:
+            now = time.time()
+            if self.last_state in BUSY_STATES:
+                self.busy_seconds += now - self.last_state_at
+                if state not in BUSY_STATES:
+                    self.idle_since = now
+            self.last_state = state
+            self.last_state_at = now
+
+    def record_job_started(self, item):
+        """Count a dispatched job and how long it waited in the queue"""
+        with self.stats_lock:
+            self.jobs_started += 1
+            if self.idle_since is not None:
+                PRINTER_IDLE_SECONDS.observe(time.time() - self.idle_since, printer=self.name)
+                self.idle_since = None
+            try:
+                uploaded_at = datetime.fromisoformat(item['uploaded_at'])
+                self.wait_seconds_total += max(0.0, (datetime.now() - uploaded_at).total_seconds())
+            except (KeyError, TypeError, ValueError):
+                pass
+
+    def stats(self):
+        with self.stats_lock:
+            now = time.time()
+            busy = self.busy_seconds
+            if self.last_state in BUSY_STATES:
+                busy += now - self.last_state_at
+            observed = now - self.observed_since
+            return {
+                'name': self.name,
+                'hostname': self.hostname,
+                'connected': self.supervisor.ready.is_set(),
+                'state': self.last_state,
+                'utilization': busy / observed if observed > 0 else 0.0,
+                'busy_seconds': busy,
+                'observed_seconds': observed,
+                'jobs_started': self.jobs_started,
+                'avg_queue_wait_seconds': (self.wait_seconds_total / self.jobs_started
+                                           if self.jobs_started else None)
+            }
+
+
+def load_fleet(default_hostname, default_access_code, default_serial, path=FLEET_CONFIG_FILE):
+    """Build the printer registry from printers.json, or a single default printer
+
+    printers.json holds a list of {"name", "hostname", "access_code", "serial"}.
+    """
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            config = json.load(f)
+        nodes = [PrinterNode(entry.get('name', entry['hostname']), entry['hostname'],
+                             entry['access_code'], entry['serial'])
+                 for entry in config]
+        print(f"Fleet mode: {len(nodes)} printers from {path}")
+        return nodes
+    return [PrinterNode(default_hostname, default_hostname, default_access_code, default_serial)]
+
+
+class FleetDispatcher:
+    """Hands queued jobs from the shared queue to printers"""
+
+    def __init__(self, nodes, queue_model):
+        self.nodes = nodes
+        self.by_name = {node.name: node for node in nodes}
+        self.default = nodes[0]
+        self.queue_model = queue_model
+        # Optional Scheduler choosing among queued jobs; None keeps queue order
+        self.scheduler = None
+
+    def node_for(self, item):
+        """Printer a job is assigned to (older items without one belong to the default printer)"""
+        return self.by_name.get(item.get('printer'), self.default)
+
+    def is_eligible(self, item, node):
+        """Queued job that may run on this printer (respects an optional target_printer pin)"""
+        if item['status'] != 'queued':
+            return False
+        # Held back after its resends ran out or failed
+        if item.get('retry_at') and item['retry_at'] > time.time():
+            return False
+        target = item.get('target_printer')
+        return not target or target == node.name
+
+    def printing_item(self, node):
+        """The job currently marked as printing on this printer"""
+        return self.queue_model.find_first(lambda item: self.node_for(item) is node, status='printing')
+
+    def next_item(self, node, exclude=()):
+        """The job this printer takes next, skipping the ids in exclude"""
+        eligible = lambda item: self.is_eligible(item, node) and item['id'] not in exclude
+        # Pinned jobs go first, in queue order, whatever the policy
+        pinned = self.queue_model.first_pinned(eligible, status='queued')
+        if pinned is not None:
+            return pinned
+        if self.scheduler is None or self.scheduler.is_fifo():
+            # Queue order: no need to look at the whole queue
+            return self.queue_model.find_first(eligible, status='queued')
+        eligible = lambda item: (self.is_eligible(item, node) and item['id'] not in exclude
+                                 and not item.get('pinned'))
+        return self.queue_model.choose('queued', eligible, lambda items: self.scheduler.pick(node, items))
+
+    def claim_next(self, node, reason='started'):
+        """Atomically take the next eligible job for an idle printer"""
+        with self.queue_model.lock:
+            if self.printing_item(node) is not None:
+                return None
+            item = self.next_item(node)
+            if item is None:
+                return None
+            started_at = datetime.now().isoformat()
+            fields = {'status': 'printing', 'printer': node.name, 'started_at': started_at}
+            if item.get('retry_at'):
+                fields['retry_at'] = None
+            self.queue_model.update(item['id'], reason=reason, **fields)
+            item.update(status='printing', printer=node.name, started_at=started_at)
+            if self.scheduler is not None:
+                self.scheduler.note_started(node, item)
+        return item
+
+    def stats(self):
+        nodes = [node.stats() for node in self.nodes]
+        started = sum(node['jobs_started'] for node in nodes)
+        waited = sum((node['avg_queue_wait_seconds'] or 0) * node['jobs_started'] for node in nodes)
+        return {
+            'printers': nodes,
+            'fleet_utilization': (sum(node['utilization'] for node in nodes) / len(nodes)
+                                  if nodes else 0.0),
+            'jobs_started': started,
+            'avg_queue_wait_seconds': waited / started if started else None
+        }
@@ -0,0 +1,222 @@
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# Whole-queue ETA forecast.
+# Every queued job gets a projected start and finish time: the live remaining
+# time of the running prints plus the slicer estimates of the jobs ahead,
+# scaled by a correction factor learned from how long finished jobs really
+# took compared to their estimate. Jobs are laid out the way they will be
+# dispatched: whichever printer frees up first takes the job the dispatcher
+# would give it then, pinned jobs first and the scheduler's policies next.
+# Jobs the policies cannot tell apart (same estimate, filament and target
+# printer) keep their queue order, so each choice only compares the first job
+# of every such group rather than the whole queue.
+
+FORECAST_HISTORY = int(os.getenv("FORECAST_HISTORY", "50"))  # Finished jobs to learn from
+DEFAULT_JOB_SECONDS = int(os.getenv("FORECAST_DEFAULT_JOB_SECONDS", "3600"))  # Jobs without an estimate
+CORRECTION_MIN = 0.5
+CORRECTION_MAX = 3.0
+# Finished jobs this far off their estimate were cancelled or finished by hand
+OUTLIER_RATIO = 4.0
+# Every dashboard asks after each queue change; they share one layout
+FORECAST_MAX_AGE_SECONDS = 5
+
+
+def parse_time(value):
+    """Timestamp of an ISO time string, or None"""
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat(timespec='seconds')
+
+
+def learn_correction(printed_items, estimate_for, history=FORECAST_HISTORY):
+    """Ratio of real to estimated print time over the most recent finished jobs"""
+    samples = []
+    for item in printed_items:
+        started = parse_time(item.get('started_at'))
+        completed = parse_time(item.get('completed_at'))
+        estimate = estimate_for(item)
+        if started is None or completed is None or not estimate or completed <= started:
+            continue
+        actual = completed - started
+        if 1 / OUTLIER_RATIO <= actual / estimate <= OUTLIER_RATIO:
+            samples.append((completed, actual, estimate))
+    samples.sort(reverse=True)
+    samples = samples[:history]
+    if not samples:
+        return 1.0
+    ratio = sum(actual for _, actual, _ in samples) / sum(estimate for _, _, estimate in samples)
+    return min(max(ratio, CORRECTION_MIN), CORRECTION_MAX)
+
+
+class QueueForecaster:
+    """Projected start and finish times for every job in the queue"""
+
+    def __init__(self, dispatcher, queue_model, estimate_for, finished=None):
+        self.dispatcher = dispatcher
+        self.queue_model = queue_model
+        self.estimate_for = estimate_for
+        # Recent finished jobs to learn from; by default the queue's printed items
+        self.finished = finished
+        self.lock = threading.Lock()
+        # item id -> (blob or file, plate, estimate); estimates only change with the file
+        self.estimates = {}
+        # Queue layout, rebuilt only when the queue version changes
+        self.version = None
+        self.correction = 1.0
+        self.printing = []
+        self.queued = []
+        # Last forecast and when it was made
+        self.cached = None
+        self.cached_at = 0
+
+    def _estimate(self, item):
+        if 'estimated_seconds' in item:
+            # Archived jobs carry the estimate they were printed with
+            return item['estimated_seconds']
+        key = (item.get('blob') or item.get('filename'), item.get('plate'))
+        cached = self.estimates.get(item['id'])
+        if cached is None or cached[:2] != key:
+            cached = key + (self.estimate_for(item),)
+            self.estimates[item['id']] = cached
+        return cached[2]
+
+    def _refresh(self):
+        """Re-read the queue after a reorder, upload, completion or delete"""
+        with self.queue_model.lock:
+            version = self.queue_model.version
+            if version == self.version:
+                return
+            printed = [] if self.finished else self.queue_model.list_by_status('printed')
+            printing = self.queue_model.list_by_status('printing')
+            queued = self.queue_model.list_by_status('queued')
+        # Forget deleted jobs
+        live = {item['id'] for item in printed + printing + queued}
+        if self.finished:
+            printed = self.finished()
+        self.estimates = {item_id: value for item_id, value in self.estimates.items() if item_id in live}
+        self.correction = learn_correction(printed, self._estimate)
+        self.printing = [(item, self._estimate(item)) for item in printing]
+        self.queued = [(item, self._estimate(item)) for item in queued]
+        self.version = version
+
+    def _busy_until(self, node, item, estimate, now):
+        """When the job running on a printer will be done"""
+        snapshot = node.snapshot()
+        remaining = snapshot.remaining_time if snapshot.connected else None
+        if isinstance(remaining, (int, float)) and remaining > 0:
+            # The printer reports whole minutes
+            return now + remaining * 60
+        started = parse_time(item.get('started_at')) or now
+        duration = (estimate or DEFAULT_JOB_SECONDS) * self.correction
+        return max(now, started + duration)
+
+    def _dispatch_order(self, queued, free_at, correction):
+        """Yield (printer, item, estimate, start) for the queued jobs in the order they will start"""
+        scheduler = self.dispatcher.scheduler
+        fifo = scheduler is None or scheduler.is_fifo()
+        pinned = []
+        # (target printer, group key) -> jobs in queue order
+        groups = {}
+        for position, (item, estimate) in enumerate(queued):
+            entry = (position, item, estimate)
+            if item.get('pinned'):
+                pinned.append(entry)
+                continue
+            group = None if fifo else scheduler.group_key(item)
+            groups.setdefault((item.get('target_printer'), group), deque()).append(entry)
+        last_filament = dict(scheduler.last_filament) if scheduler is not None else {}
+        waiting = set(free_at)
+        while waiting:
+            name = min(waiting, key=free_at.get)
+            eligible = lambda target: not target or target == name
+            chosen = next((entry for entry in pinned if eligible(entry[1].get('target_printer'))), None)
+            if chosen is not None:
+                pinned.remove(chosen)
+            else:
+                heads = [(jobs[0], key) for key, jobs in groups.items() if eligible(key[0])]
+                if not heads:
+                    # Nothing left that this printer may take
+                    waiting.discard(name)
+                    continue
+                if fifo:
+                    rank = lambda head: head[0][0]
+                else:
+                    key = scheduler.rank(self.dispatcher.by_name[name], free_at[name], last_filament.get(name))
+                    rank = lambda head: key(head[0][1], head[0][0])
+                chosen, group = min(heads, key=rank)
+                groups[group].popleft()
+                if not groups[group]:
+                    del groups[group]
+            _, item, estimate = chosen
+            start = free_at[name]
+            free_at[name] = start + (estimate or DEFAULT_JOB_SECONDS) * correction
+            if scheduler is not None:
+                last_filament[name] = scheduler.profile(item)[1]
+            yield name, item, estimate, start
+
+    def forecast(self, now=None):
+        if now is None:
+            with self.lock:
+                cached = self.cached
+                if (cached is not None and cached['queue_version'] == self.queue_model.version
+                        and time.time() - self.cached_at < FORECAST_MAX_AGE_SECONDS):
+                    return cached
+            self.cached = self._forecast(time.time())
+            self.cached_at = time.time()
+            return self.cached
+        return self._forecast(now)
+
+    def _forecast(self, now):
+        with self.lock:
+            self._refresh()
+            correction = self.correction
+            printing = self.printing
+            queued = self.queued
+
+            # When each printer can take its next job
+            free_at = {node.name: now for node in self.dispatcher.nodes}
+            items = []
+            for item, estimate in printing:
+                node = self.dispatcher.node_for(item)
+                finish = self._busy_until(node, item, estimate, now)
+                free_at[node.name] = max(free_at[node.name], finish)
+                items.append({
+                    'id': item['id'],
+                    'printer': node.name,
+                    'start_at': format_time(parse_time(item.get('started_at')) or now),
+                    'finish_at': format_time(finish),
+                    'duration_seconds': round((estimate or DEFAULT_JOB_SECONDS) * correction),
+                    'estimated': bool(estimate)
+                })
+
+        # Queued jobs in the order and on the printers they will be dispatched to
+        for name, item, estimate, start in self._dispatch_order(queued, dict(free_at), correction):
+            duration = (estimate or DEFAULT_JOB_SECONDS) * correction
+            free_at[name] = start + duration
+            items.append({
+                'id': item['id'],
+                'printer': name,
+                'start_at': format_time(start),
+                'finish_at': format_time(start + duration),
+                'duration_seconds': round(duration),
+                'estimated': bool(estimate)
+            })
+
+        finish_all = max(free_at.values()) if items else now
+        return {
+            'generated_at': format_time(now),
+            'queue_version': self.version,
+            'correction_factor': round(correction, 3),
+            'makespan_seconds': round(finish_all - now),
+            'finish_all_at': format_time(finish_all),
+            'items': items
+        }
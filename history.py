@@ -0,0 +1,160 @@
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+# Archive of finished print jobs.
+# Printed (and deleted) jobs leave the live queue for this table, so loading
+# and rendering the queue does not grow with months of history. Pages are read
+# newest first with keyset pagination over an index on the finish time: a
+# cursor holds the (finished_at, seq) of the last row seen, so a page deep in
+# the archive costs the same as the first one.
+
+HISTORY_DB = os.getenv("HISTORY_DB", "history.db")
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+COUNT_CACHE_SECONDS = 5  # Status counts are polled by every dashboard
+
+
+def encode_cursor(finished_at, seq):
+    raw = json.dumps([finished_at, seq]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(finished_at, seq) of a cursor, raises ValueError if it is not one of ours"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        finished_at, seq = json.loads(raw)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not isinstance(finished_at, str) or not isinstance(seq, int):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return finished_at, seq
+
+
+def parse_bound(value):
+    """ISO date or datetime of a filter, normalised for comparison with finished_at"""
+    return datetime.fromisoformat(value).isoformat()
+
+
+class HistoryStore:
+    """SQLite archive of finished jobs, newest first"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS history (
+            seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+            id          TEXT NOT NULL UNIQUE,
+            finished_at TEXT NOT NULL,
+            status      TEXT NOT NULL,
+            name        TEXT NOT NULL,
+            printer     TEXT,
+            data        TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_history_finished ON history(finished_at, seq);
+        CREATE INDEX IF NOT EXISTS idx_history_status ON history(status, finished_at, seq);
+    """
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        self.counts = None
+        self.counted_at = 0
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def archive(self, items):
+        """Add finished items; an id already archived is skipped, so retries are safe
+
+        Returns how many items were added.
+        """
+        now = datetime.now().isoformat()
+        rows = [(item['id'], item.get('completed_at') or now, item['status'],
+                 item.get('original_name') or item.get('filename') or '', item.get('printer'),
+                 json.dumps(item)) for item in items]
+        conn = self._conn()
+        with self.write_lock, conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO history (id, finished_at, status, name, printer, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            added = conn.total_changes - before
+        if added:
+            self.counts = None
+        return added
+
+    def page(self, limit=HISTORY_PAGE_SIZE, cursor=None, since=None, until=None, name=None, status=None):
+        """One page of archived jobs, newest first; returns (items, next cursor or None)
+
+        since is inclusive and until exclusive (ISO dates or datetimes), name
+        matches anywhere in the file name, case-insensitively.
+        """
+        limit = max(1, min(int(limit), HISTORY_MAX_PAGE_SIZE))
+        clauses = []
+        params = []
+        if cursor:
+            clauses.append("(finished_at, seq) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        if since:
+            clauses.append("finished_at >= ?")
+            params.append(parse_bound(since))
+        if until:
+            clauses.append("finished_at < ?")
+            params.append(parse_bound(until))
+        if status:
+            clauses.append("status = ?")
+            params.append(status)
+        if name:
+            escaped = name.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            clauses.append("name LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self._conn().execute(
+            f"SELECT seq, finished_at, data FROM history {where} "
+            "ORDER BY finished_at DESC, seq DESC LIMIT ?", params + [limit + 1]).fetchall()
+        next_cursor = encode_cursor(rows[limit - 1][1], rows[limit - 1][0]) if len(rows) > limit else None
+        items = []
+        for seq, finished_at, data in rows[:limit]:
+            item = json.loads(data)
+            item['finished_at'] = finished_at
+            items.append(item)
+        return items, next_cursor
+
+    def get(self, item_id):
+        row = self._conn().execute("SELECT finished_at, data FROM history WHERE id = ?", (item_id,)).fetchone()
+        if row is None:
+            return None
+        item = json.loads(row[1])
+        item['finished_at'] = row[0]
+        return item
+
+    def recent(self, limit, status=None):
+        return self.page(limit, status=status)[0]
+
+    def count_by_status(self):
+        """Archived jobs per status, cached for a few seconds"""
+        if self.counts is None or time.time() - self.counted_at > COUNT_CACHE_SECONDS:
+            rows = self._conn().execute("SELECT status, COUNT(*) FROM history GROUP BY status").fetchall()
+            self.counts = dict(rows)
+            self.counted_at = time.time()
+        return self.counts
+
+    def close(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
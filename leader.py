@@ -0,0 +1,140 @@
+import fcntl
+import json
+import os
+import threading
+import time
+
+from printer_snapshot import PrinterSnapshot
+
+# Leader election for multi-worker deployments.
+# Every web worker campaigns for an exclusive flock() on one lock file; the
+# holder becomes the leader and owns the printer connections and monitor loops.
+# The kernel drops the lock when the leader process dies, so another worker
+# takes over within LEADER_RETRY_SECONDS. The leader publishes printer and fan
+# status to a shared file that the other workers serve the dashboard from.
+
+LEADER_LOCK_FILE = os.getenv("LEADER_LOCK_FILE", "monitor.lock")
+LEADER_RETRY_SECONDS = float(os.getenv("LEADER_RETRY_SECONDS", "2"))
+SHARED_STATUS_FILE = os.getenv("SHARED_STATUS_FILE", "printer_status.json")
+SHARED_STATUS_INTERVAL_SECONDS = 1.0
+# Followers report printers as disconnected once the leader stops publishing
+SHARED_STATUS_MAX_AGE_SECONDS = 15
+
+
+class LeaderLock:
+    """Exclusive, non-blocking flock() on a file, held until the process exits"""
+
+    def __init__(self, path=LEADER_LOCK_FILE):
+        self.path = path
+        self.fd = None
+
+    def try_acquire(self):
+        """Take the lock if nobody holds it, returns True while we hold it"""
+        if self.fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # The pid is informational only; the lock itself is what counts
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self.fd = fd
+        return True
+
+
+class LeaderElection:
+    """Campaigns for the leader lock from a background thread
+
+    on_elected() runs once, on the campaign thread, when this process wins.
+    """
+
+    def __init__(self, on_elected, lock=None, retry_seconds=LEADER_RETRY_SECONDS):
+        self.on_elected = on_elected
+        self.lock = lock or LeaderLock()
+        self.retry_seconds = retry_seconds
+        self.elected = threading.Event()
+        self.start_lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        """Start campaigning (safe to call more than once)"""
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def is_leader(self):
+        return self.elected.is_set()
+
+    def _run(self):
+        while not self.lock.try_acquire():
+            time.sleep(self.retry_seconds)
+        print(f"Process {os.getpid()} elected leader - taking over the printers")
+        self.elected.set()
+        try:
+            self.on_elected()
+        except Exception as e:
+            print(f"Error taking over as leader: {e}")
+            import traceback
+            traceback.print_exc()
+
+
+class SharedStatus:
+    """Printer and fan status written by the leader and read by every other worker"""
+
+    def __init__(self, path=SHARED_STATUS_FILE, max_age=SHARED_STATUS_MAX_AGE_SECONDS):
+        self.path = path
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.cached = None
+        self.cached_mtime = None
+
+    def publish(self, printers, fan_status, fans=None):
+        """Atomically replace the shared status (leader only)"""
+        data = {
+            'leader_pid': os.getpid(),
+            'published_at': time.time(),
+            'printers': {name: snapshot.to_dict() for name, snapshot in printers.items()},
+            'fan_status': fan_status,
+            'fans': fans or {}
+        }
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def read(self):
+        """Last published status, or None when the leader has gone quiet"""
+        with self.lock:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+                if mtime != self.cached_mtime:
+                    with open(self.path, 'r') as f:
+                        self.cached = json.load(f)
+                    self.cached_mtime = mtime
+            except (OSError, ValueError):
+                return None
+            data = self.cached
+        if time.time() - data['published_at'] > self.max_age:
+            return None
+        return data
+
+    def snapshot(self, name):
+        """PrinterSnapshot of one printer as the leader last saw it"""
+        data = self.read()
+        fields = data and data['printers'].get(name)
+        if not fields:
+            return PrinterSnapshot(connected=False)
+        return PrinterSnapshot(**fields)
+
+    def fan_status(self):
+        data = self.read()
+        return data['fan_status'] if data else None
+
+    def fans(self):
+        """Per-plug fan state by printer"""
+        data = self.read()
+        return data.get('fans', {}) if data else {}
@@ -0,0 +1,161 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Minimal Prometheus instrumentation.
+# Counters, gauges and histograms with labels, rendered in the Prometheus
+# text exposition format by render(). The metrics shared by the app's
+# modules are defined at the bottom of this file.
+
+# Latency buckets in seconds, from a cached read to a slow FTP upload
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Printer idle gaps between jobs in seconds
+IDLE_BUCKETS = (10, 30, 60, 300, 600, 1800, 3600, 7200, 14400, 28800, 86400)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self):
+        """(suffix, label values, extra labels, value) tuples"""
+        with self.lock:
+            return [('', key, (), value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for suffix, key, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} '
+                         f'{_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        super().__init__(name, help, labelnames)
+        # Optional callback returning {label values tuple: value} at scrape time
+        self.collect = collect
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self):
+        if self.collect is not None:
+            try:
+                return [('', tuple(str(v) for v in key), (), value)
+                        for key, value in self.collect().items()]
+            except Exception as e:
+                print(f"Error collecting {self.name}: {e}")
+                return []
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the with block took, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append(('_bucket', key, (('le', _format_value(float(bound))),), cumulative))
+                samples.append(('_sum', key, (), total))
+                samples.append(('_count', key, (), count))
+        return samples
+
+
+def render():
+    """All registered metrics in the Prometheus text format"""
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+# --- Metrics shared across modules ---
+
+QUEUE_OPERATION_SECONDS = Histogram(
+    'print_queue_operation_seconds', 'Latency of queue reads and writes', ['operation'])
+PRINTER_CALL_SECONDS = Histogram(
+    'printer_call_seconds', 'Latency of bambulabs_api calls', ['printer', 'call'])
+FAN_CALL_SECONDS = Histogram(
+    'fan_call_seconds', 'Latency of Kasa fan calls', ['call', 'device'])
+MONITOR_CYCLE_SECONDS = Histogram(
+    'monitor_cycle_seconds', 'Duration of one background monitor cycle', ['printer'])
+PRINTER_IDLE_SECONDS = Histogram(
+    'printer_idle_between_jobs_seconds', 'Time a printer sat idle before its next job started',
+    ['printer'], buckets=IDLE_BUCKETS)
+
+CONNECTION_ATTEMPTS = Counter(
+    'printer_connection_attempts_total', 'Printer connection attempts', ['printer', 'result'])
+RESENDS = Counter(
+    'print_resends_total', 'Print commands resent after the printer dropped a job', ['printer', 'result'])
+WEBHOOK_FAILURES = Counter(
+    'print_failure_webhooks_total', 'Print failures reported through the webhook', ['printer'])
@@ -0,0 +1,201 @@
+import atexit
+import json
+import os
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+
+# Plate metadata of sliced .3mf files.
+# A .3mf is a zip archive; only the small config members are read
+# (Metadata/model_settings.config, Metadata/slice_info.config and
+# Metadata/plate_N.json), never the mesh or G-code. Results are cached in a
+# JSON index keyed by the file's SHA-256, so each file is parsed once.
+
+METADATA_INDEX_FILE = os.getenv("METADATA_INDEX", "metadata_index.json")
+# Bump when the extracted format changes so cached entries are re-parsed
+METADATA_VERSION = 1
+METADATA_SAVE_DELAY_SECONDS = 5  # Coalesce uploads and deletes into one rewrite of the index
+
+MODEL_SETTINGS = 'Metadata/model_settings.config'
+SLICE_INFO = 'Metadata/slice_info.config'
+
+
+class InvalidProjectFile(ValueError):
+    """The upload is not a readable .3mf project"""
+
+
+def _plate_settings(element):
+    return {m.get('key'): m.get('value') for m in element.findall('metadata')}
+
+
+def _new_plate(index):
+    return {
+        'index': index,
+        'name': '',
+        'sliced': False,
+        'thumbnail': None,
+        'print_seconds': None,
+        'weight_g': None,
+        'filaments': [],
+        'objects': []
+    }
+
+
+def extract_metadata(path):
+    """Read plate count, print time and filament use per plate from a .3mf"""
+    try:
+        archive = zipfile.ZipFile(path)
+    except (zipfile.BadZipFile, OSError) as e:
+        raise InvalidProjectFile(f"Not a valid .3mf archive: {e}")
+
+    with archive:
+        names = set(archive.namelist())
+        plates = {}
+        try:
+            # Every plate of the project, sliced or not
+            if MODEL_SETTINGS in names:
+                for element in ET.fromstring(archive.read(MODEL_SETTINGS)).iter('plate'):
+                    settings = _plate_settings(element)
+                    index = int(settings['plater_id'])
+                    plate = plates.setdefault(index, _new_plate(index))
+                    plate['name'] = settings.get('plater_name') or ''
+                    plate['sliced'] = bool(settings.get('gcode_file'))
+                    plate['thumbnail'] = settings.get('thumbnail_file')
+
+            # Slicer estimates for the plates that were sliced
+            if SLICE_INFO in names:
+                for element in ET.fromstring(archive.read(SLICE_INFO)).iter('plate'):
+                    settings = _plate_settings(element)
+                    index = int(settings['index'])
+                    plate = plates.setdefault(index, _new_plate(index))
+                    plate['sliced'] = True
+                    if settings.get('prediction'):
+                        plate['print_seconds'] = int(float(settings['prediction']))
+                    if settings.get('weight'):
+                        plate['weight_g'] = float(settings['weight'])
+                    plate['filaments'] = [{
+                        'type': filament.get('type'),
+                        'color': filament.get('color'),
+                        'used_g': float(filament.get('used_g') or 0),
+                        'used_m': float(filament.get('used_m') or 0)
+                    } for filament in element.findall('filament')]
+        except (ET.ParseError, KeyError, ValueError) as e:
+            raise InvalidProjectFile(f"Unreadable plate settings: {e}")
+
+        for index, plate in plates.items():
+            if plate['thumbnail'] is None and f'Metadata/plate_{index}.png' in names:
+                plate['thumbnail'] = f'Metadata/plate_{index}.png'
+            bbox_name = f'Metadata/plate_{index}.json'
+            if bbox_name in names:
+                try:
+                    bbox = json.loads(archive.read(bbox_name))
+                    plate['objects'] = [obj.get('name') for obj in bbox.get('bbox_objects', [])]
+                except ValueError:
+                    pass
+
+    ordered = [plates[index] for index in sorted(plates)]
+    return {
+        'version': METADATA_VERSION,
+        'plate_count': len(ordered),
+        'plates': ordered
+    }
+
+
+def find_plate(metadata, plate):
+    """Plate entry for a plate number (int or str), or None"""
+    try:
+        index = int(plate)
+    except (TypeError, ValueError):
+        return None
+    for entry in metadata['plates']:
+        if entry['index'] == index:
+            return entry
+    return None
+
+
+def sliced_plates(metadata):
+    """Numbers of the plates that can be printed, as strings"""
+    return [str(entry['index']) for entry in metadata['plates'] if entry['sliced']]
+
+
+def validate_plate(metadata, plate):
+    """Error message when a plate cannot be printed from this file, else None"""
+    entry = find_plate(metadata, plate)
+    sliced = sliced_plates(metadata)
+    if entry is None:
+        return f"Plate {plate} does not exist (the file has {metadata['plate_count']} plates)"
+    if not entry['sliced']:
+        if sliced:
+            return f"Plate {plate} is not sliced (sliced plates: {', '.join(sliced)})"
+        return "The file has no sliced plates - slice and export it first"
+    return None
+
+
+class MetadataIndex:
+    """Persistent cache of extracted metadata keyed by content hash"""
+
+    def __init__(self, path=METADATA_INDEX_FILE, save_delay=METADATA_SAVE_DELAY_SECONDS):
+        self.path = path
+        self.save_delay = save_delay
+        self.lock = threading.Lock()
+        self.entries = self._load()
+        self.dirty = False
+        self.save_timer = None
+        atexit.register(self.flush)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable metadata index {self.path}: {e}")
+            return {}
+
+    def _schedule_save(self):
+        """Debounce writes: the index is rewritten once changes stop for a moment (caller holds the lock)"""
+        self.dirty = True
+        if self.save_timer is not None:
+            self.save_timer.cancel()
+        self.save_timer = threading.Timer(self.save_delay, self.flush)
+        self.save_timer.daemon = True
+        self.save_timer.start()
+
+    def flush(self):
+        """Write pending changes to the index file"""
+        with self.lock:
+            if self.save_timer is not None:
+                self.save_timer.cancel()
+                self.save_timer = None
+            if not self.dirty:
+                return
+            self.dirty = False
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(self.entries, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"Error saving metadata index: {e}")
+                self.dirty = True
+
+    def get(self, digest, path):
+        """Metadata of the file with this hash, parsing it only on first use"""
+        with self.lock:
+            entry = self.entries.get(digest)
+        if entry is not None and entry.get('version') == METADATA_VERSION:
+            return entry
+        entry = extract_metadata(path)
+        with self.lock:
+            self.entries[digest] = entry
+            self._schedule_save()
+        return entry
+
+    def forget(self, digest):
+        """Drop the entry of a file that was deleted"""
+        with self.lock:
+            if self.entries.pop(digest, None) is not None:
+                self._schedule_save()
@@ -0,0 +1,114 @@
+import random
+import threading
+import time
+
+from metrics import CONNECTION_ATTEMPTS, PRINTER_CALL_SECONDS
+
+# Background connection supervisor for a Bambu printer.
+# One thread owns the bl.Printer lifecycle: it connects, watches the MQTT
+# session and reconnects with exponential backoff and jitter. Everybody else
+# only checks the `ready` event, so no request handler ever blocks on connect.
+
+CONNECT_TIMEOUT_SECONDS = 10   # How long to wait for the first MQTT report
+HEALTH_CHECK_SECONDS = 5
+RETRY_MIN_SECONDS = 2
+RETRY_MAX_SECONDS = 120
+
+
+class ConnectionSupervisor:
+    """Keeps a printer connected from a dedicated thread"""
+
+    def __init__(self, create_printer, name):
+        self.create_printer = create_printer
+        self.name = name
+        self.printer = None
+        self.ready = threading.Event()
+        self.wakeup = threading.Event()
+        self.start_lock = threading.Lock()
+        self.thread = None
+        self.attempts = 0
+        self.last_error = None
+
+    def start(self):
+        """Start the supervisor thread (safe to call more than once)"""
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def is_ready(self):
+        """Non-blocking: True when the printer is connected and reporting"""
+        self.start()
+        return self.ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        self.start()
+        return self.ready.wait(timeout)
+
+    def mark_failed(self):
+        """Report a failed printer call; the supervisor re-checks the session right away"""
+        self.wakeup.set()
+
+    def _healthy(self):
+        try:
+            return (self.printer is not None and self.printer.mqtt_client_connected()
+                    and self.printer.mqtt_client_ready())
+        except Exception:
+            return False
+
+    def _connect(self):
+        """One connection attempt, returns True once the printer reports in"""
+        self.attempts += 1
+        if self.printer is None:
+            self.printer = self.create_printer()
+            print(f"Created new printer instance for {self.name}")
+        print(f"Attempting to connect to printer at {self.name}...")
+        with PRINTER_CALL_SECONDS.time(printer=self.name, call='connect'):
+            self.printer.connect()
+        deadline = time.time() + CONNECT_TIMEOUT_SECONDS
+        while time.time() < deadline:
+            if self._healthy():
+                return True
+            time.sleep(0.1)
+        return False
+
+    def _teardown(self):
+        printer, self.printer = self.printer, None
+        if printer is not None:
+            try:
+                printer.disconnect()
+            except Exception as e:
+                print(f"Error disconnecting from printer at {self.name}: {e}")
+
+    def _run(self):
+        backoff = RETRY_MIN_SECONDS
+        while True:
+            if self._healthy():
+                if not self.ready.is_set():
+                    print(f"Successfully connected to printer at {self.name}")
+                    self.ready.set()
+                backoff = RETRY_MIN_SECONDS
+                self.wakeup.wait(HEALTH_CHECK_SECONDS)
+                self.wakeup.clear()
+                continue
+
+            if self.ready.is_set():
+                print(f"Lost connection to printer at {self.name}")
+                self.ready.clear()
+            try:
+                # Start from a fresh client so paho does not keep a stale loop around
+                self._teardown()
+                if self._connect():
+                    CONNECTION_ATTEMPTS.inc(printer=self.name, result='connected')
+                    continue
+                CONNECTION_ATTEMPTS.inc(printer=self.name, result='not_ready')
+                self.last_error = "MQTT client not ready"
+                print(f"Failed to connect to printer at {self.name} - MQTT client not ready")
+            except Exception as e:
+                CONNECTION_ATTEMPTS.inc(printer=self.name, result='error')
+                self.last_error = str(e)
+                print(f"Error connecting to printer at {self.name}: {e}")
+            # Exponential backoff with jitter between attempts
+            delay = backoff * random.uniform(0.5, 1.5)
+            backoff = min(backoff * 2, RETRY_MAX_SECONDS)
+            time.sleep(delay)
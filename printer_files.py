@@ -0,0 +1,121 @@
+import hashlib
+import os
+import threading
+import time
+
+from metrics import PRINTER_CALL_SECONDS
+
+# Helpers for the files stored on a printer (read over its FTP server).
+# PrinterFileInventory remembers what is on a printer's storage as
+# {name: (size, sha256)} so resends and restarts do not upload a file the
+# printer already has.
+
+# Re-read the printer's listing when the inventory is older than this
+INVENTORY_MAX_AGE_SECONDS = float(os.getenv("PRINTER_FILES_TTL", "300"))
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def parse_listing(lines):
+    """Turn FTP LIST lines into {name: size}"""
+    files = {}
+    for line in lines:
+        parts = line.split(None, 8)
+        # -rw-rw-rw- 1 user group SIZE Mon DD HH:MM name
+        if len(parts) < 9 or parts[0].startswith('d'):
+            continue
+        try:
+            files[parts[8]] = int(parts[4])
+        except ValueError:
+            continue
+    return files
+
+
+def list_files(printer):
+    """Files in the root of the printer's storage as {name: size}"""
+    # The FTP client logs and swallows its own errors, returning None
+    result = printer.ftp_client.list_directory()
+    if result is None:
+        raise IOError("Could not list the printer's files")
+    _, lines = result
+    return parse_listing(lines)
+
+
+_digest_cache = {}
+_digest_lock = threading.Lock()
+
+
+def file_digest(path):
+    """SHA-256 of a local file, cached while its size and mtime do not change"""
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        digest = _digest_cache.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with _digest_lock:
+            _digest_cache[key] = digest
+    return digest
+
+
+class PrinterFileInventory:
+    """What is on one printer's storage, by name, size and content hash"""
+
+    def __init__(self, name='', max_age=INVENTORY_MAX_AGE_SECONDS):
+        self.name = name
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.files = {}
+        self.refreshed_at = 0.0
+
+    def refresh(self, printer):
+        """Re-read the printer's listing, keeping known hashes of unchanged files"""
+        listing = list_files(printer)
+        with self.lock:
+            self.files = {name: (size, self.files[name][1]
+                                 if name in self.files and self.files[name][0] == size else None)
+                          for name, size in listing.items()}
+            self.refreshed_at = time.time()
+        return listing
+
+    def is_stale(self):
+        return time.time() - self.refreshed_at > self.max_age
+
+    def invalidate(self):
+        """Force a re-read on next use, e.g. after the printer reconnected"""
+        self.refreshed_at = 0.0
+
+    def record_upload(self, name, size, digest):
+        with self.lock:
+            self.files[name] = (size, digest)
+
+    def matches(self, name, size, digest):
+        """True when the printer holds this exact file
+
+        Files only seen in the listing have no known hash and match on name and
+        size; remote names are unique per upload.
+        """
+        with self.lock:
+            entry = self.files.get(name)
+        return entry is not None and entry[0] == size and entry[1] in (None, digest)
+
+    def ensure_uploaded(self, printer, local_path, remote_name):
+        """Upload a file unless the printer already has it, returns True if it uploaded"""
+        size = os.path.getsize(local_path)
+        digest = file_digest(local_path)
+        if self.is_stale():
+            try:
+                self.refresh(printer)
+            except Exception as e:
+                print(f"Could not refresh printer file list: {e}")
+        if self.matches(remote_name, size, digest):
+            return False
+        with open(local_path, "rb") as f, PRINTER_CALL_SECONDS.time(printer=self.name, call='upload_file'):
+            result = printer.upload_file(f, remote_name)
+        if result is None:
+            raise IOError(f"Upload of {remote_name} failed")
+        self.record_upload(remote_name, size, digest)
+        return True
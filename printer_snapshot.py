@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+
+# Single-flight, TTL-cached printer status.
+# All readers (HTTP routes, SSE producer, background monitor) share one
+# PrinterSnapshot. When it expires, the first caller fetches a new one and
+# everybody else arriving meanwhile waits for that fetch instead of starting
+# their own.
+
+SNAPSHOT_TTL_SECONDS = float(os.getenv("PRINTER_SNAPSHOT_TTL", "2"))
+
+
+class PrinterSnapshot:
+    """Printer status at one point in time"""
+    __slots__ = ('connected', 'state', 'percentage', 'remaining_time', 'timestamp')
+
+    def __init__(self, connected, state=None, percentage=None, remaining_time=None, timestamp=None):
+        self.connected = connected
+        self.state = state
+        self.percentage = percentage
+        self.remaining_time = remaining_time
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    def age(self):
+        return time.time() - self.timestamp
+
+    def to_dict(self):
+        return {
+            'connected': self.connected,
+            'state': self.state,
+            'percentage': self.percentage,
+            'remaining_time': self.remaining_time,
+            'timestamp': self.timestamp
+        }
+
+
+class SnapshotCache:
+    """Caches the result of fetch() for ttl seconds, coalescing concurrent fetches"""
+
+    def __init__(self, fetch, ttl=SNAPSHOT_TTL_SECONDS):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.condition = threading.Condition()
+        self.snapshot = None
+        self.valid = False
+        self.fetching = False
+
+    def get(self, max_age=None):
+        """Return a snapshot no older than max_age (defaults to the TTL)"""
+        max_age = self.ttl if max_age is None else max_age
+        with self.condition:
+            if self.valid and self.snapshot.age() <= max_age:
+                return self.snapshot
+            if self.fetching:
+                # Someone else is already talking to the printer; wait for their result
+                while self.fetching:
+                    self.condition.wait()
+                return self.snapshot
+            self.fetching = True
+        snapshot = None
+        try:
+            snapshot = self.fetch()
+        finally:
+            with self.condition:
+                if snapshot is not None:
+                    self.snapshot = snapshot
+                    self.valid = True
+                self.fetching = False
+                self.condition.notify_all()
+        return snapshot
+
+    def peek(self):
+        """Last snapshot without fetching (may be None or stale)"""
+        return self.snapshot
+
+    def invalidate(self):
+        """Force the next get() to fetch"""
+        with self.condition:
+            self.valid = False
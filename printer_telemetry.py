@@ -0,0 +1,84 @@
+import threading
+import time
+
+# Push-driven printer telemetry.
+# Hooks into the MQTT report stream of a bambulabs_api Printer and keeps the
+# latest state in an in-process snapshot, firing callbacks whenever the printer
+# state changes. When the pushes go stale the printer node asks for a full
+# report and treats the state as unknown until one arrives.
+
+STALE_AFTER_SECONDS = 60  # The printer reports every few seconds while connected
+
+
+class PrinterTelemetry:
+    """Latest printer state as pushed over MQTT, with state-change callbacks"""
+
+    def __init__(self, stale_after=STALE_AFTER_SECONDS):
+        self.stale_after = stale_after
+        self.lock = threading.Lock()
+        self.state = None
+        self.percentage = None
+        self.remaining_time = None
+        self.updated_at = 0
+        self.callbacks = []
+        self.update_callbacks = []
+
+    def attach(self, printer):
+        """Subscribe to the report stream of a (not yet connected) printer"""
+        printer.mqtt_client.on_message_handler = self._on_message
+
+    def on_state_change(self, callback, states=None):
+        """Call callback(old_state, new_state) when the state changes (optionally only into `states`)"""
+        self.callbacks.append((callback, set(states) if states else None))
+
+    def on_update(self, callback):
+        """Call callback(state, percentage, remaining_time) for every reading"""
+        self.update_callbacks.append(callback)
+
+    def _on_message(self, mqtt_client, client, userdata, msg):
+        # Runs on the paho network thread after the report was merged into the
+        # client's data, so callbacks must stay short
+        try:
+            state = mqtt_client.get_printer_state()
+            state = getattr(state, 'value', state)
+            percentage = mqtt_client.get_last_print_percentage()
+            remaining_time = mqtt_client.get_remaining_time()
+        except Exception as e:
+            print(f"Error reading printer report: {e}")
+            return
+        self.update(state, percentage, remaining_time)
+
+    def update(self, state, percentage, remaining_time):
+        """Store a new reading and fire callbacks if the state changed"""
+        with self.lock:
+            old_state = self.state
+            self.state = state
+            self.percentage = percentage
+            self.remaining_time = remaining_time
+            self.updated_at = time.time()
+        for callback in self.update_callbacks:
+            try:
+                callback(state, percentage, remaining_time)
+            except Exception as e:
+                print(f"Error in printer update callback: {e}")
+        if state != old_state:
+            print(f"Printer state changed: {old_state} -> {state}")
+            for callback, states in self.callbacks:
+                if states is None or state in states:
+                    try:
+                        callback(old_state, state)
+                    except Exception as e:
+                        print(f"Error in printer state callback: {e}")
+
+    def is_fresh(self):
+        """Whether the last reading arrived within stale_after seconds"""
+        return time.time() - self.updated_at < self.stale_after
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'state': self.state,
+                'percentage': self.percentage,
+                'remaining_time': self.remaining_time,
+                'updated_at': self.updated_at
+            }
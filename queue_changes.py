@@ -0,0 +1,106 @@
+import uuid
+from collections import OrderedDict
+
+# Change tracking for the JSON queue API.
+# Every queue change stamps the item it touched with the queue version it
+# produced, kept in change order, so "what changed since version N" walks only
+# the changes after N instead of the whole queue. Removed items leave a
+# tombstone; once there are MAX_TOMBSTONES the oldest are dropped, and clients
+# that are older than a dropped tombstone (or than a bulk replace) get the
+# whole queue instead of a delta.
+#
+# Versions count from process start, so tokens handed to clients carry a
+# random epoch: a token from before a restart is never mistaken for one of ours.
+#
+# In multi-worker mode (shared=True) every worker writes through to the shared
+# SQLite store, and versions are the store's write counter with the database's
+# epoch instead, so any worker understands a token another one handed out. A
+# worker's token is the generation its queue includes everything up to, and
+# the changes come from the store, which keeps the generation that last wrote
+# each row and removed item: a worker's own view would miss a job changed and
+# changed back, or added and removed, between two of its loads.
+
+MAX_TOMBSTONES = 1000
+
+
+class QueueChangeLog:
+    """Version stamps of the queue's changed and removed items"""
+
+    def __init__(self, queue_model, max_tombstones=MAX_TOMBSTONES, shared=False):
+        self.queue_model = queue_model
+        self.max_tombstones = max_tombstones
+        self.shared = shared
+        self.epoch = queue_model.store.epoch() if shared else uuid.uuid4().hex[:8]
+        # Clients older than this version cannot be sent a delta
+        self.floor = self._current()
+        # item id -> version of its last change (or removal), oldest first
+        self.changed = OrderedDict()
+        self.removed = OrderedDict()
+        if not shared:
+            queue_model.listeners.append(self._on_queue_change)
+
+    def _current(self):
+        """Version the queue includes every change up to"""
+        return self.queue_model.store_generation if self.shared else self.queue_model.version
+
+    def _on_queue_change(self, kind, data):
+        # Runs under the queue lock, right after the version was bumped
+        version = self.queue_model.version
+        if kind == 'replace':
+            self.changed.clear()
+            self.removed.clear()
+            self.floor = version
+            return
+        item_id = data['item']['id'] if kind == 'add' else data['id']
+        if kind == 'remove':
+            self.changed.pop(item_id, None)
+            self.removed.pop(item_id, None)
+            self.removed[item_id] = version
+            while len(self.removed) > self.max_tombstones:
+                _, dropped = self.removed.popitem(last=False)
+                self.floor = max(self.floor, dropped)
+        else:
+            self.removed.pop(item_id, None)
+            self.changed.pop(item_id, None)
+            self.changed[item_id] = version
+
+    def token(self):
+        """Opaque name of the current queue version, also used as its ETag"""
+        return f"{self.epoch}-{self._current()}"
+
+    def _version_of(self, token):
+        epoch, _, version = (token or '').partition('-')
+        if epoch != str(self.epoch) or not version.isdigit():
+            return None
+        return int(version)
+
+    def since(self, token):
+        """Changes after the version a client last saw
+
+        Returns (items changed since, in queue order, each with the id of the
+        item behind it as 'before'; ids removed since), or None when the token
+        is unknown or too old and the client has to start over.
+        """
+        with self.queue_model.lock:
+            version = self._version_of(token)
+            if version is None or version > self._current():
+                return None
+            if self.shared:
+                delta = self.queue_model.store.changes_between(version, self._current())
+                if delta is None:
+                    return None
+                changed, removed = delta
+                return self.queue_model.items_in_order(changed), removed
+            if version < self.floor:
+                return None
+            changed = []
+            for item_id, stamp in reversed(self.changed.items()):
+                if stamp <= version:
+                    break
+                changed.append(item_id)
+            removed = []
+            for item_id, stamp in reversed(self.removed.items()):
+                if stamp <= version:
+                    break
+                removed.append(item_id)
+            return self.queue_model.items_in_order(changed), removed
@@ -0,0 +1,489 @@
+import threading
+import atexit
+
+from queue_store import POSITION_STEP
+from metrics import QUEUE_OPERATION_SECONDS
+
+# Resident, lock-guarded model of the print queue.
+# Items live in a doubly linked list with an id -> node index, so lookups,
+# removals and moves to any position (given a neighbour) are O(1). Every change
+# marks only the touched fields of the touched nodes dirty; a debounced flush
+# hands those to the store, which writes just those fields.
+# With several processes on one SQLite store (multi-worker mode), changes are
+# written through immediately and sync() reloads what other processes wrote.
+
+FLUSH_DELAY_SECONDS = 0.5  # Coalesce bursts of changes into one write
+MIN_POSITION_GAP = 1e-6    # Renumber positions once midpoints get this close
+
+# Fields with their own slot; anything else an item carries goes in `extra`
+ITEM_FIELDS = ('id', 'filename', 'original_name', 'plate', 'status', 'uploaded_at')
+SLOT_FIELDS = frozenset(ITEM_FIELDS)
+
+
+class QueueItem:
+    """Compact queue record, also a node of the ordered list"""
+    __slots__ = ITEM_FIELDS + ('extra', 'position', 'prev', 'next')
+
+    def __init__(self, data, position=0.0):
+        for field in ITEM_FIELDS:
+            setattr(self, field, data.get(field))
+        self.extra = {k: v for k, v in data.items() if k not in ITEM_FIELDS}
+        self.position = position
+        self.prev = None
+        self.next = None
+
+    def update(self, fields):
+        for key, value in fields.items():
+            if key in ITEM_FIELDS:
+                setattr(self, key, value)
+            else:
+                self.extra[key] = value
+
+    # Read access like a dict, so predicates can look at a record without copying it
+
+    def get(self, key, default=None):
+        if key in SLOT_FIELDS:
+            return getattr(self, key)
+        return self.extra.get(key, default)
+
+    def __getitem__(self, key):
+        if key in SLOT_FIELDS:
+            return getattr(self, key)
+        return self.extra[key]
+
+    def to_dict(self):
+        data = {field: getattr(self, field) for field in ITEM_FIELDS}
+        data.update(self.extra)
+        return data
+
+
+class QueueModel:
+    """In-memory queue shared by request threads and the background monitor"""
+
+    def __init__(self, store, flush_delay=FLUSH_DELAY_SECONDS):
+        self.store = store
+        # 0 writes every change through before the operation returns
+        self.flush_delay = flush_delay
+        # Re-entrant so callers can hold the lock around several operations
+        self.lock = threading.RLock()
+        self.index = {}
+        self.head = None
+        self.tail = None
+        self.status_counts = {}
+        # Ids of pinned items, so finding one does not mean walking the queue
+        self.pinned = set()
+        # item id -> names of the fields to write, or None for the whole item
+        self.dirty = {}
+        self.removed = set()
+        self.flush_timer = None
+        # Optional EventLog that every change is appended to (see event_log.py)
+        self.journal = None
+        # Bumped on every change so readers can tell whether the queue moved on
+        self.version = 0
+        # Callbacks listener(kind, data) run (under the lock) after every change
+        self.listeners = []
+        # Store write counter as of our last load or write (None: not tracked)
+        self.store_generation = None
+        self.load()
+        atexit.register(self.flush)
+
+    # --- Linked list helpers (callers hold the lock) ---
+
+    def _link_before(self, node, anchor):
+        """Insert node before anchor, or at the end when anchor is None"""
+        if anchor is None:
+            node.prev, node.next = self.tail, None
+            if self.tail:
+                self.tail.next = node
+            else:
+                self.head = node
+            self.tail = node
+        else:
+            node.prev, node.next = anchor.prev, anchor
+            if anchor.prev:
+                anchor.prev.next = node
+            else:
+                self.head = node
+            anchor.prev = node
+
+    def _unlink(self, node):
+        if node.prev:
+            node.prev.next = node.next
+        else:
+            self.head = node.next
+        if node.next:
+            node.next.prev = node.prev
+        else:
+            self.tail = node.prev
+        node.prev = node.next = None
+
+    def _place(self, node):
+        """Give a freshly linked node a position between its neighbours"""
+        low = node.prev.position if node.prev else None
+        high = node.next.position if node.next else None
+        if low is None and high is None:
+            node.position = POSITION_STEP
+        elif high is None:
+            node.position = low + POSITION_STEP
+        elif low is None:
+            node.position = high - POSITION_STEP
+        elif high - low > MIN_POSITION_GAP:
+            node.position = (low + high) / 2
+        else:
+            self._renumber()
+            return
+        self._mark(node.id, ('position',))
+
+    def _renumber(self):
+        position = POSITION_STEP
+        node = self.head
+        while node:
+            node.position = position
+            self._mark(node.id, ('position',))
+            position += POSITION_STEP
+            node = node.next
+
+    def _count(self, status, delta):
+        self.status_counts[status] = self.status_counts.get(status, 0) + delta
+        if not self.status_counts[status]:
+            del self.status_counts[status]
+
+    def _track_pin(self, node):
+        if node.extra.get('pinned'):
+            self.pinned.add(node.id)
+        else:
+            self.pinned.discard(node.id)
+
+    def _iter_nodes(self):
+        node = self.head
+        while node:
+            yield node
+            node = node.next
+
+    def _mark(self, item_id, fields=None):
+        """Remember what to write: some fields of an item, or all of it (fields None)"""
+        if fields is None:
+            self.dirty[item_id] = None
+        elif item_id not in self.dirty:
+            self.dirty[item_id] = set(fields)
+        elif self.dirty[item_id] is not None:
+            self.dirty[item_id].update(fields)
+
+    def _touch(self, node, fields=None):
+        self._mark(node.id, fields)
+        self.schedule_flush()
+
+    def _record(self, kind, **data):
+        self.version += 1
+        if self.journal is not None:
+            self.journal.record(kind, **data)
+        for listener in self.listeners:
+            try:
+                listener(kind, data)
+            except Exception as e:
+                print(f"Error in queue listener: {e}")
+
+    # --- Loading and persistence ---
+
+    def load(self):
+        """(Re)load the whole queue from the store"""
+        with self.lock:
+            # Read before loading, so a write landing in between triggers another sync
+            self.store_generation = self.store.generation()
+            self.index.clear()
+            self.head = self.tail = None
+            self.status_counts = {}
+            self.pinned = set()
+            for position, data in self.store.load_ordered():
+                node = QueueItem(data, position)
+                self.index[node.id] = node
+                self._link_before(node, None)
+                self._count(node.status, 1)
+                self._track_pin(node)
+
+    def schedule_flush(self):
+        """Debounce writes: the flush runs once the queue has been quiet for a moment"""
+        if not self.flush_delay:
+            self.flush()
+            return
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+            self.flush_timer = threading.Timer(self.flush_delay, self.flush)
+            self.flush_timer.daemon = True
+            self.flush_timer.start()
+
+    def flush(self):
+        """Write pending changes to the store"""
+        with QUEUE_OPERATION_SECONDS.time(operation='flush'), self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            if not self.dirty and not self.removed:
+                return
+            changed = [(self.index[item_id].position, self.index[item_id].to_dict(), fields)
+                       for item_id, fields in self.dirty.items() if item_id in self.index]
+            removed = list(self.removed)
+            self.dirty = {}
+            self.removed.clear()
+            try:
+                generations = self.store.apply_changes(changed, removed, self.to_list)
+                # Keep the old generation when another process wrote in between,
+                # so the next sync() picks up its changes
+                if generations is not None and generations[0] == self.store_generation:
+                    self.store_generation = generations[1]
+            except Exception as e:
+                print(f"Error saving queue: {e}")
+                # Keep the changes pending so the next flush retries them
+                for _, item, fields in changed:
+                    self._mark(item['id'], fields)
+                self.removed.update(removed)
+
+    def sync(self):
+        """Reload the queue if another process changed the store since we last saw it
+
+        Differences are recorded like local changes (reason 'external'), so the
+        journal and listeners see them. Returns True if anything changed.
+        """
+        generation = self.store.generation()
+        if generation is None or generation == self.store_generation:
+            return False
+        with QUEUE_OPERATION_SECONDS.time(operation='sync'), self.lock:
+            self.flush()
+            before = {node.id: (node.position, node.to_dict()) for node in self._iter_nodes()}
+            self.load()
+            changed = bool(before.keys() - self.index.keys())
+            for node in self._iter_nodes():
+                old = before.get(node.id)
+                item = node.to_dict()
+                if old is None:
+                    self._record('add', item=item)
+                elif old[1] != item:
+                    fields = {key: value for key, value in item.items() if old[1].get(key) != value}
+                    if item['status'] != old[1]['status']:
+                        self._record('update', id=node.id, fields=fields, reason='external',
+                                     **{'from': old[1]['status'], 'to': item['status']})
+                    else:
+                        self._record('update', id=node.id, fields=fields)
+                if old is not None and old[0] != node.position:
+                    self._record('move', id=node.id, before=node.next.id if node.next else None)
+                changed = changed or old is None or old != (node.position, item)
+            for item_id in before.keys() - self.index.keys():
+                self._record('remove', id=item_id)
+            return changed
+
+    # --- Queue operations (same interface as the queue stores) ---
+
+    def to_list(self):
+        with self.lock:
+            return [node.to_dict() for node in self._iter_nodes()]
+
+    load_all = to_list
+
+    def save_all(self, queue):
+        """Replace the whole queue"""
+        with self.lock:
+            self.removed.update(self.index)
+            self.index.clear()
+            self.head = self.tail = None
+            self.status_counts = {}
+            self.pinned = set()
+            for data in queue:
+                node = QueueItem(data)
+                self.index[node.id] = node
+                self._link_before(node, None)
+                self._count(node.status, 1)
+                self._track_pin(node)
+            self._renumber()
+            for item_id in self.index:
+                self._mark(item_id)
+            self.removed.difference_update(self.index)
+            self.schedule_flush()
+            self._record('replace', items=queue)
+
+    def get(self, item_id):
+        with self.lock:
+            node = self.index.get(item_id)
+            return node.to_dict() if node else None
+
+    def add(self, item):
+        with self.lock:
+            node = QueueItem(item)
+            self.index[node.id] = node
+            self.removed.discard(node.id)
+            self._link_before(node, None)
+            self._place(node)
+            self._count(node.status, 1)
+            self._track_pin(node)
+            self._touch(node)
+            self._record('add', item=item)
+
+    def update(self, item_id, reason=None, **fields):
+        """Update fields of one item; reason is only kept in the journal"""
+        with self.lock:
+            node = self.index.get(item_id)
+            if node is None:
+                return False
+            old_status = node.status
+            self._count(node.status, -1)
+            node.update(fields)
+            self._count(node.status, 1)
+            self._track_pin(node)
+            self._touch(node, fields)
+            if node.status != old_status:
+                self._record('update', id=item_id, fields=fields, reason=reason,
+                             **{'from': old_status, 'to': node.status})
+            else:
+                self._record('update', id=item_id, fields=fields)
+            return True
+
+    def update_where_status(self, current_status, reason=None, **fields):
+        with self.lock:
+            updated = []
+            for node in self._iter_nodes():
+                if node.status == current_status:
+                    updated.append(node)
+            for node in updated:
+                self.update(node.id, reason=reason, **fields)
+            return [node.to_dict() for node in updated]
+
+    def remove(self, item_id):
+        with self.lock:
+            node = self.index.pop(item_id, None)
+            if node is None:
+                return None
+            self._unlink(node)
+            self._count(node.status, -1)
+            self.pinned.discard(item_id)
+            self.dirty.pop(item_id, None)
+            self.removed.add(item_id)
+            self.schedule_flush()
+            self._record('remove', id=item_id)
+            return node.to_dict()
+
+    def move_before(self, item_id, anchor_id=None):
+        """Jump an item in front of another one (or to the end when anchor_id is None)"""
+        with self.lock:
+            node = self.index.get(item_id)
+            anchor = self.index.get(anchor_id) if anchor_id is not None else None
+            if node is None or node is anchor or (anchor_id is not None and anchor is None):
+                return False
+            self._unlink(node)
+            self._link_before(node, anchor)
+            self._place(node)
+            self.schedule_flush()
+            self._record('move', id=item_id, before=anchor_id)
+            return True
+
+    def move_after(self, item_id, anchor_id):
+        """Jump an item right behind another one"""
+        with self.lock:
+            anchor = self.index.get(anchor_id)
+            if anchor is None:
+                return False
+            if anchor.next is None:
+                return self.move_before(item_id, None)
+            if anchor.next.id == item_id:
+                return True
+            return self.move_before(item_id, anchor.next.id)
+
+    def swap(self, item_id, direction):
+        """Move an item one step ('up'/'down') or to either end ('top'/'bottom')"""
+        with self.lock:
+            node = self.index.get(item_id)
+            if node is None:
+                return False
+            if direction == 'up' and node.prev:
+                return self.move_before(item_id, node.prev.id)
+            if direction == 'down' and node.next:
+                return self.move_after(item_id, node.next.id)
+            if direction == 'top' and node.prev:
+                return self.move_before(item_id, self.head.id)
+            if direction == 'bottom' and node.next:
+                return self.move_before(item_id, None)
+            return False
+
+    def first_with_status(self, status):
+        with self.lock:
+            if not self.status_counts.get(status):
+                return None
+            for node in self._iter_nodes():
+                if node.status == status:
+                    return node.to_dict()
+            return None
+
+    def find_first(self, predicate, status=None):
+        """First item (in queue order) with the given status for which predicate(item) is true"""
+        with self.lock:
+            if status is not None and not self.status_counts.get(status):
+                return None
+            for node in self._iter_nodes():
+                if status is not None and node.status != status:
+                    continue
+                item = node.to_dict()
+                if predicate(item):
+                    return item
+            return None
+
+    def choose(self, status, predicate, chooser):
+        """chooser(items) over the items (in queue order) with the given status that pass predicate
+
+        The items handed to predicate and chooser are the queue's own records,
+        read through get() and [] and not to be changed; the chosen one comes
+        back as a dict, or None.
+        """
+        with self.lock:
+            if not self.status_counts.get(status):
+                return None
+            items = [node for node in self._iter_nodes() if node.status == status and predicate(node)]
+            chosen = chooser(items)
+            return chosen.to_dict() if chosen is not None else None
+
+    def first_pinned(self, predicate, status=None):
+        """First pinned item (in queue order) with the given status for which predicate(item) is true"""
+        with self.lock:
+            nodes = sorted((self.index[item_id] for item_id in self.pinned), key=lambda node: node.position)
+            for node in nodes:
+                if status is not None and node.status != status:
+                    continue
+                item = node.to_dict()
+                if predicate(item):
+                    return item
+            return None
+
+    def list_by_status(self, *statuses):
+        with self.lock:
+            return [node.to_dict() for node in self._iter_nodes() if node.status in statuses]
+
+    def page_by_status(self, statuses, offset=0, limit=None):
+        """Items with one of the statuses from the offset-th on (at most limit), and how many there are"""
+        with self.lock:
+            total = sum(self.status_counts.get(status, 0) for status in statuses)
+            items = []
+            seen = 0
+            for node in self._iter_nodes():
+                if limit is not None and len(items) >= limit:
+                    break
+                if node.status not in statuses:
+                    continue
+                if seen >= offset:
+                    items.append(node.to_dict())
+                seen += 1
+            return items, total
+
+    def position_of(self, item_id):
+        """Sort key of an item's place in the queue, or None if it is not queued"""
+        with self.lock:
+            node = self.index.get(item_id)
+            return node.position if node else None
+
+    def items_in_order(self, item_ids):
+        """The given items in queue order, each with the id of the item behind it as 'before'"""
+        with self.lock:
+            nodes = sorted((self.index[item_id] for item_id in item_ids if item_id in self.index),
+                           key=lambda node: node.position)
+            return [dict(node.to_dict(), before=node.next.id if node.next else None) for node in nodes]
+
+    def count_by_status(self):
+        with self.lock:
+            return dict(self.status_counts)
@@ -0,0 +1,437 @@
+import json
+import os
+import sqlite3
+import threading
+
+# Queue storage backends for the print queue.
+# Both backends expose the same operations so app.py does not care where the
+# queue lives. The SQLite backend keeps one row per item so single-item updates
+# and status counts no longer parse and rewrite the whole queue.
+
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "sqlite")  # "sqlite" or "json"
+JSON_FILE = 'queue.json'
+SQLITE_FILE = os.getenv("QUEUE_DB", "queue.db")
+
+# Gap left between neighbouring positions so an item can be placed between two
+# others by touching only its own row
+POSITION_STEP = 1024.0
+# Removed ids kept with the generation that removed them (see changes_between)
+MAX_REMOVED_ROWS = 1000
+
+
+class JsonQueueStore:
+    """Original storage: the whole queue kept in a single JSON file"""
+
+    def __init__(self, path=JSON_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load_all(self):
+        """Return every item in queue order"""
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def save_all(self, queue):
+        """Replace the stored queue with the given list"""
+        # Write to a temp file and rename so a crash never leaves a half-written queue
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(queue, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def load_ordered(self):
+        """Return (position, item) pairs in queue order"""
+        return [((i + 1) * POSITION_STEP, item) for i, item in enumerate(self.load_all())]
+
+    def generation(self):
+        # A single file is only ever written by one process
+        return None
+
+    def epoch(self):
+        return None
+
+    def apply_changes(self, changed, removed, snapshot):
+        """Persist a batch of changes; a single file can only be rewritten whole"""
+        with self.lock:
+            self.save_all(snapshot())
+
+    def get(self, item_id):
+        return next((item for item in self.load_all() if item['id'] == item_id), None)
+
+    def add(self, item):
+        with self.lock:
+            queue = self.load_all()
+            queue.append(item)
+            self.save_all(queue)
+
+    def update(self, item_id, **fields):
+        """Update fields of a single item, returns False if it does not exist"""
+        with self.lock:
+            queue = self.load_all()
+            for item in queue:
+                if item['id'] == item_id:
+                    item.update(fields)
+                    self.save_all(queue)
+                    return True
+        return False
+
+    def update_where_status(self, current_status, **fields):
+        """Update every item with the given status, returns the updated items"""
+        with self.lock:
+            queue = self.load_all()
+            updated = [item for item in queue if item['status'] == current_status]
+            for item in updated:
+                item.update(fields)
+            if updated:
+                self.save_all(queue)
+        return updated
+
+    def remove(self, item_id):
+        """Remove an item, returns the removed item or None"""
+        with self.lock:
+            queue = self.load_all()
+            removed = next((item for item in queue if item['id'] == item_id), None)
+            if removed:
+                self.save_all([item for item in queue if item['id'] != item_id])
+        return removed
+
+    def swap(self, item_id, direction):
+        """Swap an item with its neighbour ('up' or 'down')"""
+        with self.lock:
+            queue = self.load_all()
+            idx = next((i for i, x in enumerate(queue) if x['id'] == item_id), None)
+            if idx is None:
+                return False
+            if direction == 'up' and idx > 0:
+                queue[idx], queue[idx - 1] = queue[idx - 1], queue[idx]
+            elif direction == 'down' and idx < len(queue) - 1:
+                queue[idx], queue[idx + 1] = queue[idx + 1], queue[idx]
+            else:
+                return False
+            self.save_all(queue)
+        return True
+
+    def first_with_status(self, status):
+        return next((item for item in self.load_all() if item['status'] == status), None)
+
+    def list_by_status(self, *statuses):
+        return [item for item in self.load_all() if item['status'] in statuses]
+
+    def count_by_status(self):
+        counts = {}
+        for item in self.load_all():
+            counts[item['status']] = counts.get(item['status'], 0) + 1
+        return counts
+
+    def close(self):
+        pass
+
+
+class SqliteQueueStore:
+    """SQLite storage (WAL mode) with one row per queue item"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS queue_items (
+            id       TEXT PRIMARY KEY,
+            position   REAL NOT NULL,
+            status     TEXT NOT NULL,
+            data       TEXT NOT NULL,
+            generation INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_queue_items_position ON queue_items(position);
+        CREATE INDEX IF NOT EXISTS idx_queue_items_status ON queue_items(status, position);
+        CREATE TABLE IF NOT EXISTS queue_meta (
+            key   TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS queue_removed (
+            id         TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_queue_removed_generation ON queue_removed(generation);
+        INSERT OR IGNORE INTO queue_meta (key, value) VALUES ('generation', 0);
+        INSERT OR IGNORE INTO queue_meta (key, value) VALUES ('epoch', abs(random() % 1000000000));
+        INSERT OR IGNORE INTO queue_meta (key, value) VALUES ('removed_floor', 0);
+    """
+
+    def __init__(self, path=SQLITE_FILE):
+        self.path = path
+        # sqlite3 connections cannot be shared between threads, so every Flask
+        # request thread and the monitor thread get their own
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        # Databases from before rows carried the generation that last wrote them
+        if 'generation' not in [row[1] for row in conn.execute("PRAGMA table_info(queue_items)")]:
+            conn.execute("ALTER TABLE queue_items ADD COLUMN generation INTEGER NOT NULL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_queue_items_generation ON queue_items(generation)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def _bump(conn):
+        """Count a write (inside its transaction), returns (previous, new) generation"""
+        # One statement, so the increment happens under the write lock it takes:
+        # a separate read could see a value another process is about to bump
+        new = conn.execute("UPDATE queue_meta SET value = value + 1 WHERE key = 'generation' "
+                           "RETURNING value").fetchone()[0]
+        return new - 1, new
+
+    def generation(self):
+        """Write counter shared by every process using the database"""
+        return self._conn().execute("SELECT value FROM queue_meta WHERE key = 'generation'").fetchone()[0]
+
+    def epoch(self):
+        """Random id of the database, so generations of a recreated one are not taken for these"""
+        return self._conn().execute("SELECT value FROM queue_meta WHERE key = 'epoch'").fetchone()[0]
+
+    def changes_between(self, after, until):
+        """Ids written and ids removed by generations after..until
+
+        Every row keeps the generation that last wrote it and removed ids are
+        noted with theirs, so this covers every process's changes, including
+        items that came and went between two loads of ours. Returns None when
+        removals that old were already forgotten.
+        """
+        conn = self._conn()
+        changed = conn.execute("SELECT id FROM queue_items WHERE generation > ? AND generation <= ?",
+                               (after, until)).fetchall()
+        removed = conn.execute("SELECT id FROM queue_removed WHERE generation > ? AND generation <= ? "
+                               "ORDER BY generation", (after, until)).fetchall()
+        # Read after the rows: if older ones were pruned meanwhile, the answer is incomplete
+        floor = conn.execute("SELECT value FROM queue_meta WHERE key = 'removed_floor'").fetchone()[0]
+        if after < floor:
+            return None
+        return [row[0] for row in changed], [row[0] for row in removed]
+
+    @staticmethod
+    def _note_removed(conn, item_ids, generation):
+        """Remember removed ids (inside the removing transaction), keeping the newest MAX_REMOVED_ROWS"""
+        conn.executemany("INSERT OR REPLACE INTO queue_removed (id, generation) VALUES (?, ?)",
+                         [(item_id, generation) for item_id in item_ids])
+        row = conn.execute("SELECT generation FROM queue_removed ORDER BY generation DESC "
+                           "LIMIT 1 OFFSET ?", (MAX_REMOVED_ROWS,)).fetchone()
+        if row is not None:
+            conn.execute("DELETE FROM queue_removed WHERE generation <= ?", (row[0],))
+            conn.execute("UPDATE queue_meta SET value = max(value, ?) WHERE key = 'removed_floor'", (row[0],))
+
+    @staticmethod
+    def _row_to_item(row):
+        item = json.loads(row[0])
+        item['status'] = row[1]
+        return item
+
+    @staticmethod
+    def _item_data(item):
+        # status is duplicated into its own indexed column for counts and lookups
+        return json.dumps(item)
+
+    def load_all(self):
+        rows = self._conn().execute(
+            "SELECT data, status FROM queue_items ORDER BY position").fetchall()
+        return [self._row_to_item(row) for row in rows]
+
+    def load_ordered(self):
+        rows = self._conn().execute(
+            "SELECT position, data, status FROM queue_items ORDER BY position").fetchall()
+        return [(row[0], self._row_to_item(row[1:])) for row in rows]
+
+    def apply_changes(self, changed, removed, snapshot):
+        """Persist a batch of changes, touching only the changed and removed rows
+
+        changed is a list of (position, item, fields): fields names what changed
+        ('position' for the place in the queue), or is None for a new item that
+        is written whole. Only those fields are written into the row as it is
+        now, so another process's concurrent change to other fields survives,
+        and an item another process removed is not brought back. Returns the
+        (previous, new) generation so the caller can tell whether another
+        process wrote meanwhile.
+        """
+        conn = self._conn()
+        with self.write_lock, conn:
+            # Takes the write lock first, so the rows read below cannot change under us
+            generations = self._bump(conn)
+            if removed:
+                conn.executemany("DELETE FROM queue_items WHERE id = ?",
+                                 [(item_id,) for item_id in removed])
+                self._note_removed(conn, removed, generations[1])
+            rows = []
+            for position, item, fields in changed:
+                if fields is None:
+                    rows.append((item['id'], position, item['status'], self._item_data(item),
+                                 generations[1]))
+                    continue
+                row = conn.execute("SELECT position, data, status FROM queue_items WHERE id = ?",
+                                   (item['id'],)).fetchone()
+                if row is None:
+                    continue
+                current = self._row_to_item(row[1:])
+                current.update({field: item.get(field) for field in fields if field != 'position'})
+                rows.append((item['id'], position if 'position' in fields else row[0],
+                             current['status'], self._item_data(current), generations[1]))
+            if rows:
+                conn.executemany(
+                    "INSERT INTO queue_items (id, position, status, data, generation) "
+                    "VALUES (?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET position = excluded.position, "
+                    "status = excluded.status, data = excluded.data, generation = excluded.generation",
+                    rows)
+        return generations
+
+    def save_all(self, queue):
+        conn = self._conn()
+        with self.write_lock, conn:
+            _, generation = self._bump(conn)
+            # Everything may have changed: no list of removed ids covers it
+            conn.execute("DELETE FROM queue_removed")
+            conn.execute("UPDATE queue_meta SET value = ? WHERE key = 'removed_floor'", (generation,))
+            conn.execute("DELETE FROM queue_items")
+            conn.executemany(
+                "INSERT INTO queue_items (id, position, status, data, generation) VALUES (?, ?, ?, ?, ?)",
+                [(item['id'], (i + 1) * POSITION_STEP, item['status'], self._item_data(item), generation)
+                 for i, item in enumerate(queue)])
+
+    def get(self, item_id):
+        row = self._conn().execute(
+            "SELECT data, status FROM queue_items WHERE id = ?", (item_id,)).fetchone()
+        return self._row_to_item(row) if row else None
+
+    def add(self, item):
+        conn = self._conn()
+        with self.write_lock, conn:
+            _, generation = self._bump(conn)
+            last = conn.execute("SELECT MAX(position) FROM queue_items").fetchone()[0] or 0
+            conn.execute(
+                "INSERT INTO queue_items (id, position, status, data, generation) VALUES (?, ?, ?, ?, ?)",
+                (item['id'], last + POSITION_STEP, item['status'], self._item_data(item), generation))
+
+    def update(self, item_id, **fields):
+        conn = self._conn()
+        with self.write_lock, conn:
+            row = conn.execute(
+                "SELECT data, status FROM queue_items WHERE id = ?", (item_id,)).fetchone()
+            if row is None:
+                return False
+            item = self._row_to_item(row)
+            item.update(fields)
+            _, generation = self._bump(conn)
+            conn.execute("UPDATE queue_items SET status = ?, data = ?, generation = ? WHERE id = ?",
+                         (item['status'], self._item_data(item), generation, item_id))
+        return True
+
+    def update_where_status(self, current_status, **fields):
+        conn = self._conn()
+        with self.write_lock, conn:
+            rows = conn.execute(
+                "SELECT data, status FROM queue_items WHERE status = ? ORDER BY position",
+                (current_status,)).fetchall()
+            if rows:
+                _, generation = self._bump(conn)
+            updated = []
+            for row in rows:
+                item = self._row_to_item(row)
+                item.update(fields)
+                conn.execute("UPDATE queue_items SET status = ?, data = ?, generation = ? WHERE id = ?",
+                             (item['status'], self._item_data(item), generation, item['id']))
+                updated.append(item)
+        return updated
+
+    def remove(self, item_id):
+        conn = self._conn()
+        with self.write_lock, conn:
+            row = conn.execute(
+                "SELECT data, status FROM queue_items WHERE id = ?", (item_id,)).fetchone()
+            if row is None:
+                return None
+            self._note_removed(conn, [item_id], self._bump(conn)[1])
+            conn.execute("DELETE FROM queue_items WHERE id = ?", (item_id,))
+        return self._row_to_item(row)
+
+    def swap(self, item_id, direction):
+        conn = self._conn()
+        with self.write_lock, conn:
+            row = conn.execute("SELECT position FROM queue_items WHERE id = ?", (item_id,)).fetchone()
+            if row is None:
+                return False
+            position = row[0]
+            if direction == 'up':
+                neighbour = conn.execute(
+                    "SELECT id, position FROM queue_items WHERE position < ? "
+                    "ORDER BY position DESC LIMIT 1", (position,)).fetchone()
+            elif direction == 'down':
+                neighbour = conn.execute(
+                    "SELECT id, position FROM queue_items WHERE position > ? "
+                    "ORDER BY position LIMIT 1", (position,)).fetchone()
+            else:
+                neighbour = None
+            if neighbour is None:
+                return False
+            _, generation = self._bump(conn)
+            # Only the two swapped rows are touched
+            conn.execute("UPDATE queue_items SET position = ?, generation = ? WHERE id = ?",
+                         (neighbour[1], generation, item_id))
+            conn.execute("UPDATE queue_items SET position = ?, generation = ? WHERE id = ?",
+                         (position, generation, neighbour[0]))
+        return True
+
+    def first_with_status(self, status):
+        row = self._conn().execute(
+            "SELECT data, status FROM queue_items WHERE status = ? ORDER BY position LIMIT 1",
+            (status,)).fetchone()
+        return self._row_to_item(row) if row else None
+
+    def list_by_status(self, *statuses):
+        placeholders = ', '.join('?' for _ in statuses)
+        rows = self._conn().execute(
+            f"SELECT data, status FROM queue_items WHERE status IN ({placeholders}) "
+            "ORDER BY position", statuses).fetchall()
+        return [self._row_to_item(row) for row in rows]
+
+    def count_by_status(self):
+        rows = self._conn().execute(
+            "SELECT status, COUNT(*) FROM queue_items GROUP BY status").fetchall()
+        return dict(rows)
+
+    def is_empty(self):
+        return self._conn().execute("SELECT 1 FROM queue_items LIMIT 1").fetchone() is None
+
+    def close(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+
+def migrate_json_to_sqlite(json_path, store):
+    """One-shot import of an existing queue.json into an empty SQLite store"""
+    if not os.path.exists(json_path) or not store.is_empty():
+        return False
+    queue = JsonQueueStore(json_path).load_all()
+    store.save_all(queue)
+    # Keep the old file around but out of the way so the import never runs twice
+    os.replace(json_path, json_path + '.migrated')
+    print(f"Migrated {len(queue)} queue items from {json_path} to {store.path}")
+    return True
+
+
+def create_store(backend=QUEUE_BACKEND):
+    """Create the configured queue store, migrating queue.json on first use"""
+    if backend == 'json':
+        return JsonQueueStore(JSON_FILE)
+    if backend == 'sqlite':
+        store = SqliteQueueStore(SQLITE_FILE)
+        migrate_json_to_sqlite(JSON_FILE, store)
+        return store
+    raise ValueError(f"Unknown queue backend: {backend}")
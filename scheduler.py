@@ -0,0 +1,182 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+# Pluggable job selection.
+# By default printers take queued jobs in queue order (fifo). QUEUE_POLICY
+# picks a different order as a comma separated chain of policies, e.g.
+# "filament,sjf" groups jobs by filament and runs the shortest first within
+# a group. Every policy is a sort key; the job with the smallest key tuple
+# wins and queue position breaks ties, so one pass over the queue is enough.
+# Pinned jobs always go first, in queue order: the dispatcher takes them
+# before asking the policies.
+
+QUEUE_POLICY = os.getenv("QUEUE_POLICY", "fifo")
+# Times nobody is around to clear the bed, e.g. "22:00-07:00,12:00-13:00"
+UNATTENDED_WINDOWS = os.getenv("UNATTENDED_WINDOWS", "")
+DEFAULT_JOB_SECONDS = 3600  # Jobs without an estimate
+# (file, plate) -> (estimate, filament) entries kept before the cache starts over
+PROFILE_CACHE_SIZE = 10000
+# Policies whose key depends only on a job's estimate and filament (and the
+# printer's situation), so jobs with the same profile keep their queue order
+PROFILE_POLICIES = ('fifo', 'sjf', 'filament', 'unattended')
+
+
+class Candidate:
+    """A queued job as seen by the policies"""
+    __slots__ = ('item', 'position', 'duration', 'filament')
+
+    def __init__(self, item, position, duration, filament):
+        self.item = item
+        self.position = position
+        self.duration = duration
+        self.filament = filament
+
+
+def parse_windows(spec):
+    """Parse "HH:MM-HH:MM,..." into a list of ((h, m), (h, m))"""
+    windows = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, end = part.split('-')
+        windows.append(tuple(tuple(int(x) for x in t.strip().split(':')) for t in (start, end)))
+    return windows
+
+
+def window_bounds(windows, now):
+    """(seconds left in the current window or None, seconds until the next one or None)"""
+    current = datetime.fromtimestamp(now)
+    left = None
+    until_next = None
+    for (start_h, start_m), (end_h, end_m) in windows:
+        for day in (-1, 0, 1):
+            start = (current.replace(hour=start_h, minute=start_m, second=0, microsecond=0)
+                     + timedelta(days=day))
+            end = current.replace(hour=end_h, minute=end_m, second=0, microsecond=0) + timedelta(days=day)
+            if end <= start:
+                end += timedelta(days=1)
+            if start <= current < end:
+                seconds = (end - current).total_seconds()
+                left = seconds if left is None else max(left, seconds)
+            elif start > current:
+                seconds = (start - current).total_seconds()
+                until_next = seconds if until_next is None else min(until_next, seconds)
+    return left, until_next
+
+
+def fifo_key(candidate, context):
+    return 0
+
+
+def sjf_key(candidate, context):
+    """Shortest job first"""
+    return candidate.duration
+
+
+def filament_key(candidate, context):
+    """Keep the filament loaded on the printer to avoid swaps"""
+    last = context['last_filament']
+    return 0 if last is None or candidate.filament == last else 1
+
+
+def unattended_key(candidate, context):
+    """Save long jobs for unattended windows and fill those windows well
+
+    Inside a window the longest job that still fits wins; outside one, jobs
+    that finish before the next window starts go first.
+    """
+    left, until_next = context['window']
+    if left is not None:
+        if candidate.duration <= left:
+            return (0, -candidate.duration)
+        return (1, candidate.duration)
+    if until_next is not None and candidate.duration > until_next:
+        return (1, 0)
+    return (0, 0)
+
+
+POLICIES = {
+    'fifo': fifo_key,
+    'sjf': sjf_key,
+    'filament': filament_key,
+    'unattended': unattended_key
+}
+
+
+def register_policy(name, key):
+    """Add a policy: key(candidate, context) returns a sortable value, smaller runs first"""
+    POLICIES[name] = key
+
+
+class Scheduler:
+    """Chooses which queued job a printer takes next"""
+
+    def __init__(self, estimate_for, filament_for, policy=QUEUE_POLICY, windows=UNATTENDED_WINDOWS):
+        self.estimate_for = estimate_for
+        self.filament_for = filament_for
+        self.policy = [name.strip() for name in policy.split(',') if name.strip()] or ['fifo']
+        unknown = [name for name in self.policy if name not in POLICIES]
+        if unknown:
+            raise ValueError(f"Unknown queue policy: {', '.join(unknown)}")
+        self.windows = parse_windows(windows)
+        # printer name -> filament of the job it started last
+        self.last_filament = {}
+        # (blob or file, plate) -> (estimate, filament); they only change with the file
+        self.profiles = {}
+
+    def is_fifo(self):
+        return all(name == 'fifo' for name in self.policy)
+
+    def profile(self, item):
+        """(estimate, filament) of a job's plate, read from its file once"""
+        key = (item.get('blob') or item.get('filename'), item.get('plate'))
+        profile = self.profiles.get(key)
+        if profile is None:
+            if len(self.profiles) >= PROFILE_CACHE_SIZE:
+                self.profiles.clear()
+            profile = (self.estimate_for(item), self.filament_for(item))
+            self.profiles[key] = profile
+        return profile
+
+    def group_key(self, item):
+        """Jobs with the same group key are always taken in queue order among themselves"""
+        if all(name in PROFILE_POLICIES for name in self.policy):
+            return self.profile(item)
+        return item['id']
+
+    def note_started(self, node, item):
+        self.last_filament[node.name] = self.profile(item)[1]
+
+    def rank(self, node, now, last_filament):
+        """key(item, position) of a printer's candidates at time now; the smallest runs first"""
+        context = {
+            'node': node,
+            'last_filament': last_filament,
+            'window': window_bounds(self.windows, now)
+        }
+        keys = [POLICIES[name] for name in self.policy]
+        profile = self.profile
+
+        def key(item, position):
+            estimate, filament = profile(item)
+            candidate = Candidate(item, position, estimate or DEFAULT_JOB_SECONDS, filament)
+            return tuple([policy(candidate, context) for policy in keys]) + (position,)
+        return key
+
+    def pick(self, node, items, now=None):
+        """The job to run next out of a printer's eligible, unpinned queued jobs (in queue order)"""
+        if not items:
+            return None
+        if self.is_fifo():
+            return items[0]
+
+        key = self.rank(node, time.time() if now is None else now, self.last_filament.get(node.name))
+        best = None
+        best_key = None
+        for position, item in enumerate(items):
+            item_key = key(item, position)
+            if best_key is None or item_key < best_key:
+                best, best_key = item, item_key
+        return best
@@ -0,0 +1,158 @@
+import os
+import threading
+
+# Pre-staging of the next job.
+# While a printer is busy, the file of the next job it would take is uploaded in
+# the background. Once the upload is verified the job is marked as staged on
+# that printer, so when the current print finishes only start_print() is sent.
+# Reordering, pinning or deleting jobs drops staging that no longer matches the
+# queue. A job staged on (or being uploaded to) one printer is left out of the
+# others' choice, so busy printers stage different jobs instead of taking the
+# same one from each other. The queue listener runs under the queue lock on
+# every change, so it only re-checks a printer when the change touches its
+# staged job or a job that could now go ahead of it.
+
+# States in which the printer is busy and the next job can be staged
+STAGE_DURING_STATES = ('RUNNING', 'PRINTING', 'PAUSE')
+# Changes to these fields can change which job a printer takes next
+ORDER_FIELDS = ('status', 'pinned', 'target_printer', 'retry_at')
+
+
+class JobStager:
+    """Uploads each printer's next job while the current one prints"""
+
+    def __init__(self, dispatcher, queue_model, file_path_for, remote_name_for):
+        self.dispatcher = dispatcher
+        self.queue_model = queue_model
+        self.file_path_for = file_path_for
+        self.remote_name_for = remote_name_for
+        self.lock = threading.Lock()
+        # printer name -> id of the job currently being uploaded
+        self.in_flight = {}
+        # printer name -> id of the job staged on it
+        self.staged = {}
+        with queue_model.lock:
+            self._find_staged()
+            queue_model.listeners.append(self._on_queue_change)
+
+    def is_staged(self, item, node):
+        return item.get('staged_on') == node.name
+
+    def staged_item(self, node):
+        item = self.queue_model.get(self.staged.get(node.name))
+        if item is None or item['status'] != 'queued' or not self.is_staged(item, node):
+            return None
+        return item
+
+    def _find_staged(self):
+        """Rebuild the printer -> staged job map from the queue"""
+        self.staged = {}
+        for item in self.queue_model.list_by_status('queued'):
+            if item.get('staged_on'):
+                self.staged[item['staged_on']] = item['id']
+
+    def next_item(self, node):
+        """The job this printer would take next, leaving out jobs other printers stage"""
+        taken = {item_id for name, item_id in list(self.staged.items()) + list(self.in_flight.items())
+                 if name != node.name}
+        return self.dispatcher.next_item(node, exclude=taken)
+
+    def maybe_stage(self, node, state):
+        """Start uploading the printer's next job if it is busy and nothing is staged yet"""
+        if state not in STAGE_DURING_STATES or not node.is_ready():
+            return False
+        with self.lock:
+            if node.name in self.in_flight:
+                return False
+            item = self.next_item(node)
+            if item is None or self.is_staged(item, node):
+                return False
+            self.in_flight[node.name] = item['id']
+        thread = threading.Thread(target=self._stage, args=(node, item), daemon=True)
+        thread.start()
+        return True
+
+    def _stage(self, node, item):
+        remote_name = self.remote_name_for(item)
+        try:
+            file_path = self.file_path_for(item)
+            if not os.path.exists(file_path):
+                return
+            size = os.path.getsize(file_path)
+            print(f"Staging {item['original_name']} on {node.name} while the current print runs")
+            with node.command_lock:
+                printer = node.printer
+                node.files.ensure_uploaded(printer, file_path, remote_name)
+                # Only trust the upload once the printer lists the file with the right size
+                verified = node.files.refresh(printer).get(remote_name) == size
+            if not verified:
+                print(f"Staged upload of {item['original_name']} to {node.name} could not be verified")
+                return
+            with self.queue_model.lock:
+                # The queue may have been reordered while uploading
+                next_item = self.next_item(node)
+                if next_item is None or next_item['id'] != item['id']:
+                    print(f"Discarding staged upload of {item['original_name']} - queue changed")
+                    return
+                self.queue_model.update(item['id'], staged_on=node.name, staged_name=remote_name)
+            print(f"Staged {item['original_name']} on {node.name}")
+        except Exception as e:
+            print(f"Error staging {item['original_name']} on {node.name}: {e}")
+            node.mark_failed()
+        finally:
+            with self.lock:
+                self.in_flight.pop(node.name, None)
+
+    def _on_queue_change(self, kind, data):
+        """Drop staging that no longer belongs to the next job of its printer"""
+        if kind == 'replace':
+            self._find_staged()
+            for node in self.dispatcher.nodes:
+                if node.name in self.staged:
+                    self._check(node)
+            return
+        item_id = data['item']['id'] if kind == 'add' else data['id']
+        fields = data.get('fields') or {}
+        if 'staged_on' in fields:
+            # Our own bookkeeping (or another worker's, in multi-worker mode)
+            for name, staged_id in list(self.staged.items()):
+                if staged_id == item_id:
+                    del self.staged[name]
+            if fields['staged_on']:
+                self.staged[fields['staged_on']] = item_id
+        if not self.staged or kind == 'update' and not any(field in fields for field in ORDER_FIELDS):
+            return
+        for node in self.dispatcher.nodes:
+            staged_id = self.staged.get(node.name)
+            if staged_id is not None and self._affects(kind, data, item_id, staged_id):
+                self._check(node)
+
+    def _affects(self, kind, data, item_id, staged_id):
+        """Whether a change can make another job than the staged one go next"""
+        if item_id == staged_id:
+            return True
+        if kind == 'remove':
+            # Taking another job away never puts a different one ahead
+            return False
+        item = data['item'] if kind == 'add' else self.queue_model.get(item_id)
+        if item is None or item['status'] != 'queued':
+            return False
+        if item.get('pinned'):
+            return True
+        scheduler = self.dispatcher.scheduler
+        if scheduler is None or scheduler.is_fifo():
+            # In queue order, only a job now ahead of the staged one can replace it
+            return self.queue_model.position_of(item_id) < self.queue_model.position_of(staged_id)
+        # Other policies choose by the job itself; its place only breaks ties
+        return kind != 'move'
+
+    def _check(self, node):
+        staged = self.staged_item(node)
+        if staged is None:
+            # Started, removed or unstaged since
+            self.staged.pop(node.name, None)
+            return
+        next_item = self.next_item(node)
+        if next_item is None or next_item['id'] != staged['id']:
+            print(f"Queue reordered - {staged['original_name']} is no longer staged on {node.name}")
+            self.queue_model.update(staged['id'], staged_on=None)
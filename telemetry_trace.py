@@ -0,0 +1,118 @@
+import bisect
+import os
+import struct
+import threading
+import time
+
+# Compact binary traces of printer telemetry.
+# A trace is an 8 byte header followed by fixed-size records of
+# (timestamp, state, percentage, remaining minutes), written whenever one of
+# them changes. TraceRecorder captures a live printer's readings;
+# TracePlayer answers "what did the printer report at time t" during replay.
+
+TRACE_DIR = os.getenv("TELEMETRY_TRACE_DIR")  # Record every printer here when set
+TRACE_MAGIC = b'PQTRACE1'
+# timestamp (float64), state code (uint8), percentage (int16), remaining minutes (int32)
+RECORD = struct.Struct('<dBhi')
+STATES = ('IDLE', 'PREPARE', 'RUNNING', 'PAUSE', 'FINISH', 'FAILED', 'UNKNOWN', 'PRINTING')
+STATE_CODES = {state: code for code, state in enumerate(STATES)}
+NO_STATE = 255
+NO_VALUE = -1
+
+
+def encode(timestamp, state, percentage, remaining_time):
+    state = getattr(state, 'value', state)
+    code = NO_STATE if state is None else STATE_CODES.get(state, STATE_CODES['UNKNOWN'])
+
+    def number(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return NO_VALUE
+    return RECORD.pack(timestamp, code, number(percentage), number(remaining_time))
+
+
+def decode(data):
+    timestamp, code, percentage, remaining = RECORD.unpack(data)
+    return (timestamp,
+            None if code == NO_STATE else STATES[code],
+            None if percentage == NO_VALUE else percentage,
+            None if remaining == NO_VALUE else remaining)
+
+
+def read_trace(path):
+    """All records of a trace as (timestamp, state, percentage, remaining_time) tuples"""
+    with open(path, 'rb') as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(f"{path} is not a telemetry trace")
+        data = f.read()
+    # A torn final record from a crash is ignored
+    usable = len(data) - len(data) % RECORD.size
+    return [decode(data[i:i + RECORD.size]) for i in range(0, usable, RECORD.size)]
+
+
+def write_trace(path, records):
+    with open(path, 'wb') as f:
+        f.write(TRACE_MAGIC)
+        for record in records:
+            f.write(encode(*record))
+
+
+class TraceRecorder:
+    """Appends a printer's readings to a trace file whenever they change"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.last = None
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'ab')
+        if new_file:
+            self.file.write(TRACE_MAGIC)
+            self.file.flush()
+
+    def record(self, state, percentage, remaining_time):
+        reading = (getattr(state, 'value', state), percentage, remaining_time)
+        with self.lock:
+            if reading == self.last:
+                return
+            self.last = reading
+            self.file.write(encode(time.time(), *reading))
+            self.file.flush()
+
+    def attach(self, telemetry):
+        telemetry.on_update(self.record)
+        return self
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class TracePlayer:
+    """Printer readings of a trace looked up by (virtual) time"""
+
+    def __init__(self, records):
+        self.records = records
+        self.times = [record[0] for record in records]
+
+    @property
+    def start(self):
+        return self.times[0] if self.times else 0.0
+
+    @property
+    def end(self):
+        return self.times[-1] if self.times else 0.0
+
+    def at(self, timestamp):
+        """(state, percentage, remaining_time) in effect at timestamp"""
+        index = bisect.bisect_right(self.times, timestamp) - 1
+        if index < 0:
+            return (None, None, None)
+        return self.records[index][1:]
+
+    def change_times(self, start=None, end=None):
+        """Timestamps at which the readings change, within [start, end]"""
+        lo = 0 if start is None else bisect.bisect_left(self.times, start)
+        hi = len(self.times) if end is None else bisect.bisect_right(self.times, end)
+        return self.times[lo:hi]
@@ -0,0 +1,50 @@
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The app's modules live in the repository root, the fake printer and Kasa
+# plug in benchmarks/ (see benchmarks/fakes.py)
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+
+
+def make_item(number, status='queued', **fields):
+    item = {
+        'id': f'job-{number}',
+        'filename': f'job{number}.3mf',
+        'original_name': f'job{number}.3mf',
+        'plate': '1',
+        'status': status,
+        'uploaded_at': '2024-01-01T00:00:00'
+    }
+    item.update(fields)
+    return item
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """The app against two fake printers, in a working directory of its own
+
+    app.py configures itself when it is imported, so there is one per test run;
+    tests that use it start from an empty queue (see the queue fixture).
+    """
+    import run
+    os.chdir(tmp_path_factory.mktemp('app'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        app = run.boot_app(printers=2)
+        for node in app.printer_nodes:
+            node.supervisor.wait_ready(10)
+    return app
+
+
+@pytest.fixture
+def queue(app):
+    """The app's queue model, emptied before the test"""
+    app.save_queue([])
+    for node in app.printer_nodes:
+        node.resends.reset()
+    yield app.queue_model
+    app.save_queue([])
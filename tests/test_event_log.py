@@ -0,0 +1,74 @@
+from conftest import make_item
+from event_log import EventLog
+from queue_model import QueueModel
+from queue_store import SqliteQueueStore
+
+
+def journaled(tmp_path, flush_delay=0):
+    """A queue model on tmp_path's store with its journal attached, and the kinds of changes it saw"""
+    model = QueueModel(SqliteQueueStore(str(tmp_path / 'queue.db')), flush_delay=flush_delay)
+    kinds = []
+    model.listeners.append(lambda kind, data: kinds.append(kind))
+    log = EventLog(str(tmp_path / 'events.log'), str(tmp_path / 'snapshot.json'))
+    log.attach(model)
+    return model, log, kinds
+
+
+def make_changes(model):
+    for number in range(4):
+        model.add(make_item(number))
+    model.move_before('job-3', 'job-0')
+    model.update('job-1', reason='started', status='printing')
+    model.update('job-1', reason='failed', status='queued')
+    model.remove('job-2')
+
+
+def test_clean_restart_keeps_the_store(tmp_path):
+    model, log, _ = journaled(tmp_path)
+    make_changes(model)
+    log.close()
+    expected = model.to_list()
+
+    restarted, log, kinds = journaled(tmp_path)
+    # Nothing to replay: the store is not rewritten
+    assert 'replace' not in kinds
+    assert restarted.to_list() == expected
+    assert [entry['to'] for entry in log.timeline('job-1')] == ['queued', 'printing', 'queued']
+    assert log.failure_counts() == {'job-1': 1}
+    log.close()
+
+
+def test_replay_recovers_unflushed_changes(tmp_path, capsys):
+    model, log, _ = journaled(tmp_path, flush_delay=60)
+    model.flush()
+    make_changes(model)
+    # Crash before the debounced flush: the store misses the changes, the journal has them
+    model.flush_timer.cancel()
+    model.dirty.clear()
+    model.removed.clear()
+    log.close()
+    expected = model.to_list()
+
+    recovered, log, kinds = journaled(tmp_path)
+    assert 'Recovered queue' in capsys.readouterr().out
+    assert recovered.to_list() == expected
+    assert QueueModel(SqliteQueueStore(str(tmp_path / 'queue.db'))).to_list() == expected
+    log.close()
+
+    # Once recovered, the next start has nothing left to replay
+    _, log, kinds = journaled(tmp_path)
+    assert 'replace' not in kinds
+    log.close()
+
+
+def test_compaction_drops_timelines_of_finished_jobs(tmp_path):
+    model, log, _ = journaled(tmp_path)
+    make_changes(model)
+    with model.lock:
+        log.compact()
+    log.close()
+
+    _, log, _ = journaled(tmp_path)
+    assert log.timeline('job-2') == []
+    assert [entry['event'] for entry in log.timeline('job-3')] == ['added']
+    log.close()
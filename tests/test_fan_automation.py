@@ -0,0 +1,38 @@
+import time
+
+import fakes
+from fan_automation import FAN_MAX_SLEEP_SECONDS, FanAutomation, desired_fan_state
+from fan_client import FanDevice, FanGroup
+from printer_snapshot import PrinterSnapshot
+from printer_telemetry import PrinterTelemetry
+
+
+def test_switching_rule_has_hysteresis():
+    assert desired_fan_state('RUNNING', 2, False) is True
+    assert desired_fan_state('RUNNING', 4, True) is True
+    assert desired_fan_state('RUNNING', 4, False) is False
+    assert desired_fan_state('RUNNING', 6, True) is False
+    assert desired_fan_state('FINISH', None, True) is False
+    assert desired_fan_state('PREPARE', 1, False) is None
+
+
+def test_automation_switches_without_polling_the_plug():
+    plug = fakes.FakeKasaDevice('fan')
+    device = FanDevice('fan')
+    device.device, device.is_on = plug, False
+    group = FanGroup([device], refresh_interval=0.05)
+    reading = {'state': 'RUNNING', 'remaining_time': 30}
+    automation = FanAutomation(PrinterTelemetry(), lambda: PrinterSnapshot(True, **reading), group)
+
+    # A long way to go: nothing to switch, and no reason to look before it gets close
+    assert 0 < automation.check() <= FAN_MAX_SLEEP_SECONDS
+    time.sleep(0.5)
+    # Only the first read of the plug, however many refresh intervals passed
+    assert plug.calls == {'update': 1}
+
+    reading['remaining_time'] = 1
+    automation.check()
+    assert device.is_on is True
+    assert automation.switches == 1
+    # The switch and its read-back
+    assert plug.calls == {'update': 2, 'turn_on': 1}
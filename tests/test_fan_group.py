@@ -0,0 +1,52 @@
+import time
+
+import fakes
+from fan_client import FanDevice, FanGroup
+
+
+class BrokenPlug(fakes.FakeKasaDevice):
+    async def turn_on(self):
+        await self._call('turn_on')
+        raise ConnectionError('plug unreachable')
+
+
+def connected(host, plug):
+    device = FanDevice(host, timeout=2)
+    device.device = plug
+    device.is_on = False
+    return device
+
+
+def test_plugs_switch_concurrently():
+    devices = [connected(f'fan-{i}', fakes.FakeKasaDevice(f'fan-{i}', latency=0.2)) for i in range(4)]
+    group = FanGroup(devices)
+    group.start()
+
+    start = time.perf_counter()
+    results = group.switch_devices([(device, True) for device in devices])
+    elapsed = time.perf_counter() - start
+
+    assert results == [True] * 4
+    assert group.is_on is True
+    # turn_on and update() per plug, all plugs at once: far less than 8 calls one by one
+    assert elapsed < 1.0
+
+
+def test_broken_plug_does_not_hold_up_the_others():
+    fakes.install()
+    good = connected('good', fakes.FakeKasaDevice('good'))
+    broken = connected('broken', BrokenPlug('broken'))
+    group = FanGroup([good, broken])
+    group.start()
+
+    assert group.switch_devices([(good, True), (broken, True)]) == [True, None]
+    assert good.available()
+    assert not broken.available()
+    assert broken.last_error is not None
+
+    # The group reconnects the dropped plug once its backoff is over
+    deadline = time.time() + 5
+    while broken.device is None and time.time() < deadline:
+        time.sleep(0.05)
+    assert broken.device is not None
+    assert broken.last_error is None
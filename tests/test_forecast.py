@@ -0,0 +1,30 @@
+import contextlib
+import io
+import random
+
+import pytest
+
+from run import queue_items
+
+
+@pytest.mark.parametrize('policy', ['fifo', 'sjf', 'filament,sjf'])
+def test_forecast_follows_dispatch_order(app, queue, monkeypatch, policy):
+    monkeypatch.setattr(app.scheduler, 'policy', policy.split(','))
+    rng = random.Random(2)
+    items = queue_items(app, 80, random.Random(0))
+    for item in items:
+        item['plate'] = str(1 + rng.randrange(4))
+        if rng.random() < 0.1:
+            item['target_printer'] = 'printer-1'
+        if rng.random() < 0.05:
+            item['pinned'] = True
+    app.save_queue(items)
+
+    forecast = app.forecaster.forecast()
+    # Each printer takes the jobs the forecast gives it, in the forecast's order
+    with contextlib.redirect_stdout(io.StringIO()):
+        for entry in forecast['items'][:40]:
+            node = app.dispatcher.by_name[entry['printer']]
+            claimed = app.dispatcher.claim_next(node)
+            assert claimed['id'] == entry['id']
+            queue.update(claimed['id'], status='printed')
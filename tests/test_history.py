@@ -0,0 +1,54 @@
+import pytest
+
+from conftest import make_item
+from history import HistoryStore
+
+
+def archived(tmp_path, count):
+    history = HistoryStore(str(tmp_path / 'history.db'))
+    # Two jobs per minute, so cursors have to break ties on finish time
+    history.archive([make_item(number, status='printed' if number % 4 else 'deleted',
+                               completed_at=f'2024-01-01T10:{number // 2:02d}:00')
+                     for number in range(count)])
+    return history
+
+
+def walk(history, **filters):
+    ids, cursor = [], None
+    while True:
+        items, cursor = history.page(limit=7, cursor=cursor, **filters)
+        ids.extend(item['id'] for item in items)
+        if cursor is None:
+            return ids
+
+
+def test_cursor_pages_cover_everything_once(tmp_path):
+    history = archived(tmp_path, 50)
+    ids = walk(history)
+    assert len(ids) == len(set(ids)) == 50
+    # Newest first, later archived first among jobs finished at the same time
+    assert ids[:3] == ['job-49', 'job-48', 'job-47']
+
+
+def test_pages_do_not_shift_when_jobs_are_archived(tmp_path):
+    history = archived(tmp_path, 20)
+    first, cursor = history.page(limit=5)
+    history.archive([make_item(99, status='printed', completed_at='2024-01-01T11:00:00')])
+    second, _ = history.page(limit=5, cursor=cursor)
+    assert [item['id'] for item in second] == [f'job-{number}' for number in range(14, 9, -1)]
+
+
+def test_filters_and_archiving_twice(tmp_path):
+    history = archived(tmp_path, 20)
+    assert walk(history, status='deleted') == [f'job-{number}' for number in range(16, -1, -4)]
+    assert walk(history, since='2024-01-01T10:08:00') == [f'job-{number}' for number in range(19, 15, -1)]
+    assert walk(history, name='job1') == ['job-19', 'job-18', 'job-17', 'job-16', 'job-15', 'job-14',
+                                          'job-13', 'job-12', 'job-11', 'job-10', 'job-1']
+    # Retried archiving is a no-op
+    assert history.archive([make_item(3, status='printed')]) == 0
+    assert history.count_by_status() == {'printed': 15, 'deleted': 5}
+
+
+def test_invalid_cursor(tmp_path):
+    with pytest.raises(ValueError):
+        archived(tmp_path, 1).page(cursor='not-a-cursor')
@@ -0,0 +1,23 @@
+import os
+import threading
+
+from leader import LeaderElection, LeaderLock
+
+
+def test_one_leader_and_failover(tmp_path):
+    path = str(tmp_path / 'monitor.lock')
+    first = LeaderLock(path)
+    assert first.try_acquire()
+    # Another worker's lock on the same file (flock is per open file)
+    assert not LeaderLock(path).try_acquire()
+
+    elected = threading.Event()
+    election = LeaderElection(elected.set, lock=LeaderLock(path), retry_seconds=0.05)
+    election.start()
+    assert not elected.wait(0.3)
+    assert not election.is_leader()
+
+    # The leader dies: the kernel drops its lock and the follower takes over
+    os.close(first.fd)
+    assert elected.wait(5)
+    assert election.is_leader()
@@ -0,0 +1,105 @@
+import random
+
+from conftest import make_item
+from queue_changes import QueueChangeLog
+from queue_model import QueueModel
+from queue_store import SqliteQueueStore
+
+
+def apply_delta(client, delta):
+    """What the dashboard does with a delta (see applyQueueChanges in templates/index.html)"""
+    changed, removed = delta
+    rows = [item for item in client if item['id'] not in removed]
+    # From the back of the queue, so every item's successor is already in place
+    for item in reversed(changed):
+        rows = [row for row in rows if row['id'] != item['id']]
+        before = [index for index, row in enumerate(rows) if row['id'] == item['before']]
+        row = {key: value for key, value in item.items() if key != 'before'}
+        rows.insert(before[0] if before else len(rows), row)
+    return rows
+
+
+def random_change(model, rng, number):
+    items = model.to_list()
+    operation = rng.choice(['add', 'add', 'remove', 'move', 'update'])
+    if operation == 'add' or not items:
+        model.add(make_item(number))
+    elif operation == 'remove':
+        model.remove(rng.choice(items)['id'])
+    elif operation == 'move':
+        anchor = rng.choice(items + [None])
+        model.move_before(rng.choice(items)['id'], anchor['id'] if anchor else None)
+    else:
+        model.update(rng.choice(items)['id'], status=rng.choice(['queued', 'printing']))
+
+
+def test_deltas_follow_the_queue(tmp_path):
+    rng = random.Random(3)
+    model = QueueModel(SqliteQueueStore(str(tmp_path / 'queue.db')))
+    changes = QueueChangeLog(model)
+    client, token = model.to_list(), changes.token()
+    for number in range(400):
+        random_change(model, rng, number)
+        if rng.random() < 0.3:
+            delta = changes.since(token)
+            assert delta is not None
+            client, token = apply_delta(client, delta), changes.token()
+            assert client == model.to_list()
+
+
+def test_unknown_or_outdated_tokens_get_the_whole_queue(tmp_path):
+    model = QueueModel(SqliteQueueStore(str(tmp_path / 'queue.db')))
+    changes = QueueChangeLog(model, max_tombstones=2)
+    for number in range(5):
+        model.add(make_item(number))
+    token = changes.token()
+    assert changes.since(token) == ([], [])
+    assert changes.since('nonsense') is None
+    # A token from before a restart has another epoch
+    assert QueueChangeLog(model).since(token) is None
+
+    # Removals past the tombstone limit
+    for number in range(3):
+        model.remove(f'job-{number}')
+    assert changes.since(token) is None
+
+    token = changes.token()
+    model.save_all([make_item(9)])
+    assert changes.since(token) is None
+
+
+def test_workers_understand_each_others_tokens(tmp_path):
+    rng = random.Random(4)
+    workers = []
+    for _ in range(3):
+        # Multi-worker mode: every change is written through, versions come from the store
+        model = QueueModel(SqliteQueueStore(str(tmp_path / 'queue.db')), flush_delay=0)
+        workers.append((model, QueueChangeLog(model, shared=True)))
+    client, token = [], workers[0][1].token()
+    for number in range(300):
+        model, _ = rng.choice(workers)
+        model.sync()
+        random_change(model, rng, number)
+        # The dashboard's next poll lands on any worker
+        model, changes = rng.choice(workers)
+        model.sync()
+        delta = changes.since(token)
+        assert delta is not None
+        client, token = apply_delta(client, delta), changes.token()
+        assert client == model.to_list()
+
+
+def test_forgotten_removals_get_the_whole_queue(tmp_path, monkeypatch):
+    monkeypatch.setattr('queue_store.MAX_REMOVED_ROWS', 2)
+    model = QueueModel(SqliteQueueStore(str(tmp_path / 'queue.db')), flush_delay=0)
+    changes = QueueChangeLog(model, shared=True)
+    for number in range(4):
+        model.add(make_item(number))
+    token = changes.token()
+    model.remove('job-0')
+    recent = changes.token()
+    model.remove('job-1')
+    model.remove('job-2')
+    assert changes.since(recent) == ([], ['job-1', 'job-2'])
+    # job-0's removal was pruned
+    assert changes.since(token) is None
@@ -0,0 +1,81 @@
+import random
+
+from conftest import make_item
+from queue_model import QueueModel
+from queue_store import SqliteQueueStore
+
+
+def ids(items):
+    return [item['id'] for item in items]
+
+
+def test_moves_keep_order_and_persist(tmp_path):
+    store = SqliteQueueStore(str(tmp_path / 'queue.db'))
+    model = QueueModel(store, flush_delay=0)
+    for number in range(5):
+        model.add(make_item(number))
+
+    model.move_before('job-4', 'job-0')
+    model.move_after('job-0', 'job-2')
+    model.swap('job-1', 'top')
+    model.swap('job-3', 'up')
+    expected = ['job-1', 'job-4', 'job-2', 'job-3', 'job-0']
+    assert ids(model.to_list()) == expected
+
+    # A fresh model reads the same order back from the store
+    assert ids(QueueModel(SqliteQueueStore(str(tmp_path / 'queue.db'))).to_list()) == expected
+
+
+def test_repeated_moves_to_one_spot_renumber(tmp_path):
+    model = QueueModel(SqliteQueueStore(str(tmp_path / 'queue.db')), flush_delay=0)
+    for number in range(60):
+        model.add(make_item(number))
+    # Every move halves the gap between job-0 and job-1 until positions run out
+    for number in range(59, 1, -1):
+        model.move_after(f'job-{number}', 'job-0')
+    expected = ['job-0'] + [f'job-{number}' for number in range(2, 60)] + ['job-1']
+    assert ids(model.to_list()) == expected
+    assert ids(QueueModel(SqliteQueueStore(str(tmp_path / 'queue.db'))).to_list()) == expected
+
+
+def test_matches_a_plain_list(tmp_path):
+    rng = random.Random(1)
+    model = QueueModel(SqliteQueueStore(str(tmp_path / 'queue.db')))
+    truth = []
+    for step in range(500):
+        operation = rng.choice(['add', 'add', 'remove', 'move', 'update'])
+        if operation == 'add' or not truth:
+            item = make_item(step)
+            model.add(item)
+            truth.append(dict(item))
+        elif operation == 'remove':
+            item = truth.pop(rng.randrange(len(truth)))
+            assert model.remove(item['id'])['id'] == item['id']
+        elif operation == 'move':
+            item = truth.pop(rng.randrange(len(truth)))
+            index = rng.randrange(len(truth) + 1)
+            anchor = truth[index]['id'] if index < len(truth) else None
+            truth.insert(index, item)
+            model.move_before(item['id'], anchor)
+        else:
+            item = rng.choice(truth)
+            item['status'] = rng.choice(['queued', 'printing', 'printed'])
+            model.update(item['id'], status=item['status'])
+    assert model.to_list() == truth
+    counts = {}
+    for item in truth:
+        counts[item['status']] = counts.get(item['status'], 0) + 1
+    assert model.count_by_status() == counts
+
+    # The debounced flush writes the same queue
+    model.flush()
+    assert QueueModel(SqliteQueueStore(str(tmp_path / 'queue.db'))).to_list() == truth
+
+
+def test_page_by_status(tmp_path):
+    model = QueueModel(SqliteQueueStore(str(tmp_path / 'queue.db')), flush_delay=0)
+    for number in range(10):
+        model.add(make_item(number, status='printed' if number % 3 == 0 else 'queued'))
+    items, total = model.page_by_status(('queued',), offset=2, limit=3)
+    assert total == 6
+    assert ids(items) == ['job-4', 'job-5', 'job-7']
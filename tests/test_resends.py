@@ -0,0 +1,50 @@
+import contextlib
+import io
+import random
+import time
+
+import fakes
+from fleet import ResendBudget
+from run import queue_items
+
+
+def test_backoff_doubles_up_to_the_cap():
+    budget = ResendBudget(max_attempts=4, backoff_min=30, backoff_max=100)
+    assert [budget.record_attempt('job') for _ in range(4)] == [30, 60, 100, 100]
+    assert budget.exhausted('job')
+    # Another job starts with a fresh budget
+    assert not budget.exhausted('other')
+    assert budget.ready('other')
+
+
+def test_dropped_job_is_resent_then_held(app, queue, monkeypatch):
+    node = app.default_node
+    monkeypatch.setattr(node.resends, 'backoff_min', 0)
+    monkeypatch.setattr(node.resends, 'backoff_max', 0.5)
+    # The printer keeps dropping the job back to IDLE
+    monkeypatch.setattr(app, 'get_printer_state', lambda node=None: 'IDLE')
+    machine = fakes.SimulatedPrinter.machines[node.hostname]
+    app.save_queue(queue_items(app, 1, random.Random(2)))
+    before = machine.calls.get('start_print', 0)
+
+    def cycles(count):
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(count):
+                app.update_print_status(node)
+                if not app.is_printing_in_progress(node):
+                    app.start_next_print(node)
+
+    cycles(20)
+    # The start and every resend of the budget, then the job goes back to the queue
+    assert machine.calls.get('start_print', 0) - before == 1 + node.resends.max_attempts
+    item = queue.to_list()[0]
+    assert item['status'] == 'queued'
+    assert item['retry_at'] > time.time()
+
+    # Once the backoff is over it is started again, with a fresh budget
+    time.sleep(item['retry_at'] - time.time() + 0.05)
+    cycles(1)
+    item = queue.to_list()[0]
+    assert item['status'] == 'printing'
+    assert not item.get('retry_at')
+    assert machine.calls.get('start_print', 0) - before == 2 + node.resends.max_attempts
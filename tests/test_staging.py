@@ -0,0 +1,50 @@
+import random
+import time
+
+from run import queue_items
+
+
+def stage_cycles(app, cycles):
+    """Run the monitors' staging step on every busy printer, waiting for the uploads"""
+    for _ in range(cycles):
+        for node in app.printer_nodes:
+            app.stager.maybe_stage(node, 'RUNNING')
+        deadline = time.time() + 10
+        while app.stager.in_flight and time.time() < deadline:
+            time.sleep(0.01)
+
+
+def staged_on(queue):
+    return {item['id']: item.get('staged_on') for item in queue.to_list() if item.get('staged_on')}
+
+
+def test_busy_printers_stage_different_jobs(app, queue):
+    app.save_queue(queue_items(app, 3, random.Random(0)))
+    changes = []
+    queue.listeners.append(lambda kind, data: changes.append(data['fields']['staged_on'])
+                           if kind == 'update' and 'staged_on' in data.get('fields', {}) else None)
+    try:
+        stage_cycles(app, 8)
+    finally:
+        queue.listeners.pop()
+
+    # One upload per printer, and no job handed back and forth between them
+    assert sorted(changes) == sorted(node.name for node in app.printer_nodes)
+    first, second = [item['id'] for item in queue.to_list()[:2]]
+    assert set(staged_on(queue)) == {first, second}
+    assert sorted(staged_on(queue).values()) == sorted(node.name for node in app.printer_nodes)
+
+
+def test_staging_follows_a_deleted_job(app, queue):
+    app.save_queue(queue_items(app, 3, random.Random(1)))
+    stage_cycles(app, 2)
+    staged = staged_on(queue)
+    removed_id, printer = next(iter(staged.items()))
+
+    queue.remove(removed_id)
+    stage_cycles(app, 4)
+
+    # The printer moves on to the job nobody staged, the other keeps its own
+    third = queue.to_list()[-1]['id']
+    assert staged_on(queue) == dict({item_id: name for item_id, name in staged.items() if item_id != removed_id},
+                                    **{third: printer})
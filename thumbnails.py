@@ -0,0 +1,52 @@
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+
+# Plate previews read straight out of the .3mf archive.
+# Only the plate PNG member is read; extracted bytes are kept in a
+# size-bounded LRU cache keyed by content hash and plate, so repeat requests
+# never re-open the archive.
+
+THUMBNAIL_CACHE_BYTES = int(os.getenv("THUMBNAIL_CACHE_BYTES", str(8 * 1024 * 1024)))
+
+
+def read_thumbnail(path, member):
+    """Bytes of one PNG member of a .3mf, or None when the file or the member is missing or unreadable"""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return archive.read(member)
+    except KeyError:
+        return None
+    except (OSError, zipfile.BadZipFile) as e:
+        print(f"Cannot read thumbnail from {path}: {e}")
+        return None
+
+
+class ThumbnailCache:
+    """LRU cache of thumbnail bytes bounded by their total size"""
+
+    def __init__(self, max_bytes=THUMBNAIL_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, key, load):
+        """Cached bytes for key, calling load() on a miss"""
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                return data
+        data = load()
+        if data is not None and len(data) <= self.max_bytes:
+            with self.lock:
+                if key not in self.entries:
+                    self.entries[key] = data
+                    self.size += len(data)
+                while self.size > self.max_bytes:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return data
+
@@ -0,0 +1,20 @@
+import os
+
+# Entry point for running the dashboard under a multi-worker WSGI server, e.g.
+#
+#     gunicorn -w 4 --worker-class gthread --threads 8 -b 0.0.0.0:5001 wsgi:app
+#
+# Every worker serves the dashboard from the shared SQLite queue; one of them
+# wins the leader election and owns the printers (see leader.py). Do not use
+# gunicorn's --preload: the election has to run in the workers, not the master.
+#
+# Use threaded workers: every open dashboard holds an /events stream for as
+# long as it is open. Workers without threads answer /events with 204 and the
+# dashboards fall back to polling.
+
+os.environ.setdefault("MULTI_WORKER", "1")
+
+from app import app, election  # noqa: E402
+
+if election is not None:
+    election.start()